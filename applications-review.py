@@ -22,18 +22,17 @@ import os
 import sys
 import logging
 import pkg_resources
-import requests
 import yaml
 
 from .common import steps
+from .labkit import rawapi, readiness
 from urllib3.exceptions import InsecureRequestWarning
 from ocp import api
-from ocp.utils import OpenShift
+from .labkit.openshift import OpenShift
 from labs import labconfig
 from labs.common.userinterface import Console
 from labs.common import labtools
 from labs.grading import Default as GuidedExercise
-from kubernetes.client.exceptions import ApiException
 from .common.constants import USER_NAME, IDM_SERVER, OCP4_API, OCP4_MNG_API
 
 
@@ -76,11 +75,8 @@ class ApplicationsReview(OpenShift):
         logging.debug("{} / {}".format(SKU, sys._getframe().f_code.co_name))
         try:
             super().__init__()
-        except requests.exceptions.ConnectionError:
-            print("The Lab environment is not ready, please wait 10 minutes before trying again.")
-            sys.exit(1)
-        except ApiException:
-            print("The OpenShift cluster is not ready, please wait 5 minutes before trying again.")
+        except readiness.ClusterNotReady as e:
+            print(str(e))
             sys.exit(1)
         except Exception as e:
             print("An unknown error ocurred: " + str(e))
@@ -107,6 +103,7 @@ class ApplicationsReview(OpenShift):
                 "label": "Checking that RHACM is installed. Installing if needed",
                 "task": self.run_playbook,
                 "playbook": "ansible/common/acm_install.yaml",
+                "fail_fast": True,
                 "fatal": True
                 
             },
@@ -114,6 +111,7 @@ class ApplicationsReview(OpenShift):
                 "label": "Checking that MulticlusterHub is deployed. Deploying if needed",
                 "task": self.run_playbook,
                 "playbook": "ansible/common/acm_create_multiclusterhub.yaml",
+                "fail_fast": True,
                 "fatal": True
                 
             },
@@ -121,6 +119,7 @@ class ApplicationsReview(OpenShift):
                 "label": "Importing the managed clusters",
                 "task": self.run_playbook,
                 "playbook": "ansible/common/acm_import_cluster2.yaml",
+                "fail_fast": True,
                 "fatal": True
                 
             },
@@ -262,16 +261,17 @@ class ApplicationsReview(OpenShift):
     
     def _check_cluster_imageregistry(self, item):
         try:
-            o = self.resource_get("imageregistry.operator.openshift.io/v1", "Config", "cluster", "")
+            o = rawapi.get(self.oc_client, "imageregistry.operator.openshift.io/v1", "Config", "cluster",
+                           fields=["spec.storage.s3.bucket"])
 
             item["failed"] = False
             if not o:
                 raise GradingError("Something went really wrong.")
-            if "noobaa-review-" not in o.spec.storage.s3.bucket:
+            if o["spec.storage.s3.bucket"] is None:
+                item["failed"] = True
+                item["msgs"] = [{"text": "Image registry is not configured. Please work through the lab instructions."}]
+            elif "noobaa-review-" not in o["spec.storage.s3.bucket"]:
                 raise GradingError("Image registry is set to the wrong value.")
-        except AttributeError:
-            item["failed"] = True
-            item["msgs"] = [{"text": "Image registry is not configured. Please work through the lab instructions."}]
         except GradingError as e:
             item["failed"] = True
             item["msgs"] = [{"text": "{} Please work through the lab instructions.".format(str(e))}]
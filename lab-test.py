@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+# lab-test.py version 0.1.0
+# Streaming companion of 'lab-test.sh'
+# BSD 3-clause license
+
+"""
+Run the lab verbs for every lab in 'labs.txt' and record compact JSON events.
+
+Unlike 'lab-test.sh', the verbs do not run under 'script': there is no
+pseudo-TTY, so no spinner frames or terminal escapes reach the logs.
+The console output of each verb is parsed into events, one JSON object per
+line, written to a rotating log:
+
+    {"ts": ..., "lab": "review-cr1", "verb": "start", "event": "step_end",
+     "label": "Checking lab systems", "status": "SUCCESS", "duration": 0.13}
+
+The 'oc get' inspection snapshots go to separate gzip'd files, and the
+cluster status printed by the 'labkit.health' module of the lab package
+is saved before and after the run.
+Post-run analysis is then a query, for example:
+
+    zcat -f logs/events.jsonl* | jq 'select(.status == "FAIL")'
+
+The events depend on the console format of the 'lab' command. A verb
+whose output has no status line at all emits a 'parse_error' event and
+counts as failed, so a change of that format cannot pass unnoticed.
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import logging
+import argparse
+import subprocess
+
+from logging.handlers import RotatingFileHandler
+
+
+# Course SKU, only used to name the log directory
+SKU = os.environ.get("LAB_SKU", "DO316")
+
+# Terminal escape sequences and spinner frames printed by the lab console
+ANSI_RE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+SPINNER_RE = re.compile(r"^ {1,4}[-\\|/] {2,}(?P<label>\S.*)$")
+STATUS_RE = re.compile(r"^(?P<status>SUCCESS|PASS|FAIL|ERROR|WARNING|SKIPPED)\s+(?P<label>\S.*)$")
+MESSAGE_RE = re.compile(r"^\s{5,}-\s(?P<text>\S.*)$")
+HEADER_RE = re.compile(r"^(Starting|Grading|Finishing|Fixing) lab\.$")
+
+# Snapshots taken after every verb and around the whole run
+SNAPSHOT_AFTER_VERB = ["get", "vm,vmi,dv", "-A", "-o", "json"]
+SNAPSHOT_PROJECTS = ["get", "projects", "-o", "name"]
+
+events = logging.getLogger("lab-test.events")
+
+
+def emit(**event):
+    event["ts"] = round(time.time(), 3)
+    events.info(json.dumps(event, sort_keys=True))
+
+
+def read_labs(path):
+    """
+    Return the lab names from a 'labs.txt' file, skipping comments.
+    """
+    with open(path) as f:
+        return [
+            line.strip() for line in f
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+
+
+def clean_lines(stream):
+    """
+    Yield the console lines without terminal escapes.
+    Carriage returns separate spinner frames, so they also end a line.
+    """
+    buffer = ""
+    for chunk in iter(lambda: stream.read1(4096) if hasattr(stream, "read1") else stream.read(4096), b""):
+        buffer += ANSI_RE.sub("", chunk.decode("utf-8", "replace"))
+        *lines, buffer = re.split(r"[\r\n]", buffer)
+        for line in lines:
+            if line.strip():
+                yield line.rstrip()
+    if buffer.strip():
+        yield buffer.rstrip()
+
+
+def run_verb(lab, verb, env):
+    """
+    Run one lab verb and emit its events. Returns the exit code.
+    """
+    context = {"lab": lab, "verb": verb}
+    emit(event="verb_start", **context)
+    start = time.time()
+    step, step_start, last_step = None, None, None
+    statuses = 0
+    proc = subprocess.Popen(
+        ["lab", verb, lab],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env=env,
+    )
+    for line in clean_lines(proc.stdout):
+        m = MESSAGE_RE.match(line)
+        if m:
+            emit(event="message", text=m.group("text"), step=step or last_step, **context)
+            continue
+        m = SPINNER_RE.match(line)
+        if m:
+            if m.group("label") != step:
+                step, step_start = m.group("label"), time.time()
+                emit(event="step_start", label=step, **context)
+            continue
+        m = STATUS_RE.match(line)
+        if m:
+            label = m.group("label")
+            began = step_start if label == step else None
+            emit(
+                event="step_end", label=label, status=m.group("status"),
+                duration=round(time.time() - began, 3) if began else None,
+                **context
+            )
+            step, step_start, last_step = None, None, label
+            statuses += 1
+            continue
+        if HEADER_RE.match(line.strip()):
+            continue
+        emit(event="message", text=line.strip(), step=step or last_step, **context)
+    rc = proc.wait()
+    if not statuses:
+        logging.error("No step status found in the output of 'lab {} {}'".format(verb, lab))
+        emit(event="parse_error", text="no step status line matched", **context)
+        rc = rc or 1
+    emit(event="verb_end", rc=rc, duration=round(time.time() - start, 3), **context)
+    return rc
+
+
+def snapshot(path, args):
+    """
+    Save the output of an 'oc' command to a gzip'd file.
+    """
+    with gzip.open(path, "wb") as f:
+        result = subprocess.run(["oc"] + args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        f.write(result.stdout)
+    return result.returncode
+
+
+def cluster_status(path, python, package):
+    """
+    Save the cluster status printed by 'health --detail' to a file.
+    """
+    with open(path, "wb") as f:
+        result = subprocess.run(
+            [python, "-m", "{}.labkit.health".format(package), "--detail"],
+            stdout=f, stderr=subprocess.STDOUT,
+        )
+    if result.returncode != 0:
+        logging.error("Cannot read the cluster status, see {}".format(path))
+    return result.returncode
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the lab scripts and record JSON events")
+    parser.add_argument("--labs", default="labs.txt", help="file with the lab names, in order")
+    parser.add_argument("--sku", default=SKU, help="course SKU, names the log directory")
+    parser.add_argument("--log-dir", default=None)
+    parser.add_argument("--python", default=os.path.expanduser("~/.venv/labs/bin/python"),
+                        help="Python interpreter of the lab package")
+    parser.add_argument("--verbs", default="start,fix,grade,finish")
+    parser.add_argument("--no-grade", action="store_true")
+    parser.add_argument("--sleep", type=int, default=15, help="seconds between verbs")
+    parser.add_argument("--max-bytes", type=int, default=10 * 1024 * 1024)
+    parser.add_argument("--backups", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    log_dir = args.log_dir or "./{}-logs-{}".format(args.sku, time.strftime("%Y-%m-%d_%H-%M"))
+    snapshot_dir = os.path.join(log_dir, "snapshots")
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    handler = RotatingFileHandler(
+        os.path.join(log_dir, "events.jsonl"),
+        maxBytes=args.max_bytes, backupCount=args.backups,
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    events.addHandler(handler)
+    events.setLevel(logging.INFO)
+    events.propagate = False
+
+    # Plain output without colors or spinner from the lab console
+    env = dict(os.environ, TERM="dumb", NO_COLOR="1", PYTHONUNBUFFERED="1")
+
+    labs = read_labs(args.labs)
+    verbs = args.verbs.split(",")
+    emit(event="run_start", labs=labs, verbs=verbs)
+    snapshot(os.path.join(snapshot_dir, "_projects.before.txt.gz"), SNAPSHOT_PROJECTS)
+    cluster_status(os.path.join(log_dir, "_00-cluster-status.before.txt"), args.python, args.sku.lower())
+
+    failed = 0
+    for lab in labs:
+        for verb in verbs:
+            # The 'grade' verb only applies to labs and comprehensive reviews
+            if verb == "grade" and (args.no_grade or "review" not in lab):
+                continue
+            if run_verb(lab, verb, env) != 0:
+                failed += 1
+            snapshot(
+                os.path.join(snapshot_dir, "{}.{}.vm-vmi-dv.json.gz".format(lab, verb)),
+                SNAPSHOT_AFTER_VERB,
+            )
+            time.sleep(args.sleep)
+
+    snapshot(os.path.join(snapshot_dir, "_projects.after.txt.gz"), SNAPSHOT_PROJECTS)
+    cluster_status(os.path.join(log_dir, "_00-cluster-status.after.txt"), args.python, args.sku.lower())
+    emit(event="run_end", failed=failed)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
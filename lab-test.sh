@@ -176,6 +176,12 @@ function cluster_login()
 
 function cluster_status()
 {
+  # The health module of the lab package reads the cluster in a few
+  # requests, the 'oc' commands below are only used by older packages
+  if "${VENV_PYTHON}" -m "${SKU_LOWER}.labkit.health" --detail
+  then
+    return
+  fi
   oc version
   oc get nodes
   oc get ClusterVersion
@@ -0,0 +1,9 @@
+"""
+Shared helpers of the lab scripts
+
+The package ships inside the course package, next to the lab scripts,
+which import it with ``from .labkit import ...``. It is not named
+``common``: in DO316, ``<course>.common`` is the flat ``common.py``
+module of the course, and in DO480 it is the package of ``steps`` and
+``constants``.
+"""
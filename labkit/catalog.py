@@ -0,0 +1,336 @@
+"""
+Index of the operator catalogs
+
+The index maps each package to its catalog, its default channel and the
+current CSV of every channel. It is built from one list of the
+CatalogSources, one list of their registry pods and one list of the
+PackageManifests, then saved to disk.
+
+The index is keyed by the ``status.connectionState`` of every
+CatalogSource and the image digest its registry pod runs. As long as no
+catalog changes state or image, the next verb loads the index from disk
+and answers the subscription queries in memory, without listing the
+PackageManifests again.
+
+An index is only kept once the catalog sources a lab subscribes from are
+READY, as ``health`` judges them; another catalog that is not ready does
+not keep the lab from reusing the index.
+
+    python -m <course>.labkit.catalog
+    python -m <course>.labkit.catalog resolve kubevirt-hyperconverged stable
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import tempfile
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from . import rawapi, readiness
+
+
+CATALOG_NAMESPACE = "openshift-marketplace"
+
+CACHE_FILE = os.path.expanduser("~/.cache/labs/catalog.json")
+
+# Label of the registry pod of a CatalogSource
+SOURCE_LABEL = "olm.catalogSource"
+
+# Seconds to wait for the catalogs to offer the packages
+CATALOG_TIMEOUT = 5 * 60
+
+
+class Subscription(NamedTuple):
+    """
+    What a Subscription asks the catalogs for. Without a source, the
+    package must be offered by a single catalog.
+    """
+    package: str
+    channel: Optional[str] = None
+    source: Optional[str] = None
+
+
+def subscription(operator: Dict, package: str) -> Subscription:
+    """
+    Return the Subscription of an operator from the ``OPERATORS`` of the
+    course, which names its ``package``, ``channel`` and ``source`` like
+    the Subscription spec does.
+    """
+    return Subscription(operator.get("package", package), operator.get("channel"),
+                        operator.get("source"))
+
+
+def sources_of(subscriptions: List[Subscription]) -> List[str]:
+    """
+    Return the catalog sources the subscriptions install from.
+    """
+    return sorted({s.source for s in subscriptions if s.source})
+
+
+class CatalogIndex:
+    """
+    The catalog sources and the packages they offer.
+
+    ``sources`` is {name: {"state": ..., "image": ..., "digest": ...}} and
+    ``packages`` is {package: {catalog: {"default": channel,
+    "channels": {channel: csv}}}}.
+    """
+
+    def __init__(self, key: str, sources: Dict[str, Dict], packages: Dict[str, Dict]):
+        self.key = key
+        self.sources = sources
+        self.packages = packages
+
+    def ready(self, sources: Optional[List[str]] = None) -> bool:
+        """
+        Whether the catalog sources serve their packages. Only the named
+        ``sources`` are judged, every catalog source by default.
+        """
+        if sources is None:
+            sources = list(self.sources)
+        return bool(sources) and all(
+            name in self.sources and self.sources[name]["state"] == "READY" for name in sources)
+
+    def resolve(self, package: str, channel: Optional[str] = None,
+                source: Optional[str] = None) -> Tuple[str, str, str]:
+        """
+        Return the (catalog, channel, csv) a Subscription to the package
+        installs. The default channel is used when ``channel`` is not
+        given. Raise ``LookupError`` when the catalogs do not offer it.
+        """
+        catalogs = self.packages.get(package)
+        if not catalogs:
+            raise LookupError("No catalog offers the '{}' package".format(package))
+        if source:
+            if source not in catalogs:
+                raise LookupError("The '{}' catalog source does not offer the '{}' package".format(
+                    source, package))
+            name = source
+        elif len(catalogs) == 1:
+            name = next(iter(catalogs))
+        else:
+            raise LookupError("Several catalog sources offer the '{}' package: {}".format(
+                package, ", ".join(sorted(catalogs))))
+        entry = catalogs[name]
+        channel = channel or entry["default"]
+        if channel not in entry["channels"]:
+            raise LookupError("The '{}' package has no '{}' channel in the '{}' catalog source".format(
+                package, channel, name))
+        return name, channel, entry["channels"][channel]
+
+    def manifest_lines(self) -> List[str]:
+        """
+        Return one line per package with the current CSV of each channel,
+        as the ``cluster_status`` function of ``lab-test.sh`` prints them.
+        """
+        lines = []
+        for package in sorted(self.packages):
+            for entry in self.packages[package].values():
+                lines.append('"{}": {}'.format(
+                    package,
+                    "\t".join('"{}",'.format(csv) for csv in entry["channels"].values()),
+                ))
+        return lines
+
+    def to_dict(self) -> Dict:
+        return {"key": self.key, "sources": self.sources, "packages": self.packages}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CatalogIndex":
+        return cls(data["key"], data["sources"], data["packages"])
+
+
+def list_sources(oc_client, namespace: str = CATALOG_NAMESPACE) -> Dict[str, Dict]:
+    """
+    Return the state, image and registry image digest of each
+    CatalogSource.
+    """
+    catalogs = rawapi.get(
+        oc_client, "operators.coreos.com/v1alpha1", "CatalogSource", namespace=namespace,
+        fields=["metadata.name", "spec.image", "status.connectionState.lastObservedState"],
+    )
+    pods = rawapi.get(
+        oc_client, "v1", "Pod", namespace=namespace, label_selector=SOURCE_LABEL,
+        fields=["metadata.labels", "status.containerStatuses"],
+    )
+    digests = {}
+    for pod in pods:
+        name = (pod["metadata.labels"] or {}).get(SOURCE_LABEL)
+        statuses = pod["status.containerStatuses"] or []
+        if name and statuses and statuses[0].get("imageID"):
+            digests[name] = statuses[0]["imageID"]
+    return {
+        catalog["metadata.name"]: {
+            "state": catalog["status.connectionState.lastObservedState"],
+            "image": catalog["spec.image"],
+            "digest": digests.get(catalog["metadata.name"]),
+        }
+        for catalog in catalogs
+    }
+
+
+def index_key(sources: Dict[str, Dict]) -> str:
+    text = "\n".join(
+        "{}={}@{}".format(name, source["state"], source["digest"] or source["image"])
+        for name, source in sorted(sources.items())
+    )
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def list_packages(oc_client, namespace: str = CATALOG_NAMESPACE) -> Dict[str, Dict]:
+    """
+    Read the PackageManifests once and keep only the channels.
+    """
+    manifests = rawapi.get(
+        oc_client, "packages.operators.coreos.com/v1", "PackageManifest", namespace=namespace,
+        fields=["status.packageName", "status.catalogSource", "status.defaultChannel",
+                "status.channels"],
+    )
+    packages = {}
+    for manifest in manifests:
+        packages.setdefault(manifest["status.packageName"], {})[manifest["status.catalogSource"]] = {
+            "default": manifest["status.defaultChannel"],
+            "channels": {
+                channel["name"]: channel.get("currentCSV")
+                for channel in manifest["status.channels"] or []
+            },
+        }
+    return packages
+
+
+def _read_cache(key: str) -> Optional[CatalogIndex]:
+    try:
+        with open(CACHE_FILE) as f:
+            data = json.load(f)
+        if data.get("key") == key:
+            return CatalogIndex.from_dict(data)
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def _write_cache(index: CatalogIndex):
+    directory = os.path.dirname(CACHE_FILE)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".catalog-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index.to_dict(), f)
+        os.replace(tmp, CACHE_FILE)
+    except OSError as e:
+        logging.debug("Cannot save the catalog index: {}".format(e))
+
+
+_index: Optional[CatalogIndex] = None
+
+
+def load(oc_client, namespace: str = CATALOG_NAMESPACE,
+         sources: Optional[List[str]] = None) -> CatalogIndex:
+    """
+    Return the catalog index, from memory or disk when no catalog source
+    changed, otherwise built from the PackageManifests. A new index is
+    kept when the ``sources`` the caller resolves from are ready, every
+    catalog source by default.
+    """
+    global _index
+    states = list_sources(oc_client, namespace)
+    key = index_key(states)
+    if _index is not None and _index.key == key:
+        return _index
+    index = _read_cache(key)
+    if index is None:
+        logging.debug("Building the catalog index")
+        packages = list_packages(oc_client, namespace) if states else {}
+        index = CatalogIndex(key, states, packages)
+        # A catalog that is not ready yet serves a partial list of packages
+        if not index.ready(sources):
+            # Do not keep it in memory either, the packages are read again
+            # until the catalogs are ready
+            return index
+        _write_cache(index)
+    _index = index
+    return index
+
+
+############################################################################
+# Lab tasks
+
+def check_catalog(item: Dict):
+    """
+    Wait for the catalog sources to offer the packages.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * ``packages`` is a list of ``Subscription``, or of package names,
+      that must resolve to a CSV
+    * (optional) ``timeout`` in seconds, 5 minutes by default
+    """
+    item["failed"] = False
+    oc_client = item["oc_client"]
+    subscriptions = [
+        package if isinstance(package, Subscription) else Subscription(package)
+        for package in item.get("packages", [])
+    ]
+    # A subscription without a source is resolved against every catalog
+    sources = None
+    if subscriptions and all(s.source for s in subscriptions):
+        sources = sources_of(subscriptions)
+
+    def probe() -> Optional[str]:
+        index = load(oc_client, sources=sources)
+        if not index.sources:
+            return "no catalog source exists in the '{}' namespace".format(CATALOG_NAMESPACE)
+        problems = []
+        for subscription in subscriptions:
+            try:
+                catalog, channel, csv = index.resolve(*subscription)
+                logging.debug("{} {} from {}: {}".format(subscription.package, channel, catalog, csv))
+            except LookupError as e:
+                problems.append(str(e))
+        return "; ".join(problems) or None
+
+    gate = readiness.ReadinessGate(readiness.api_url(None), item.get("timeout", CATALOG_TIMEOUT),
+                                   output=logging.info)
+    try:
+        gate.wait("operator catalog", probe)
+    except readiness.ClusterNotReady as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": problem} for problem in e.reason.split("; ")]
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot read the catalog sources"}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+    return item
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the operator catalog index")
+    parser.add_argument("-s", "--catalog-source", action="append", default=None,
+                        help="catalog source the lab subscribes from, all by default")
+    subparsers = parser.add_subparsers(dest="command")
+    resolve = subparsers.add_parser("resolve", help="print the CSV a subscription installs")
+    resolve.add_argument("package")
+    resolve.add_argument("channel", nargs="?")
+    resolve.add_argument("--source")
+    args = parser.parse_args(argv)
+
+    from kubernetes import config, dynamic
+    index = load(dynamic.DynamicClient(config.new_client_from_config()), sources=args.catalog_source)
+    if args.command == "resolve":
+        try:
+            print("{} {} {}".format(*index.resolve(args.package, args.channel, args.source)))
+        except LookupError as e:
+            print(e)
+            return 1
+        return 0
+    for name, source in sorted(index.sources.items()):
+        print("{:<40} {:<12} {}".format(name, source["state"] or "", source["digest"] or source["image"]))
+    print("\n".join(index.manifest_lines()))
+    return 0 if index.ready(args.catalog_source) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
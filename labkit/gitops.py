@@ -0,0 +1,167 @@
+"""
+Wait for the Argo CD Applications generated by an ApplicationSet
+
+The Applications generated by an ApplicationSet carry an owner reference
+to it. They are listed once, then followed with a watch until every one
+of them reports ``Synced`` and ``Healthy``. A ``Degraded`` Application
+stops the wait immediately, so grading does not run against a
+half-synced deployment.
+"""
+
+import time
+import logging
+
+from typing import Dict, Optional
+
+from kubernetes.client.exceptions import ApiException
+
+
+ARGOCD_API = "argoproj.io/v1alpha1"
+GITOPS_NAMESPACE = "openshift-gitops"
+
+
+class ApplicationState:
+    """
+    Sync and health state of one Application, with timing.
+    """
+
+    def __init__(self, name: str, start: float):
+        self.name = name
+        self.start = start
+        self.sync = None
+        self.health = None
+        self.ready_at = None
+
+    def update(self, obj: Dict):
+        status = obj.get("status") or {}
+        self.sync = (status.get("sync") or {}).get("status")
+        self.health = (status.get("health") or {}).get("status")
+        if self.ready and self.ready_at is None:
+            self.ready_at = time.time()
+            logging.debug("Application {} ready after {:.1f}s".format(self.name, self.seconds))
+        elif not self.ready:
+            self.ready_at = None
+
+    @property
+    def ready(self) -> bool:
+        return self.sync == "Synced" and self.health == "Healthy"
+
+    @property
+    def degraded(self) -> bool:
+        return self.health == "Degraded"
+
+    @property
+    def seconds(self) -> Optional[float]:
+        if self.ready_at is None:
+            return None
+        return round(self.ready_at - self.start, 1)
+
+    def __str__(self):
+        return "{} ({}, {})".format(self.name, self.sync or "Unknown", self.health or "Unknown")
+
+
+def owned_by(obj: Dict, appset: str) -> bool:
+    return any(
+        ref.get("kind") == "ApplicationSet" and ref.get("name") == appset
+        for ref in obj.get("metadata", {}).get("ownerReferences") or []
+    )
+
+
+def wait_applicationset(oc_client, name: str, namespace: str = GITOPS_NAMESPACE,
+                        timeout: int = 300) -> Dict[str, ApplicationState]:
+    """
+    Wait for the Applications of an ApplicationSet to be synced and
+    healthy, or for one of them to be degraded.
+    Returns the state of every generated Application.
+    """
+    start = time.time()
+    deadline = start + timeout
+    resource = oc_client.resources.get(api_version=ARGOCD_API, kind="Application")
+    apps = {}
+
+    def done():
+        states = list(apps.values())
+        return any(s.degraded for s in states) or (states and all(s.ready for s in states))
+
+    def handle(event_type: str, obj: Dict):
+        if not owned_by(obj, name):
+            return
+        app = obj["metadata"]["name"]
+        if event_type == "DELETED":
+            apps.pop(app, None)
+            return
+        apps.setdefault(app, ApplicationState(app, start)).update(obj)
+
+    resource_version = None
+    while time.time() < deadline:
+        if resource_version is None:
+            apps.clear()
+            listing = resource.get(namespace=namespace)
+            for item in listing.items:
+                handle("ADDED", item.to_dict())
+            resource_version = listing.metadata.resourceVersion
+        if done():
+            break
+        try:
+            for event in oc_client.watch(resource, namespace=namespace,
+                                         resource_version=resource_version,
+                                         timeout=max(1, int(deadline - time.time()))):
+                obj = event["raw_object"]
+                resource_version = obj["metadata"]["resourceVersion"]
+                handle(event["type"], obj)
+                if done() or time.time() > deadline:
+                    break
+        except ApiException as e:
+            if e.status != 410:
+                raise
+            # The resourceVersion expired, list again
+            resource_version = None
+    return apps
+
+
+############################################################################
+# Lab tasks
+
+def wait_applications_ready(item: Dict):
+    """
+    Wait for the Applications generated by an ApplicationSet.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * ``name`` is the ApplicationSet name
+    * (optional) ``namespace``, ``openshift-gitops`` by default
+    * (optional) ``timeout`` in seconds, 300 by default
+    The per-Application state and sync time are saved in
+    ``item["applications"]``.
+    """
+    item["failed"] = False
+    name = item["name"]
+    try:
+        apps = wait_applicationset(
+            item["oc_client"], name,
+            item.get("namespace", GITOPS_NAMESPACE), item.get("timeout", 300),
+        )
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot read the '{}' ApplicationSet applications".format(name)}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+        return item
+
+    item["applications"] = {
+        app.name: {"sync": app.sync, "health": app.health, "seconds": app.seconds}
+        for app in apps.values()
+    }
+    if not apps:
+        item["failed"] = True
+        item["msgs"] = [{"text": "The '{}' ApplicationSet did not generate any application".format(name)}]
+        return item
+
+    degraded = [app for app in apps.values() if app.degraded]
+    pending = [app for app in apps.values() if not app.ready]
+    if degraded:
+        item["failed"] = True
+        item["msgs"] = [{"text": "The application is degraded: {}".format(app)} for app in degraded]
+    elif pending:
+        item["failed"] = True
+        item["msgs"] = [{"text": "The application is not synced and healthy: {}".format(app)}
+                        for app in pending]
+    return item
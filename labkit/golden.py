@@ -0,0 +1,310 @@
+"""
+Virtual machine disks cloned from a golden snapshot
+
+Importing a qcow2 image into every DataVolume of every lab run is slow.
+In golden mode, the image is imported once into a DataVolume of the
+``lab-golden-images`` project, a VolumeSnapshot of it is taken, and the
+VM disks of the lab are DataVolumes cloned from that snapshot. With a
+Ceph RBD storage class, CDI restores the snapshot with a CSI smart clone,
+which takes seconds. Several disks are cloned concurrently.
+
+When the storage class has no matching VolumeSnapshotClass, or a smart
+clone fails, the disks are cloned from the golden PVC instead. CDI
+then picks a CSI clone or a host-assisted copy.
+
+The golden project is not deleted by ``finish``. The snapshot is
+annotated with the sha256 digest of its source image, as published by
+the image server on ``utility``, and is rebuilt only when that digest
+changes.
+
+Golden mode is enabled with ``LAB_GOLDEN_CLONE=1``.
+"""
+
+import os
+import time
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from kubernetes.dynamic.exceptions import ConflictError, NotFoundError
+
+from . import rawapi
+from .watches import wait_objects
+
+
+ENABLED = os.environ.get("LAB_GOLDEN_CLONE", "") == "1"
+
+GOLDEN_NAMESPACE = "lab-golden-images"
+STORAGE_CLASS = "ocs-external-storagecluster-ceph-rbd-virtualization"
+DIGEST_ANNOTATION = "labs.example.com/source-sha256"
+
+DV_API = "cdi.kubevirt.io/v1beta1"
+SNAPSHOT_API = "snapshot.storage.k8s.io/v1"
+
+DEFAULT_SIZE = "10Gi"
+
+
+def _annotation(obj: Optional[Dict]) -> Optional[str]:
+    if not obj:
+        return None
+    return (obj["metadata"].get("annotations") or {}).get(DIGEST_ANNOTATION)
+
+
+def snapshot_class(oc_client, storage_class: str = STORAGE_CLASS) -> Optional[str]:
+    """
+    Return the VolumeSnapshotClass for the driver of the storage class,
+    the default one first.
+    """
+    sc = rawapi.get(oc_client, "storage.k8s.io/v1", "StorageClass", storage_class)
+    if sc is None:
+        return None
+    classes = [
+        c for c in rawapi.get(oc_client, SNAPSHOT_API, "VolumeSnapshotClass")
+        if c.get("driver") == sc.get("provisioner")
+    ]
+    classes.sort(key=lambda c: (c["metadata"].get("annotations") or {}).get(
+        "snapshot.storage.kubernetes.io/is-default-class") != "true")
+    return classes[0]["metadata"]["name"] if classes else None
+
+
+def ensure_namespace(oc_client, name: str):
+    try:
+        oc_client.resources.get(api_version="v1", kind="Namespace").create(
+            body={"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": name}})
+    except ConflictError:
+        pass
+
+
+def _dv_phase(obj: Dict) -> str:
+    return (obj.get("status") or {}).get("phase", "")
+
+
+def wait_datavolumes(oc_client, namespace: str, names: List[str], timeout: int) -> Dict[str, str]:
+    """
+    Return the phase of each DataVolume, once all succeeded or one failed.
+    """
+    seen = wait_objects(
+        oc_client, DV_API, "DataVolume", namespace, names,
+        done=lambda o: _dv_phase(o) == "Succeeded",
+        failed=lambda o: _dv_phase(o) == "Failed",
+        timeout=timeout,
+    )
+    return {name: _dv_phase(seen[name]) if name in seen else "Missing" for name in names}
+
+
+def _delete(oc_client, api_version: str, kind: str, name: str, namespace: str):
+    try:
+        oc_client.resources.get(api_version=api_version, kind=kind).delete(
+            name=name, namespace=namespace)
+    except NotFoundError:
+        pass
+
+
+def _wait_deleted(oc_client, api_version: str, kind: str, names: List[str], namespace: str,
+                  timeout: int = 120):
+    """
+    Wait for deleted objects to be gone, before their names are reused.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline and any(
+            rawapi.get(oc_client, api_version, kind, name, namespace) for name in names):
+        time.sleep(2)
+
+
+def ensure_snapshot(oc_client, name: str, url: str, digest: Optional[str],
+                    size: str = DEFAULT_SIZE, storage_class: str = STORAGE_CLASS,
+                    timeout: int = 1200) -> Dict:
+    """
+    Return the DataVolume ``spec.source`` for the clones of the golden
+    disk, a snapshot when possible, otherwise the golden PVC.
+    The golden DataVolume and snapshot are rebuilt when the digest of
+    the source image changed. An unknown digest reuses them.
+    """
+    snapshot = rawapi.get(oc_client, SNAPSHOT_API, "VolumeSnapshot", name, GOLDEN_NAMESPACE)
+    current = digest is None or _annotation(snapshot) == digest
+    if snapshot and current and (snapshot.get("status") or {}).get("readyToUse"):
+        logging.debug("Reusing the {} golden snapshot".format(name))
+        return {"snapshot": {"namespace": GOLDEN_NAMESPACE, "name": name}}
+
+    ensure_namespace(oc_client, GOLDEN_NAMESPACE)
+    dv = rawapi.get(oc_client, DV_API, "DataVolume", name, GOLDEN_NAMESPACE)
+    if snapshot and not current:
+        _delete(oc_client, SNAPSHOT_API, "VolumeSnapshot", name, GOLDEN_NAMESPACE)
+        _wait_deleted(oc_client, SNAPSHOT_API, "VolumeSnapshot", [name], GOLDEN_NAMESPACE)
+        snapshot = None
+    if dv and digest is not None and _annotation(dv) != digest:
+        _delete(oc_client, DV_API, "DataVolume", name, GOLDEN_NAMESPACE)
+        _wait_deleted(oc_client, DV_API, "DataVolume", [name], GOLDEN_NAMESPACE)
+        dv = None
+    annotations = {DIGEST_ANNOTATION: digest} if digest else {}
+    if dv is None:
+        logging.debug("Importing the {} golden disk from {}".format(name, url))
+        oc_client.resources.get(api_version=DV_API, kind="DataVolume").create(
+            namespace=GOLDEN_NAMESPACE,
+            body={
+                "apiVersion": DV_API,
+                "kind": "DataVolume",
+                "metadata": {"name": name, "annotations": annotations},
+                "spec": {
+                    "source": {"http": {"url": url}},
+                    "storage": {
+                        "storageClassName": storage_class,
+                        "resources": {"requests": {"storage": size}},
+                    },
+                },
+            },
+        )
+    phase = wait_datavolumes(oc_client, GOLDEN_NAMESPACE, [name], timeout)[name]
+    if phase != "Succeeded":
+        raise RuntimeError("The {} golden disk import is {}".format(name, phase or "pending"))
+
+    pvc_source = {"pvc": {"namespace": GOLDEN_NAMESPACE, "name": name}}
+    snapshot_class_name = snapshot_class(oc_client, storage_class)
+    if snapshot_class_name is None:
+        logging.debug("No VolumeSnapshotClass for {}, cloning from the PVC".format(storage_class))
+        return pvc_source
+    if snapshot is None:
+        oc_client.resources.get(api_version=SNAPSHOT_API, kind="VolumeSnapshot").create(
+            namespace=GOLDEN_NAMESPACE,
+            body={
+                "apiVersion": SNAPSHOT_API,
+                "kind": "VolumeSnapshot",
+                "metadata": {"name": name, "annotations": annotations},
+                "spec": {
+                    "volumeSnapshotClassName": snapshot_class_name,
+                    "source": {"persistentVolumeClaimName": name},
+                },
+            },
+        )
+    seen = wait_objects(
+        oc_client, SNAPSHOT_API, "VolumeSnapshot", GOLDEN_NAMESPACE, [name],
+        done=lambda o: bool((o.get("status") or {}).get("readyToUse")),
+        failed=lambda o: bool((o.get("status") or {}).get("error")),
+        timeout=timeout,
+    )
+    if not (seen.get(name, {}).get("status") or {}).get("readyToUse"):
+        logging.debug("The {} golden snapshot is not ready, cloning from the PVC".format(name))
+        return pvc_source
+    return {"snapshot": {"namespace": GOLDEN_NAMESPACE, "name": name}}
+
+
+def golden_source(oc_client, name: str) -> Dict:
+    """
+    Return the clone source of an existing golden disk: the snapshot when
+    it is ready, otherwise the PVC.
+    """
+    snapshot = rawapi.get(oc_client, SNAPSHOT_API, "VolumeSnapshot", name, GOLDEN_NAMESPACE)
+    if snapshot and (snapshot.get("status") or {}).get("readyToUse"):
+        return {"snapshot": {"namespace": GOLDEN_NAMESPACE, "name": name}}
+    return {"pvc": {"namespace": GOLDEN_NAMESPACE, "name": name}}
+
+
+def _clone_body(name: str, source: Dict, size: str, storage_class: str) -> Dict:
+    return {
+        "apiVersion": DV_API,
+        "kind": "DataVolume",
+        "metadata": {"name": name},
+        "spec": {
+            "source": source,
+            "storage": {
+                "storageClassName": storage_class,
+                "resources": {"requests": {"storage": size}},
+            },
+        },
+    }
+
+
+def clone_disks(oc_client, namespace: str, names: List[str], source: Dict,
+                size: str = DEFAULT_SIZE, storage_class: str = STORAGE_CLASS,
+                timeout: int = 600) -> Dict[str, str]:
+    """
+    Create the DataVolumes concurrently as clones of the golden source,
+    and wait for them. A failed snapshot clone is retried from the
+    golden PVC. Returns the phase of each DataVolume.
+    """
+    ensure_namespace(oc_client, namespace)
+    resource = oc_client.resources.get(api_version=DV_API, kind="DataVolume")
+
+    def create(name, disk_source):
+        try:
+            resource.create(namespace=namespace, body=_clone_body(name, disk_source, size, storage_class))
+        except ConflictError:
+            logging.debug("The {} DataVolume already exists".format(name))
+
+    def create_all(disk_names, disk_source):
+        with ThreadPoolExecutor(max_workers=max(len(disk_names), 1)) as executor:
+            list(executor.map(lambda n: create(n, disk_source), disk_names))
+
+    create_all(names, source)
+    phases = wait_datavolumes(oc_client, namespace, names, timeout)
+    failed = [name for name, phase in phases.items() if phase == "Failed"]
+    if failed and "snapshot" in source:
+        logging.debug("Smart clone failed for {}, cloning from the PVC".format(", ".join(failed)))
+        for name in failed:
+            _delete(oc_client, DV_API, "DataVolume", name, namespace)
+        pvc_source = {"pvc": dict(source["snapshot"])}
+        _wait_deleted(oc_client, DV_API, "DataVolume", failed, namespace)
+        create_all(failed, pvc_source)
+        phases = wait_datavolumes(oc_client, namespace, names, timeout)
+    return phases
+
+
+############################################################################
+# Lab tasks
+
+def prepare_golden_snapshot(item: Dict):
+    """
+    Make sure the golden snapshot matches its source image.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * ``name`` is the name of the golden DataVolume and snapshot
+    * ``url`` is the URL of the source image
+    * ``digest`` is the sha256 digest of the source image, or None
+    * (optional) ``size``, ``storage_class`` and ``timeout``
+    """
+    item["failed"] = False
+    try:
+        ensure_snapshot(
+            item["oc_client"], item["name"], item["url"], item.get("digest"),
+            size=item.get("size", DEFAULT_SIZE),
+            storage_class=item.get("storage_class", STORAGE_CLASS),
+            timeout=item.get("timeout", 1200),
+        )
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot prepare the '{}' golden disk".format(item["name"])}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+    return item
+
+
+def clone_golden_disks(item: Dict):
+    """
+    Clone the VM disks of the lab from the golden disk.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * ``namespace`` is the lab project
+    * ``disks`` is the list of DataVolume names
+    * ``golden`` is the name of the golden disk
+    * (optional) ``size``, ``storage_class`` and ``timeout``
+    """
+    item["failed"] = False
+    try:
+        source = golden_source(item["oc_client"], item["golden"])
+        phases = clone_disks(
+            item["oc_client"], item["namespace"], item["disks"], source,
+            size=item.get("size", DEFAULT_SIZE),
+            storage_class=item.get("storage_class", STORAGE_CLASS),
+            timeout=item.get("timeout", 600),
+        )
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot clone the VM disks"}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+        return item
+    pending = ["The '{}' DataVolume is {}".format(name, phase or "pending")
+               for name, phase in phases.items() if phase != "Succeeded"]
+    if pending:
+        item["failed"] = True
+        item["msgs"] = [{"text": text} for text in pending]
+    return item
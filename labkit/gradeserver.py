@@ -0,0 +1,192 @@
+"""
+Classroom grading service
+
+Keeps one lab object, one login and one informer cache per cluster, and
+grades many student namespaces from that cache. Start it on the
+instructor machine:
+
+    python -m <course>.labkit.gradeserver review-cr1 --port 8088
+
+and request a grade with:
+
+    curl 'http://localhost:8088/grade?lab=review-cr1&namespace=review-cr1'
+
+The response holds the same per-item results as ``Console.report_grade``.
+Only the labs whose class implements ``grade_items(namespace)`` can be
+graded by the service.
+"""
+
+import sys
+import json
+import logging
+import argparse
+import importlib
+import threading
+
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, List
+from urllib.parse import urlparse, parse_qs
+
+from .informer import CachedClient
+
+
+# Kinds cached by the service. The cluster-scoped objects are shared by
+# every student, and the namespaced ones are watched across all namespaces.
+CACHED_KINDS = [
+    ("v1", "Node"),
+    ("nmstate.io/v1", "NodeNetworkConfigurationPolicy"),
+    ("hco.kubevirt.io/v1beta1", "HyperConverged"),
+    ("kubevirt.io/v1", "VirtualMachine"),
+    ("k8s.cni.cncf.io/v1", "NetworkAttachmentDefinition"),
+]
+
+
+def load_lab(lab: str):
+    """
+    Import a lab script from the course package and return its class.
+    """
+    package = __package__.rpartition(".")[0]
+    module = importlib.import_module("{}.{}".format(package, lab))
+    for value in vars(module).values():
+        if isinstance(value, type) and getattr(value, "__LAB__", None) == lab:
+            return value
+    raise LookupError("No lab class found for {}".format(lab))
+
+
+def run_grade_items(items: List[Dict]) -> Dict:
+    """
+    Run grading items without a console and return their results.
+    Steps that run on the student workstation (host checks and
+    playbooks) are skipped.
+    """
+    results = []
+    for item in items:
+        if "hosts" in item or "playbook" in item:
+            continue
+        item["failed"] = False
+        try:
+            item["task"](item)
+        except Exception as e:
+            logging.exception("Grading step failed: {}".format(item["label"]))
+            item["failed"] = True
+            item["msgs"] = [{"text": str(e)}]
+        results.append({
+            "label": item["label"],
+            "result": "FAIL" if item.get("failed") else "PASS",
+            "msgs": [m["text"] for m in item.get("msgs") or [] if isinstance(m, dict)],
+        })
+        if item.get("failed") and item.get("fatal"):
+            break
+    passed = all(r["result"] == "PASS" for r in results)
+    return {"result": "PASS" if passed else "FAIL", "items": results}
+
+
+class GradeService:
+    """
+    Grade lab namespaces from a shared informer cache.
+    """
+
+    def __init__(self, labs: List[str], kinds=CACHED_KINDS):
+        self._lock = threading.Lock()
+        self._labs = {}
+        self._client = None
+        self._kinds = kinds
+        for lab in labs:
+            self.lab(lab)
+
+    def lab(self, name: str):
+        with self._lock:
+            if name not in self._labs:
+                lab = load_lab(name)()
+                if not hasattr(lab, "grade_items"):
+                    raise LookupError("The {} lab cannot be graded by the service".format(name))
+                # All the labs talk to the same cluster, share one cache
+                if self._client is None:
+                    client = lab.oc_client
+                    if not isinstance(client, CachedClient):
+                        client = CachedClient(client)
+                    for api_version, kind in self._kinds:
+                        client.inform(api_version, kind)
+                    client.start()
+                    self._client = client
+                elif isinstance(lab.oc_client, CachedClient):
+                    lab.oc_client.stop()
+                lab.oc_client = self._client
+                self._labs[name] = lab
+            return self._labs[name]
+
+    def grade(self, lab: str, namespace: str) -> Dict:
+        result = run_grade_items(self.lab(lab).grade_items(namespace))
+        result.update({"lab": lab, "namespace": namespace})
+        return result
+
+    def stop(self):
+        if self._client is not None:
+            self._client.stop()
+
+
+class GradeRequestHandler(BaseHTTPRequestHandler):
+    service: GradeService = None
+
+    def log_message(self, format, *args):
+        logging.info("%s - %s" % (self.address_string(), format % args))
+
+    def _reply(self, status: int, body: Dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/healthz":
+            self._reply(HTTPStatus.OK, {"status": "ok"})
+            return
+        if url.path != "/grade":
+            self._reply(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+            return
+        query = parse_qs(url.query)
+        lab = query.get("lab", [None])[0]
+        namespace = query.get("namespace", [lab])[0]
+        if not lab:
+            self._reply(HTTPStatus.BAD_REQUEST, {"error": "The 'lab' parameter is required"})
+            return
+        try:
+            self._reply(HTTPStatus.OK, self.service.grade(lab, namespace))
+        except (ImportError, LookupError) as e:
+            self._reply(HTTPStatus.NOT_FOUND, {"error": str(e)})
+
+
+class GradeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classroom grading service")
+    parser.add_argument("labs", nargs="*", help="labs to load at startup")
+    parser.add_argument("--host", default="")
+    parser.add_argument("--port", type=int, default=8088)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    service = GradeService(args.labs)
+    handler = type("Handler", (GradeRequestHandler,), {"service": service})
+    server = GradeServer((args.host, args.port), handler)
+    logging.info("Grading service listening on port {}".format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
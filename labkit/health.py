@@ -0,0 +1,324 @@
+"""
+Single-pass cluster health evaluation
+
+Nodes, ClusterOperators, MachineConfigPools, CatalogSources and the
+ClusterVersion are listed in one concurrent fan-out, as plain dicts, and
+all their conditions are evaluated in memory. Only the catalog sources
+the lab subscribes from are checked. A MachineConfigPool that is updating
+is waited for, it is not a problem on its own.
+
+A healthy verdict is saved with the resourceVersions of the
+ClusterVersion and of every ClusterOperator. The next verb lists only the
+metadata of those objects, and reuses the verdict when nothing changed
+and it is recent, so back-to-back verbs skip the full evaluation.
+
+``status_report`` returns the same detail as the ``cluster_status``
+function of ``lab-test.sh``, for the test logs:
+
+    python -m <course>.labkit.health --detail
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from kubernetes.dynamic.exceptions import ResourceNotFoundError
+
+from . import catalog, rawapi, readiness
+
+
+CACHE_FILE = os.path.expanduser("~/.cache/labs/health.json")
+
+# Seconds a healthy verdict is reused. Nodes, pools and catalog sources
+# are not part of the cache key, so the verdict must also expire.
+CACHE_TTL = 10 * 60
+
+# (name, api_version, kind) of the objects evaluated
+SOURCES = [
+    ("nodes", "v1", "Node"),
+    ("clusteroperators", "config.openshift.io/v1", "ClusterOperator"),
+    ("machineconfigpools", "machineconfiguration.openshift.io/v1", "MachineConfigPool"),
+    ("catalogsources", "operators.coreos.com/v1alpha1", "CatalogSource"),
+    ("clusterversions", "config.openshift.io/v1", "ClusterVersion"),
+]
+
+NODE_PRESSURE = ("MemoryPressure", "DiskPressure", "PIDPressure")
+
+# Seconds to wait for the MachineConfigPools that are updating
+POOLS_TIMEOUT = 15 * 60
+
+
+def _conditions(obj: Dict) -> Dict[str, str]:
+    return {
+        c.get("type"): c.get("status")
+        for c in (obj.get("status") or {}).get("conditions") or []
+    }
+
+
+def _name(obj: Dict) -> str:
+    metadata = obj["metadata"]
+    if metadata.get("namespace"):
+        return "{}/{}".format(metadata["namespace"], metadata["name"])
+    return metadata["name"]
+
+
+def collect(oc_client, sources=SOURCES, workers: int = 5) -> Dict[str, List[Dict]]:
+    """
+    List the sources concurrently. A kind missing from the cluster gives
+    an empty list, a list that fails gives ``None``.
+    """
+    state, found = {}, []
+    # The discovery cache of the client is not thread safe, resolve the
+    # kinds first so the threads only read it
+    for name, api_version, kind in sources:
+        try:
+            oc_client.resources.get(api_version=api_version, kind=kind)
+            found.append((name, api_version, kind))
+        except ResourceNotFoundError:
+            state[name] = []
+
+    def fetch(source):
+        name, api_version, kind = source
+        try:
+            return name, rawapi.get(oc_client, api_version, kind)
+        except Exception as e:
+            logging.debug("Cannot list {}: {}".format(kind, e))
+            return name, None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        state.update(executor.map(fetch, found))
+    return state
+
+
+def evaluate(state: Dict[str, Optional[List[Dict]]],
+             catalog_sources: Optional[List[str]] = None) -> List[str]:
+    """
+    Return the health problems found in the collected objects.
+    ``catalog_sources`` are the names of the CatalogSources to check, in
+    the ``openshift-marketplace`` namespace. None are checked by default.
+    """
+    problems = []
+    if state.get("nodes") is None:
+        problems.append("Cannot list the cluster nodes")
+    for node in state.get("nodes") or []:
+        conditions = _conditions(node)
+        if conditions.get("Ready") != "True":
+            problems.append("The '{}' node is not ready".format(_name(node)))
+        for pressure in NODE_PRESSURE:
+            if conditions.get(pressure) == "True":
+                problems.append("The '{}' node has {}".format(_name(node), pressure))
+    for cv in state.get("clusterversions") or []:
+        if _conditions(cv).get("Available") != "True":
+            problems.append("The cluster version is not available")
+    for co in state.get("clusteroperators") or []:
+        conditions = _conditions(co)
+        if conditions.get("Available") != "True":
+            problems.append("The '{}' cluster operator is not available".format(_name(co)))
+        elif conditions.get("Degraded") == "True":
+            problems.append("The '{}' cluster operator is degraded".format(_name(co)))
+    for pool in state.get("machineconfigpools") or []:
+        conditions = _conditions(pool)
+        if conditions.get("Degraded") == "True":
+            problems.append("The '{}' machine config pool is degraded".format(_name(pool)))
+    sources = {
+        source["metadata"]["name"]: source
+        for source in state.get("catalogsources") or []
+        if source["metadata"].get("namespace") == catalog.CATALOG_NAMESPACE
+    }
+    for name in catalog_sources or []:
+        if name not in sources:
+            problems.append("The '{}' catalog source does not exist".format(name))
+            continue
+        connection = (sources[name].get("status") or {}).get("connectionState") or {}
+        if connection.get("lastObservedState") != "READY":
+            problems.append("The '{}' catalog source is {}".format(
+                name, connection.get("lastObservedState") or "not connected"))
+    return problems
+
+
+def updating(pools: Optional[List[Dict]]) -> List[str]:
+    """
+    Return the names of the MachineConfigPools that are updating.
+    """
+    return [
+        _name(pool) for pool in pools or []
+        if _conditions(pool).get("Updating") == "True"
+    ]
+
+
+def wait_for_pools(oc_client, timeout: int = POOLS_TIMEOUT) -> Optional[str]:
+    """
+    Wait for the MachineConfigPools to finish their update. Returns None,
+    or the reason when they are still updating at the deadline.
+    """
+    def probe():
+        pools = updating(rawapi.get(oc_client, "machineconfiguration.openshift.io/v1",
+                                    "MachineConfigPool"))
+        return "updating: {}".format(", ".join(pools)) if pools else None
+
+    gate = readiness.ReadinessGate(readiness.api_url(None), timeout, output=logging.info)
+    try:
+        gate.wait("machine config pools", probe)
+    except readiness.ClusterNotReady as e:
+        return e.reason
+    return None
+
+
+def cache_key(oc_client, catalog_sources: Optional[List[str]] = None) -> str:
+    """
+    Hash the resourceVersions of the ClusterVersion and ClusterOperators,
+    read as metadata only, and the catalog sources the verdict covers.
+    """
+    versions = ["CatalogSource/{}".format(name) for name in catalog_sources or []]
+    for kind in ("ClusterVersion", "ClusterOperator"):
+        for obj in rawapi.get(oc_client, "config.openshift.io/v1", kind, metadata_only=True):
+            versions.append("{}/{}={}".format(
+                kind, obj["metadata"]["name"], obj["metadata"].get("resourceVersion")))
+    return hashlib.sha1("\n".join(sorted(versions)).encode("utf-8")).hexdigest()
+
+
+def _cached(key: str) -> bool:
+    try:
+        with open(CACHE_FILE) as f:
+            cached = json.load(f)
+        return cached["key"] == key and time.time() - cached["time"] < CACHE_TTL
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def _save(key: str):
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        with open(CACHE_FILE, "w") as f:
+            json.dump({"key": key, "time": time.time()}, f)
+    except OSError as e:
+        logging.debug("Cannot save the health verdict: {}".format(e))
+
+
+def check(oc_client, catalog_sources: Optional[List[str]] = None,
+          pools_timeout: int = POOLS_TIMEOUT) -> List[str]:
+    """
+    Return the health problems of the cluster, reusing a recent healthy
+    verdict when the ClusterVersion and ClusterOperators did not change.
+    MachineConfigPools that are updating are waited for first.
+    """
+    try:
+        key = cache_key(oc_client, catalog_sources)
+    except Exception as e:
+        logging.debug("Cannot compute the health cache key: {}".format(e))
+        key = None
+    if key and _cached(key):
+        logging.debug("Reusing the cluster health verdict")
+        return []
+    state = collect(oc_client)
+    if updating(state.get("machineconfigpools")):
+        reason = wait_for_pools(oc_client, pools_timeout)
+        if reason:
+            return ["The machine config pools are still {}".format(reason)]
+        # Nodes reboot during a pool update, evaluate them again
+        state = collect(oc_client)
+    problems = evaluate(state, catalog_sources)
+    if key and not problems:
+        _save(key)
+    return problems
+
+
+def status_report(oc_client) -> str:
+    """
+    Return the cluster detail printed by ``cluster_status`` in lab-test.sh:
+    version, nodes, ClusterVersion, ClusterOperators, CatalogSources and
+    the current CSV of every package channel, from the catalog index.
+    """
+    state = collect(oc_client)
+    lines = []
+    for cv in state.get("clusterversions") or []:
+        lines.append("Server Version: {}".format(
+            ((cv.get("status") or {}).get("desired") or {}).get("version")))
+    lines.append("")
+    lines.append("{:<30} {:<8} {:<25} {}".format("NODE", "STATUS", "ROLES", "VERSION"))
+    for node in state.get("nodes") or []:
+        roles = sorted(
+            key.split("/", 1)[1] for key in node["metadata"].get("labels", {})
+            if key.startswith("node-role.kubernetes.io/")
+        )
+        lines.append("{:<30} {:<8} {:<25} {}".format(
+            _name(node),
+            "Ready" if _conditions(node).get("Ready") == "True" else "NotReady",
+            ",".join(roles) or "<none>",
+            ((node.get("status") or {}).get("nodeInfo") or {}).get("kubeletVersion", ""),
+        ))
+    lines.append("")
+    lines.append("{:<40} {:<10} {:<12} {}".format("CLUSTEROPERATOR", "AVAILABLE", "PROGRESSING", "DEGRADED"))
+    for co in state.get("clusteroperators") or []:
+        conditions = _conditions(co)
+        lines.append("{:<40} {:<10} {:<12} {}".format(
+            _name(co), conditions.get("Available", ""), conditions.get("Progressing", ""),
+            conditions.get("Degraded", ""),
+        ))
+    lines.append("")
+    lines.append("{:<60} {}".format("CATALOGSOURCE", "STATE"))
+    for source in state.get("catalogsources") or []:
+        connection = (source.get("status") or {}).get("connectionState") or {}
+        lines.append("{:<60} {}".format(_name(source), connection.get("lastObservedState", "")))
+    lines.append("")
+    try:
+        lines.extend(catalog.load(oc_client).manifest_lines())
+    except Exception as e:
+        lines.append("Cannot read the catalog index: {}".format(e))
+    problems = evaluate(state)
+    lines.append("")
+    lines.extend(problems or ["The cluster is healthy"])
+    return "\n".join(lines)
+
+
+############################################################################
+# Lab tasks
+
+def check_cluster_ready(item: Dict):
+    """
+    Check the health of the cluster.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * (optional) ``catalog_sources``, the names of the catalog sources the
+      lab subscribes from
+    """
+    item["failed"] = False
+    try:
+        problems = check(item["oc_client"], item.get("catalog_sources"))
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot check the cluster health"}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+        return item
+    if problems:
+        item["failed"] = True
+        item["msgs"] = [{"text": problem} for problem in problems]
+    return item
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the cluster health")
+    parser.add_argument("--detail", action="store_true", help="print the cluster status")
+    parser.add_argument("-s", "--catalog-source", action="append", default=[],
+                        help="catalog source to check")
+    args = parser.parse_args(argv)
+
+    from kubernetes import config, dynamic
+    oc_client = dynamic.DynamicClient(config.new_client_from_config())
+    if args.detail:
+        print(status_report(oc_client))
+        return 0
+    problems = check(oc_client, args.catalog_source)
+    print("\n".join(problems or ["The cluster is healthy"]))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+"""
+Checksum-keyed disk image store for the lab image server on 'utility'
+
+Images are stored once under ``<root>/sha256/<digest>`` and published under
+their usual URL path (for example ``openshift4/images/helloworld.qcow2``)
+through a symbolic link in ``<root>/names``.  The HTTP server answers range
+requests and ``If-None-Match`` revalidation, and sends the file content with
+``os.sendfile`` so that many CDI importers can read the same image at once.
+
+Each lab also gets a manifest published as ``labs/<lab>.json`` that lists
+the images it uses and their digests. The lab scripts read it to skip the
+image staging playbook when everything is already in place. The staging
+playbooks must publish with ``imagestore add --lab <lab>`` and the server
+must run on 'utility' for that to happen; until then the playbooks run,
+and the images are removed at finish, as before.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import tempfile
+import requests
+
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_ROOT = "/home/lab/images"
+DEFAULT_PORT = 8080
+
+
+class ImageStore:
+    """
+    Content-addressed image store.
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT):
+        self.root = os.path.abspath(root)
+        self.blobs = os.path.join(self.root, "sha256")
+        self.names = os.path.join(self.root, "names")
+        os.makedirs(self.blobs, exist_ok=True)
+        os.makedirs(self.names, exist_ok=True)
+
+    @staticmethod
+    def checksum(path: str) -> str:
+        """
+        Return the sha256 digest of a file, reading it in chunks.
+        """
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _name_path(self, name: str) -> str:
+        path = os.path.normpath(os.path.join(self.names, name.lstrip("/")))
+        if not path.startswith(self.names + os.sep):
+            raise ValueError("Invalid image name: {}".format(name))
+        return path
+
+    def add(self, source: str, name: str, digest: Optional[str] = None,
+            lab: Optional[str] = None) -> str:
+        """
+        Add an image to the store and publish it under ``name``.
+        The blob is only copied when no image with the same checksum
+        is already stored, so re-staging an image is cheap.
+        When ``lab`` is given, the image is recorded in the lab manifest.
+        """
+        digest = digest or self.checksum(source)
+        blob = os.path.join(self.blobs, digest)
+        if not os.path.exists(blob):
+            logging.info("Storing image {} as {}".format(source, digest))
+            fd, tmp = tempfile.mkstemp(dir=self.blobs)
+            try:
+                # Copy rather than link: the blob must not share its inode,
+                # nor its mode, with a file the caller can still change
+                sha = hashlib.sha256()
+                with open(source, "rb") as src, os.fdopen(fd, "wb") as dst:
+                    for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                        sha.update(chunk)
+                        dst.write(chunk)
+                if sha.hexdigest() != digest:
+                    raise ValueError("The checksum of {} is {}, not {}".format(
+                        source, sha.hexdigest(), digest))
+                os.chmod(tmp, 0o444)
+                os.rename(tmp, blob)
+            finally:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+        else:
+            logging.info("Image {} already stored as {}".format(source, digest))
+
+        link = self._name_path(name)
+        os.makedirs(os.path.dirname(link), exist_ok=True)
+        tmp_link = link + ".tmp"
+        if os.path.lexists(tmp_link):
+            os.unlink(tmp_link)
+        os.symlink(os.path.relpath(blob, os.path.dirname(link)), tmp_link)
+        os.replace(tmp_link, link)
+
+        if lab:
+            manifest = self.manifest(lab)
+            manifest[name.lstrip("/")] = digest
+            self._publish_manifest(lab, manifest)
+        return digest
+
+    def manifest(self, lab: str) -> Dict[str, str]:
+        """
+        Return the images recorded for a lab, as a name to digest mapping.
+        """
+        found = self.lookup(manifest_name(lab))
+        if found is None:
+            return {}
+        with open(found[0]) as f:
+            return json.load(f)
+
+    def _publish_manifest(self, lab: str, manifest: Dict[str, str]):
+        fd, tmp = tempfile.mkstemp(dir=self.root)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f, sort_keys=True)
+            self.add(tmp, manifest_name(lab))
+        finally:
+            os.unlink(tmp)
+
+    def remove(self, name: str):
+        """
+        Unpublish an image. The blob stays until ``prune`` is called.
+        """
+        link = self._name_path(name)
+        if os.path.lexists(link):
+            os.unlink(link)
+
+    def prune(self):
+        """
+        Delete the blobs that are not published under any name.
+        """
+        used = set()
+        for dirpath, _, filenames in os.walk(self.names):
+            for filename in filenames:
+                used.add(os.path.basename(os.readlink(os.path.join(dirpath, filename))))
+        for digest in os.listdir(self.blobs):
+            if digest not in used:
+                logging.info("Pruning image {}".format(digest))
+                os.unlink(os.path.join(self.blobs, digest))
+
+    def lookup(self, name: str) -> Optional[Tuple[str, str, os.stat_result]]:
+        """
+        Return the blob path, digest and stat result of a published image.
+        """
+        try:
+            link = self._name_path(name)
+        except ValueError:
+            return None
+        if not os.path.islink(link):
+            return None
+        blob = os.path.realpath(link)
+        try:
+            st = os.stat(blob)
+        except FileNotFoundError:
+            return None
+        return blob, os.path.basename(blob), st
+
+
+def manifest_name(lab: str) -> str:
+    return "labs/{}.json".format(lab)
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single ``bytes=`` range and return the inclusive (start, end)
+    offsets, or None when the range cannot be satisfied.
+    Multiple ranges are not supported and are rejected.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                return None
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serve the published images with range and ETag support.
+    """
+
+    store: ImageStore = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s" % (self.address_string(), format % args))
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        found = self.store.lookup(unquote(urlsplit(self.path).path))
+        if found is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        blob, digest, st = found
+        etag = '"sha256:{}"'.format(digest)
+
+        inm = self.headers.get("If-None-Match")
+        if inm and (inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = 0, st.st_size - 1
+        status = HTTPStatus.OK
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and (not if_range or if_range.strip() == etag):
+            byte_range = parse_range(range_header, st.st_size)
+            if byte_range is None:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", "bytes */{}".format(st.st_size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start, end = byte_range
+            status = HTTPStatus.PARTIAL_CONTENT
+
+        length = end - start + 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(st.st_mtime))
+        self.send_header("Cache-Control", "public, max-age=0, must-revalidate")
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, st.st_size))
+        self.end_headers()
+
+        if send_body and length > 0:
+            with open(blob, "rb") as f:
+                self._send_file(f, start, length)
+
+    def _send_file(self, f, offset: int, count: int):
+        self.wfile.flush()
+        try:
+            out = self.connection.fileno()
+            while count > 0:
+                sent = os.sendfile(out, f.fileno(), offset, min(count, CHUNK_SIZE * 8))
+                if sent == 0:
+                    break
+                offset += sent
+                count -= sent
+        except (AttributeError, OSError) as e:
+            if isinstance(e, (BrokenPipeError, ConnectionResetError)):
+                return
+            # sendfile is not available, fall back to regular reads
+            f.seek(offset)
+            while count > 0:
+                chunk = f.read(min(count, CHUNK_SIZE))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                count -= len(chunk)
+
+
+class ImageServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+def serve(root: str = DEFAULT_ROOT, host: str = "", port: int = DEFAULT_PORT):
+    """
+    Serve the image store until interrupted.
+    """
+    handler = type("Handler", (ImageRequestHandler,), {"store": ImageStore(root)})
+    server = ImageServer((host, port), handler)
+    logging.info("Serving images from {} on port {}".format(root, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def published_manifest(base_url: str, lab: str, timeout: int = 10) -> Dict[str, str]:
+    """
+    Return the image manifest the server publishes for a lab, or an empty
+    mapping when it cannot be read.
+    """
+    try:
+        r = requests.get("{}/{}".format(base_url.rstrip("/"), manifest_name(lab)), timeout=timeout)
+        if r.status_code == HTTPStatus.OK:
+            return r.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.debug("Cannot read the image manifest for {}: {}".format(lab, e))
+    return {}
+
+
+def images_current(base_url: str, lab: str, timeout: int = 10) -> bool:
+    """
+    Return True when the images recorded in the lab manifest are all
+    still published with the recorded digests.
+    Revalidation uses ``If-None-Match``, so no image data is transferred.
+    """
+    base_url = base_url.rstrip("/")
+    try:
+        r = requests.get("{}/{}".format(base_url, manifest_name(lab)), timeout=timeout)
+        if r.status_code != HTTPStatus.OK:
+            return False
+        manifest = r.json()
+        for name, digest in manifest.items():
+            r = requests.head(
+                "{}/{}".format(base_url, name),
+                headers={"If-None-Match": '"sha256:{}"'.format(digest)},
+                timeout=timeout,
+            )
+            if r.status_code != HTTPStatus.NOT_MODIFIED:
+                logging.debug("Image {} is not current: {}".format(name, r.status_code))
+                return False
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.debug("Cannot read the image manifest for {}: {}".format(lab, e))
+        return False
+    return bool(manifest)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lab disk image store")
+    parser.add_argument("--root", default=DEFAULT_ROOT)
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("serve", help="serve the published images over HTTP")
+    p.add_argument("--host", default="")
+    p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p = sub.add_parser("add", help="add an image and publish it")
+    p.add_argument("source")
+    p.add_argument("name")
+    p.add_argument("--sha256")
+    p.add_argument("--lab", help="record the image in the lab manifest")
+    p = sub.add_parser("remove", help="unpublish an image")
+    p.add_argument("name")
+    sub.add_parser("prune", help="delete unpublished images")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    store = ImageStore(args.root)
+    if args.command == "serve":
+        serve(args.root, args.host, args.port)
+    elif args.command == "add":
+        print(store.add(args.source, args.name, args.sha256, args.lab))
+    elif args.command == "remove":
+        store.remove(args.name)
+    elif args.command == "prune":
+        store.prune()
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
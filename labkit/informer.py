@@ -0,0 +1,358 @@
+"""
+List+watch informers and a cached view of the dynamic client
+
+An informer LISTs one kind once, then follows a WATCH stream in a
+background thread and keeps a local copy of every object.
+``CachedClient`` wraps the dynamic client so that ``resources.get(...)``
+returns a cached resource for the informed kinds; every other kind, every
+write, and the reads with a field selector or a set-based label selector
+go to the API server as before.
+"""
+
+import re
+import time
+import logging
+import threading
+
+from typing import Dict, List, Optional, Tuple
+
+from kubernetes.client.exceptions import ApiException
+from kubernetes.dynamic.exceptions import NotFoundError, ResourceNotFoundError
+from kubernetes.dynamic.resource import ResourceInstance
+
+
+# Seconds a watch request stays open before it is renewed
+WATCH_TIMEOUT = 300
+
+# Seconds to wait before retrying a failed list or watch
+RETRY_DELAY = 5
+
+
+def parse_selector(selector: Optional[str]) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Parse an equality-based label selector such as ``a=b,c!=d,e,!f``.
+    Returns (key, operator, value) tuples, where operator is one of
+    ``=``, ``!=``, ``exists`` or ``!``. Set-based selectors, such as
+    ``a in (b,c)``, raise ``ValueError``.
+    """
+    if re.search(r"[()]|\s(not)?in(\s|$)", selector or ""):
+        raise ValueError("Set-based label selectors are not supported: {}".format(selector))
+    terms = []
+    for term in (selector or "").split(","):
+        term = term.strip()
+        if not term:
+            continue
+        if "!=" in term:
+            key, value = term.split("!=", 1)
+            terms.append((key.strip(), "!=", value.strip()))
+        elif "=" in term:
+            key, value = term.split("=", 1)
+            terms.append((key.strip(), "=", value.strip().lstrip("=")))
+        elif term.startswith("!"):
+            terms.append((term[1:].strip(), "!", None))
+        else:
+            terms.append((term, "exists", None))
+    for key, _, value in terms:
+        if not key or re.search(r"\s", key) or (value and re.search(r"\s", value)):
+            raise ValueError("Invalid label selector: {}".format(selector))
+    return terms
+
+
+def labels_match(labels: Dict[str, str], terms) -> bool:
+    for key, op, value in terms:
+        if op == "=" and labels.get(key) != value:
+            return False
+        if op == "!=" and labels.get(key) == value:
+            return False
+        if op == "exists" and key not in labels:
+            return False
+        if op == "!" and key in labels:
+            return False
+    return True
+
+
+class Store:
+    """
+    Thread-safe local copy of the objects of one kind.
+    Objects are kept as plain dicts, keyed by (namespace, name), with
+    indexes on namespace and on label key=value pairs. ``label_version``
+    changes only when an object is added or removed, or its labels change.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._objects = {}
+        self._by_namespace = {}
+        self._by_label = {}
+        self.label_version = 0
+
+    @staticmethod
+    def key(obj: Dict) -> Tuple[str, str]:
+        metadata = obj.get("metadata", {})
+        return metadata.get("namespace") or "", metadata["name"]
+
+    @staticmethod
+    def _labels(obj: Dict) -> Dict[str, str]:
+        return obj.get("metadata", {}).get("labels") or {}
+
+    def _index(self, key, obj: Dict):
+        self._by_namespace.setdefault(key[0], set()).add(key)
+        for label in self._labels(obj).items():
+            self._by_label.setdefault(label, set()).add(key)
+
+    def _unindex(self, key):
+        obj = self._objects.pop(key, None)
+        if obj is None:
+            return
+        self._by_namespace.get(key[0], set()).discard(key)
+        for label in self._labels(obj).items():
+            keys = self._by_label.get(label)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_label[label]
+
+    def replace(self, objects: List[Dict]):
+        with self._lock:
+            self._objects = {}
+            self._by_namespace = {}
+            self._by_label = {}
+            self.label_version += 1
+            for obj in objects:
+                self.update(obj)
+
+    def update(self, obj: Dict):
+        key = self.key(obj)
+        with self._lock:
+            current = self._objects.get(key)
+            if current is None or self._labels(current) != self._labels(obj):
+                self.label_version += 1
+            self._unindex(key)
+            self._objects[key] = obj
+            self._index(key, obj)
+
+    def delete(self, obj: Dict):
+        key = self.key(obj)
+        with self._lock:
+            if key in self._objects:
+                self.label_version += 1
+            self._unindex(key)
+
+    def get(self, name: str, namespace: Optional[str] = None) -> Optional[Dict]:
+        with self._lock:
+            return self._objects.get((namespace or "", name))
+
+    def list(self, namespace: Optional[str] = None,
+             label_selector: Optional[str] = None) -> List[Dict]:
+        terms = parse_selector(label_selector)
+        with self._lock:
+            keys = None
+            if namespace:
+                keys = set(self._by_namespace.get(namespace, ()))
+            for key, op, value in terms:
+                if op == "=":
+                    matched = self._by_label.get((key, value), set())
+                    keys = set(matched) if keys is None else keys & matched
+            if keys is None:
+                keys = self._objects.keys()
+            objects = [self._objects[key] for key in sorted(keys)]
+        return [obj for obj in objects if labels_match(self._labels(obj), terms)]
+
+
+class Informer:
+    """
+    Keep a Store in sync with the API server for one kind.
+    """
+
+    def __init__(self, oc_client, api_version: str, kind: str,
+                 namespace: Optional[str] = None):
+        self.oc_client = oc_client
+        self.api_version = api_version
+        self.kind = kind
+        self.namespace = namespace
+        self.store = Store()
+        self.resource_version = None
+        self.synced = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return "Informer({}/{})".format(self.api_version, self.kind)
+
+    @property
+    def resource(self):
+        return self.oc_client.resources.get(api_version=self.api_version, kind=self.kind)
+
+    def start(self, wait: bool = True, timeout: Optional[float] = 60):
+        """
+        Start the list+watch thread. By default, wait for the first LIST.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name=repr(self), daemon=True
+            )
+            self._thread.start()
+        if wait:
+            return self.wait(timeout)
+        return self.synced.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the first LIST. Returns early if the informer gave up.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.synced.is_set() and self._thread is not None and self._thread.is_alive():
+            remaining = 0.1 if deadline is None else min(deadline - time.time(), 0.1)
+            if remaining <= 0:
+                break
+            self.synced.wait(remaining)
+        return self.synced.is_set()
+
+    def stop(self):
+        self._stop.set()
+
+    def _list(self):
+        result = self.resource.get(namespace=self.namespace)
+        self.store.replace([item.to_dict() for item in result.items])
+        self.resource_version = result.metadata.resourceVersion
+        self.synced.set()
+        logging.debug("{} listed {} objects at {}".format(
+            self, len(result.items), self.resource_version))
+
+    def _watch(self):
+        try:
+            for event in self.oc_client.watch(
+                self.resource,
+                namespace=self.namespace,
+                resource_version=self.resource_version,
+                timeout=WATCH_TIMEOUT,
+            ):
+                if self._stop.is_set():
+                    return
+                obj = event["raw_object"]
+                if event["type"] == "DELETED":
+                    self.store.delete(obj)
+                elif event["type"] != "BOOKMARK":
+                    self.store.update(obj)
+                self.resource_version = obj["metadata"]["resourceVersion"]
+        except ApiException as e:
+            if e.status != 410:
+                raise
+            # The resource version is too old, list again
+            self.resource_version = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.resource_version is None:
+                    self._list()
+                self._watch()
+            except ResourceNotFoundError:
+                logging.warning("{} is not served by the cluster".format(self))
+                return
+            except Exception as e:
+                logging.debug("{} failed, retrying: {}".format(self, e))
+                self.resource_version = None
+                self._stop.wait(RETRY_DELAY)
+
+
+def _supported(label_selector: Optional[str]) -> bool:
+    try:
+        parse_selector(label_selector)
+    except ValueError:
+        return False
+    return True
+
+
+class CachedResource:
+    """
+    Serve the read calls of a dynamic client resource from an informer.
+    """
+
+    def __init__(self, resource, informer: Informer):
+        self._resource = resource
+        self._informer = informer
+
+    def __getattr__(self, name):
+        return getattr(self._resource, name)
+
+    def get(self, name: Optional[str] = None, namespace: Optional[str] = None,
+            label_selector: Optional[str] = None, field_selector: Optional[str] = None,
+            **kwargs):
+        if (field_selector or kwargs or not self._informer.synced.is_set()
+                or not _supported(label_selector)):
+            return self._resource.get(
+                name=name, namespace=namespace, label_selector=label_selector,
+                field_selector=field_selector, **kwargs
+            )
+        client = self._resource.client
+        if name:
+            obj = self._informer.store.get(name, namespace)
+            if obj is None:
+                raise NotFoundError(ApiException(status=404, reason="Not Found"))
+            return ResourceInstance(client, obj)
+        objects = self._informer.store.list(namespace, label_selector)
+        return ResourceInstance(client, {
+            "apiVersion": self._informer.api_version,
+            "kind": self._informer.kind + "List",
+            "metadata": {"resourceVersion": self._informer.resource_version},
+            "items": objects,
+        })
+
+
+class CachedResources:
+    def __init__(self, resources, informers: Dict[Tuple[str, str], Informer]):
+        self._resources = resources
+        self._informers = informers
+
+    def __getattr__(self, name):
+        return getattr(self._resources, name)
+
+    def get(self, **kwargs):
+        resource = self._resources.get(**kwargs)
+        informer = self._informers.get((kwargs.get("api_version"), kwargs.get("kind")))
+        if informer is None:
+            return resource
+        return CachedResource(resource, informer)
+
+
+class CachedClient:
+    """
+    Drop-in replacement for the dynamic client used as ``oc_client``.
+    """
+
+    def __init__(self, oc_client, kinds: List[Tuple[str, str]] = ()):
+        self._oc_client = oc_client
+        self.informers = {}
+        for api_version, kind in kinds:
+            self.inform(api_version, kind)
+        self.resources = CachedResources(oc_client.resources, self.informers)
+
+    def __getattr__(self, name):
+        return getattr(self._oc_client, name)
+
+    def inform(self, api_version: str, kind: str, namespace: Optional[str] = None) -> Informer:
+        key = (api_version, kind)
+        if key not in self.informers:
+            self.informers[key] = Informer(self._oc_client, api_version, kind, namespace)
+        return self.informers[key]
+
+    def start(self, timeout: Optional[float] = 60) -> bool:
+        """
+        Start all the informers and wait for their first LIST.
+        Kinds that fail to sync keep reading from the API server.
+        """
+        deadline = time.time() + (timeout or 0)
+        synced = True
+        for informer in self.informers.values():
+            informer.start(wait=False)
+        for informer in self.informers.values():
+            remaining = max(deadline - time.time(), 0) if timeout else None
+            if not informer.wait(remaining):
+                logging.warning("{} did not sync".format(informer))
+                synced = False
+        return synced
+
+    def stop(self):
+        for informer in self.informers.values():
+            informer.stop()
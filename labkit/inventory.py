@@ -0,0 +1,288 @@
+"""
+Cluster inventory snapshots
+
+A snapshot records one line per object, sorted by kind and then by
+storage key, ``<namespace>/<name>``:
+
+    <kind>\t<namespace>\t<name>\t<resourceVersion>
+
+The objects are read with paginated LIST requests (``limit`` and
+``continue``) that only ask for the object metadata. The rows of one kind
+are kept in memory, one short tuple per object, and written to a gzip'd
+file before the next kind is listed. Pages come back in key order; a kind
+that does not is sorted, so two snapshots are compared with a linear
+merge.
+
+When the ``continue`` token of a kind expires (HTTP 410), the kind is
+listed again from the start. A kind that still cannot be listed is left
+out and recorded as incomplete at the end of the file, and ``diff`` skips
+the incomplete kinds of both snapshots instead of reporting their objects
+as added or removed.
+
+    python -m <course>.labkit.inventory snapshot before.tsv.gz
+    python -m <course>.labkit.inventory diff before.tsv.gz after.tsv.gz
+"""
+
+import sys
+import gzip
+import json
+import logging
+import argparse
+
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from kubernetes.dynamic.resource import ResourceList
+
+
+# Objects per LIST page
+PAGE_SIZE = 500
+
+# Only the metadata is needed, the API server drops the spec and status
+METADATA_ACCEPT = (
+    "application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1,"
+    "application/json"
+)
+
+# Kinds that change on every run and say nothing about leftovers
+SKIPPED_KINDS = {
+    "Event", "Event.events.k8s.io", "Lease.coordination.k8s.io",
+    "EndpointSlice.discovery.k8s.io", "Endpoints", "PodMetrics.metrics.k8s.io",
+    "NodeMetrics.metrics.k8s.io", "PackageManifest.packages.operators.coreos.com",
+}
+
+HEADER = "# inventory v1"
+INCOMPLETE = "# incomplete"
+
+# LIST attempts of a kind whose continue token expires
+LIST_ATTEMPTS = 3
+
+Row = Tuple[str, str, str, str]
+
+
+def kind_key(resource) -> str:
+    """
+    Return the ``Kind.group`` name of a resource, or the kind for the
+    core group.
+    """
+    return "{}.{}".format(resource.kind, resource.group) if resource.group else resource.kind
+
+
+def list_resources(oc_client, namespaced: Optional[bool] = None, kinds: Optional[List[str]] = None):
+    """
+    Return the listable resources, one preferred version per kind, sorted
+    by ``kind_key``.
+    """
+    resources = {}
+    for resource in oc_client.resources.search():
+        if isinstance(resource, ResourceList):
+            continue
+        verbs = getattr(resource, "verbs", None) or []
+        if "list" not in verbs or "/" in (resource.name or ""):
+            continue
+        if namespaced is not None and resource.namespaced != namespaced:
+            continue
+        key = kind_key(resource)
+        if key in SKIPPED_KINDS and not kinds:
+            continue
+        if kinds and key not in kinds and resource.kind not in kinds:
+            continue
+        current = resources.get(key)
+        if current is None or (resource.preferred and not current.preferred):
+            resources[key] = resource
+    return [resources[key] for key in sorted(resources)]
+
+
+def iter_pages(oc_client, resource, namespace: Optional[str] = None,
+               page_size: int = PAGE_SIZE) -> Iterator[List[dict]]:
+    """
+    Yield the items of a resource one LIST page at a time.
+    """
+    token = None
+    while True:
+        response = oc_client.request(
+            "GET", resource.path(namespace=namespace),
+            limit=page_size, _continue=token,
+            header_params={"Accept": METADATA_ACCEPT},
+            serialize=False,
+        )
+        page = json.loads(response.data)
+        yield page.get("items") or []
+        token = (page.get("metadata") or {}).get("continue")
+        if not token:
+            return
+
+
+def row_key(row: Row) -> Tuple[str, str]:
+    """
+    Sort key of a snapshot row. The API server returns the objects in
+    storage key order, ``<namespace>/<name>``, which differs from sorting
+    the namespace and the name separately (``a-b/x`` sorts before ``a/x``).
+    """
+    return row[0], "{}/{}".format(row[1], row[2])
+
+
+def _list_rows(oc_client, resource, key: str, namespace: Optional[str],
+               page_size: int) -> List[Row]:
+    """
+    Return the rows of one kind, sorted by ``row_key``. The kind is listed
+    again when its continue token expires between two pages.
+    """
+    for attempt in range(1, LIST_ATTEMPTS + 1):
+        rows = []
+        try:
+            for items in iter_pages(oc_client, resource, namespace, page_size):
+                for item in items:
+                    metadata = item.get("metadata") or {}
+                    rows.append((
+                        key, metadata.get("namespace", ""), metadata.get("name", ""),
+                        metadata.get("resourceVersion", ""),
+                    ))
+        except Exception as e:
+            if getattr(e, "status", None) != 410 or attempt == LIST_ATTEMPTS:
+                raise
+            logging.debug("The continue token of {} expired, listing it again".format(key))
+            continue
+        keys = [row_key(row) for row in rows]
+        if any(a > b for a, b in zip(keys, keys[1:])):
+            logging.warning("{} was not listed in key order, sorting it".format(key))
+            rows.sort(key=row_key)
+        return rows
+    return []
+
+
+def iter_rows(oc_client, resources, namespace: Optional[str] = None,
+              page_size: int = PAGE_SIZE, incomplete: Optional[List[str]] = None) -> Iterator[Row]:
+    """
+    Yield the snapshot rows of the resources, sorted by ``row_key``.
+    A kind that cannot be listed raises, or, when an ``incomplete`` list
+    is given, is added to it and yields no rows.
+    """
+    for resource in resources:
+        key = kind_key(resource)
+        try:
+            rows = _list_rows(oc_client, resource, key, namespace, page_size)
+        except Exception as e:
+            if incomplete is None:
+                raise
+            logging.warning("Cannot list {}: {}".format(key, e))
+            incomplete.append(key)
+            continue
+        yield from rows
+
+
+def write_snapshot(path: str, rows: Iterator[Row], incomplete: Iterable[str] = ()) -> int:
+    """
+    Write snapshot rows to a gzip'd file. ``incomplete`` is read after
+    the rows, so it can be filled while they are written. Returns the
+    number of rows.
+    """
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(HEADER + "\n")
+        for row in rows:
+            f.write("\t".join(row) + "\n")
+            count += 1
+        for kind in incomplete:
+            f.write("{}\t{}\n".format(INCOMPLETE, kind))
+    return count
+
+
+def read_snapshot(path: str) -> Iterator[Row]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+            yield tuple(line.rstrip("\n").split("\t"))
+
+
+def incomplete_kinds(path: str) -> Set[str]:
+    """
+    Return the kinds a snapshot could not list.
+    """
+    kinds = set()
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith(INCOMPLETE + "\t"):
+                kinds.add(line.rstrip("\n").split("\t", 1)[1])
+    return kinds
+
+
+def snapshot(oc_client, path: str, namespace: Optional[str] = None,
+             kinds: Optional[List[str]] = None, namespaced: Optional[bool] = None) -> int:
+    """
+    Save an inventory snapshot of the cluster, or of one namespace.
+    The kinds that cannot be listed are recorded as incomplete.
+    """
+    if namespace:
+        namespaced = True
+    resources = list_resources(oc_client, namespaced=namespaced, kinds=kinds)
+    incomplete = []
+    return write_snapshot(path, iter_rows(oc_client, resources, namespace, incomplete=incomplete),
+                          incomplete)
+
+
+def diff(before: Iterator[Row], after: Iterator[Row], changed: bool = False,
+         skip: Iterable[str] = ()) -> Iterator[Tuple[str, Row]]:
+    """
+    Compare two sorted snapshots with a linear merge.
+    Yields ``("+", row)`` for the added objects and ``("-", row)`` for the
+    removed ones. With ``changed``, ``("~", row)`` is yielded for the
+    objects whose resourceVersion changed. The kinds in ``skip``, such as
+    the incomplete kinds of either snapshot, are not compared.
+    """
+    skip = set(skip)
+    before = (row for row in before if row[0] not in skip)
+    after = (row for row in after if row[0] not in skip)
+    sentinel = None
+    old, new = next(before, sentinel), next(after, sentinel)
+    while old is not sentinel or new is not sentinel:
+        old_key = row_key(old) if old is not sentinel else None
+        new_key = row_key(new) if new is not sentinel else None
+        if new_key is None or (old_key is not None and old_key < new_key):
+            yield "-", old
+            old = next(before, sentinel)
+        elif old_key is None or new_key < old_key:
+            yield "+", new
+            new = next(after, sentinel)
+        else:
+            if changed and old[3] != new[3]:
+                yield "~", new
+            old, new = next(before, sentinel), next(after, sentinel)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cluster inventory snapshots")
+    subparsers = parser.add_subparsers(dest="command")
+    parser_snapshot = subparsers.add_parser("snapshot", help="save a snapshot")
+    parser_snapshot.add_argument("path")
+    parser_snapshot.add_argument("--namespace", "-n")
+    parser_snapshot.add_argument("--kinds", help="comma separated kinds")
+    parser_diff = subparsers.add_parser("diff", help="compare two snapshots")
+    parser_diff.add_argument("before")
+    parser_diff.add_argument("after")
+    parser_diff.add_argument("--changed", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command == "snapshot":
+        from kubernetes import config, dynamic
+        oc_client = dynamic.DynamicClient(config.new_client_from_config())
+        kinds = args.kinds.split(",") if args.kinds else None
+        count = snapshot(oc_client, args.path, args.namespace, kinds)
+        print("{} objects".format(count), file=sys.stderr)
+        return 0
+    if args.command == "diff":
+        found = False
+        skip = incomplete_kinds(args.before) | incomplete_kinds(args.after)
+        for kind in sorted(skip):
+            print("{} is incomplete, not compared".format(kind), file=sys.stderr)
+        for op, row in diff(read_snapshot(args.before), read_snapshot(args.after), args.changed,
+                            skip):
+            found = True
+            print("{} {}".format(op, "\t".join(row[:3])))
+        return 1 if found else 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Isolated kubeconfig for each lab run
+
+``oc login`` and ``oc logout`` rewrite the kubeconfig file, so two lab
+verbs running at the same time on the workstation corrupt each other's
+context, and a lab that logs in as an administrator leaves the student
+logged in as that user.
+
+``isolate()`` copies the current kubeconfig to a private temporary file
+and exports it in ``KUBECONFIG``. The Python tasks, the commands run with
+``run_command`` and the playbooks run with ``run_playbook`` all inherit
+the environment of the lab process, so every login and logout of the run
+goes to the copy. The user's kubeconfig is never written. The copy is
+removed when the process exits.
+"""
+
+import os
+import atexit
+import shutil
+import logging
+import tempfile
+import contextlib
+
+from typing import Optional
+
+
+DEFAULT_KUBECONFIG = os.path.expanduser("~/.kube/config")
+
+_isolated = None
+
+
+def source_path() -> Optional[str]:
+    """
+    Return the kubeconfig file currently in use, if it exists.
+    """
+    for path in os.environ.get("KUBECONFIG", DEFAULT_KUBECONFIG).split(os.pathsep):
+        if path and os.path.isfile(path):
+            return path
+    return None
+
+
+def _remove(directory: str):
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def isolate() -> str:
+    """
+    Export a private copy of the current kubeconfig in ``KUBECONFIG``.
+    Calling it again in the same process returns the same copy.
+    """
+    global _isolated
+    if _isolated and os.environ.get("KUBECONFIG") == _isolated:
+        return _isolated
+
+    # A child process copies the isolated file of its parent, which the
+    # parent removes when it exits
+    source = source_path()
+    directory = tempfile.mkdtemp(prefix="lab-kube-")
+    path = os.path.join(directory, "config")
+    if source:
+        shutil.copyfile(source, path)
+    else:
+        open(path, "w").close()
+    os.chmod(path, 0o600)
+    atexit.register(_remove, directory)
+
+    os.environ["KUBECONFIG"] = path
+    _isolated = path
+    logging.debug("Using the isolated kubeconfig {} copied from {}".format(path, source))
+    return path
+
+
+@contextlib.contextmanager
+def isolated():
+    """
+    Run a block with its own kubeconfig, then restore the environment.
+    """
+    global _isolated
+    previous, previous_isolated = os.environ.get("KUBECONFIG"), _isolated
+    _isolated = None
+    path = isolate()
+    try:
+        yield path
+    finally:
+        if previous is None:
+            os.environ.pop("KUBECONFIG", None)
+        else:
+            os.environ["KUBECONFIG"] = previous
+        _isolated = previous_isolated
+        _remove(os.path.dirname(path))
@@ -0,0 +1,234 @@
+"""
+Detect the resources a lab leaves behind after ``finish``
+
+``start`` records a baseline: an inventory snapshot of the cluster-scoped
+kinds the lab creates, such as its namespace and NodeNetworkConfigurationPolicy
+objects, and the node labels it sets. ``finish`` takes the same snapshot
+again and compares it with the baseline.
+
+Operators, other labs and the student also create cluster objects while
+the lab runs, so an object that appeared since ``start`` is only blamed
+on the lab when the lab owns it: its name is declared by the lab, or it
+carries the ``LAB_LABEL`` label with the lab name. Only those objects are
+reported, and optionally deleted.
+"""
+
+import os
+import json
+import logging
+
+from typing import Dict, List, Optional, Set
+
+from kubernetes.dynamic.exceptions import NotFoundError
+
+from . import inventory
+from .nodes import NodeInventory
+
+
+STATE_DIR = os.path.expanduser("~/.cache/labs/leftovers")
+
+# Delete the leftovers instead of only reporting them
+PURGE = os.environ.get("LAB_PURGE_LEFTOVERS", "") == "1"
+
+# Cluster-scoped kinds a lab commonly creates. Namespaced objects go away
+# with the lab namespaces.
+DEFAULT_KINDS = [
+    "Namespace",
+    "NodeNetworkConfigurationPolicy.nmstate.io",
+    "PersistentVolume",
+]
+
+# Label that marks the objects created by a lab, the value is the lab name
+LAB_LABEL = "labs.example.com/lab"
+
+
+def _paths(lab: str) -> Dict[str, str]:
+    return {
+        "snapshot": os.path.join(STATE_DIR, "{}.start.tsv.gz".format(lab)),
+        "labels": os.path.join(STATE_DIR, "{}.labels.json".format(lab)),
+    }
+
+
+def _node_labels(oc_client, keys: List[str]) -> Dict[str, Dict[str, str]]:
+    nodes = NodeInventory(oc_client)
+    return {
+        name: {key: labels[key] for key in keys if key in labels}
+        for name, labels in nodes.nodes.items()
+    }
+
+
+def record(oc_client, lab: str, kinds: List[str] = DEFAULT_KINDS, label_keys: List[str] = (),
+           owned: Optional[Dict[str, List[str]]] = None):
+    """
+    Save the baseline of a lab before ``start`` creates anything.
+    ``owned`` maps a kind to the names of the objects the lab creates.
+    """
+    os.makedirs(STATE_DIR, exist_ok=True)
+    paths = _paths(lab)
+    count = inventory.snapshot(oc_client, paths["snapshot"], kinds=kinds, namespaced=False)
+    with open(paths["labels"], "w") as f:
+        json.dump({
+            "kinds": kinds,
+            "label_keys": list(label_keys),
+            "owned": owned or {},
+            "nodes": _node_labels(oc_client, list(label_keys)),
+        }, f)
+    logging.debug("Recorded {} objects for {}".format(count, lab))
+
+
+def _labeled(oc_client, lab: str, kind: str) -> Set[str]:
+    """
+    Return the names of the objects of a kind that carry the lab label.
+    """
+    resources = inventory.list_resources(oc_client, namespaced=False, kinds=[kind])
+    if not resources:
+        return set()
+    items = resources[0].get(label_selector="{}={}".format(LAB_LABEL, lab)).items
+    return {obj.metadata.name for obj in items}
+
+
+def find(oc_client, lab: str) -> List[Dict]:
+    """
+    Return what the lab created since its baseline and still exists.
+    Each leftover is a dict with ``kind``, ``name`` and, for node labels,
+    ``label``.
+    """
+    paths = _paths(lab)
+    if not os.path.exists(paths["snapshot"]):
+        raise FileNotFoundError("No baseline recorded for {}".format(lab))
+    with open(paths["labels"]) as f:
+        state = json.load(f)
+
+    current = paths["snapshot"].replace(".start.", ".finish.")
+    inventory.snapshot(oc_client, current, kinds=state["kinds"], namespaced=False)
+    owned = state.get("owned", {})
+    labeled = {}
+    leftovers = []
+    skip = inventory.incomplete_kinds(paths["snapshot"]) | inventory.incomplete_kinds(current)
+    for op, row in inventory.diff(inventory.read_snapshot(paths["snapshot"]),
+                                  inventory.read_snapshot(current), skip=skip):
+        if op != "+":
+            continue
+        kind, name = row[0], row[2]
+        if name not in owned.get(kind, []) and name not in owned.get(kind.split(".")[0], []):
+            if kind not in labeled:
+                labeled[kind] = _labeled(oc_client, lab, kind)
+            if name not in labeled[kind]:
+                continue
+        leftovers.append({"kind": kind, "name": name})
+
+    before = state["nodes"]
+    for name, labels in _node_labels(oc_client, state["label_keys"]).items():
+        for key, value in labels.items():
+            if before.get(name, {}).get(key) != value:
+                leftovers.append({"kind": "Node", "name": name, "label": key})
+    return leftovers
+
+
+def _terminating(oc_client, leftover: Dict) -> bool:
+    if leftover["kind"] != "Namespace":
+        return False
+    v1_namespaces = oc_client.resources.get(api_version="v1", kind="Namespace")
+    try:
+        return v1_namespaces.get(name=leftover["name"]).status.phase == "Terminating"
+    except NotFoundError:
+        return True
+
+
+def purge(oc_client, leftovers: List[Dict]) -> List[str]:
+    """
+    Delete the leftovers. Returns the ones that could not be deleted.
+    """
+    resources = {
+        inventory.kind_key(resource): resource
+        for resource in inventory.list_resources(oc_client, namespaced=False)
+    }
+    failed = []
+    for leftover in leftovers:
+        try:
+            if "label" in leftover:
+                v1_nodes = oc_client.resources.get(api_version="v1", kind="Node")
+                v1_nodes.patch(
+                    name=leftover["name"],
+                    body={"metadata": {"labels": {leftover["label"]: None}}},
+                    content_type="application/merge-patch+json",
+                )
+            else:
+                resources[leftover["kind"]].delete(name=leftover["name"])
+        except Exception as e:
+            logging.debug("Cannot delete {}: {}".format(describe(leftover), e))
+            failed.append(describe(leftover))
+    return failed
+
+
+def describe(leftover: Dict) -> str:
+    if "label" in leftover:
+        return "the '{}' label on the '{}' node".format(leftover["label"], leftover["name"])
+    return "{} '{}'".format(leftover["kind"].split(".")[0], leftover["name"])
+
+
+############################################################################
+# Lab tasks
+
+def record_baseline(item: Dict):
+    """
+    Record the baseline of a lab, before it creates any resource.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * ``lab`` is the lab name
+    * (optional) ``kinds`` is the list of cluster-scoped kinds to track
+    * (optional) ``label_keys`` is the list of node label keys to track
+    * (optional) ``owned`` maps a kind to the names of the objects the lab
+      creates. Objects with the ``LAB_LABEL`` label are also the lab's.
+    """
+    item["failed"] = False
+    try:
+        record(item["oc_client"], item["lab"], item.get("kinds", DEFAULT_KINDS),
+               item.get("label_keys", []), item.get("owned"))
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot record the cluster state"}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+    return item
+
+
+def check_leftovers(item: Dict):
+    """
+    Report, and optionally delete, the resources left behind by a lab.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * ``lab`` is the lab name
+    * (optional) ``purge`` deletes the leftovers. By default, only when
+      the ``LAB_PURGE_LEFTOVERS`` environment variable is set to ``1``
+    """
+    item["failed"] = False
+    lab = item["lab"]
+    oc_client = item["oc_client"]
+    try:
+        leftovers = [
+            leftover for leftover in find(oc_client, lab)
+            if not _terminating(oc_client, leftover)
+        ]
+    except FileNotFoundError:
+        # The lab was started before the baseline existed
+        return item
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot compare the cluster state with the start of the lab"}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+        return item
+
+    if leftovers and item.get("purge", PURGE):
+        remaining = purge(oc_client, leftovers)
+        if remaining:
+            item["failed"] = True
+            item["msgs"] = [{"text": "Cannot delete {}".format(name)} for name in remaining]
+    elif leftovers:
+        item["failed"] = True
+        item["msgs"] = [
+            {"text": "Left behind by {}: {}".format(lab, describe(leftover))}
+            for leftover in leftovers
+        ]
+    for leftover in leftovers:
+        logging.info("Left behind by {}: {}".format(lab, describe(leftover)))
+    return item
@@ -0,0 +1,286 @@
+"""
+HTTP load generator for the lab applications
+
+Sends requests from one process with asyncio, instead of one ``curl``
+process per request. Each worker keeps its HTTP/1.1 connection open
+between requests. The load is shaped by:
+
+* ``concurrency``: the number of workers, so of open connections
+* ``rps``: the target rate of requests per second, for all workers
+* ``duration`` and ``requests``: when to stop, the first reached
+
+The result holds a latency histogram and the count of every status code
+and error. From the command line:
+
+    python -m <course>.labkit.loadgen -c 10 --rps 50 -d 60 \\
+        http://books-console-apps.apps.ocp4.example.com/leak
+"""
+
+import sys
+import ssl
+import time
+import asyncio
+import argparse
+
+from collections import Counter
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from .metrics import Histogram
+
+
+DEFAULT_TIMEOUT = 10
+
+# Seconds of load for a step that sets neither a duration nor requests
+DEFAULT_DURATION = 30
+
+
+class LoadResult:
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.seconds = 0.0
+
+    @property
+    def count(self) -> int:
+        return self.latency.count + sum(self.errors.values())
+
+    def summary(self) -> str:
+        rate = self.count / self.seconds if self.seconds else 0.0
+        statuses = ", ".join("{}: {}".format(k, v) for k, v in sorted(self.statuses.items()))
+        errors = ", ".join("{}: {}".format(k, v) for k, v in sorted(self.errors.items()))
+        if self.latency.count:
+            latency = "p50<={}s p95<={}s p99<={}s".format(
+                self.latency.quantile(0.5), self.latency.quantile(0.95), self.latency.quantile(0.99))
+        else:
+            latency = "no answer"
+        return "{} requests in {:.1f}s ({:.1f}/s), {}, status {}{}".format(
+            self.count, self.seconds, rate, latency,
+            statuses or "none", ", errors " + errors if errors else "",
+        )
+
+
+class _Connection:
+    """
+    A keep-alive HTTP/1.1 connection, reopened when the server closes it.
+    """
+
+    def __init__(self, url: str, timeout: float):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.https = parts.scheme == "https"
+        self.port = parts.port or (443 if self.https else 80)
+        self.path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        self.host_header = parts.netloc
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def _open(self):
+        context = None
+        if self.https:
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=context)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def _read_body(self, headers: Dict[str, str]) -> bool:
+        """
+        Read and drop the body. Returns False when the connection cannot
+        be reused.
+        """
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0].strip() or b"0", 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    return True
+        if "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+            return headers.get("connection", "").lower() != "close"
+        await self.reader.read()
+        return False
+
+    async def _send(self, method: str) -> bytes:
+        """
+        Send the request and return the status line. A kept-alive
+        connection the server closed while idle is reopened, and the
+        request sent again once.
+        """
+        reused = self.writer is not None
+        if not reused:
+            await self._open()
+        try:
+            self.writer.write(
+                "{} {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: lab-loadgen\r\nAccept: */*\r\n\r\n".format(
+                    method, self.path, self.host_header).encode("ascii"))
+            await self.writer.drain()
+            status_line = await self.reader.readline()
+        except ConnectionError:
+            if not reused:
+                raise
+            status_line = b""
+        if not status_line and reused:
+            self.close()
+            return await self._send(method)
+        if not status_line:
+            raise ConnectionResetError("connection closed")
+        return status_line
+
+    async def request(self, method: str) -> int:
+        status_line = await self._send(method)
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            reusable = True
+        else:
+            reusable = await self._read_body(headers)
+        if not reusable:
+            self.close()
+        return status
+
+    async def timed_request(self, method: str) -> int:
+        try:
+            return await asyncio.wait_for(self.request(method), self.timeout)
+        except BaseException:
+            # A half-read response leaves the connection unusable
+            self.close()
+            raise
+
+
+async def _run(url: str, concurrency: int, rps: Optional[float], duration: Optional[float],
+               requests: Optional[int], method: str, timeout: float) -> LoadResult:
+    result = LoadResult()
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+    issued = 0
+
+    def next_slot() -> Optional[float]:
+        """
+        Reserve the next request, returns when to send it, or None when
+        the run is over.
+        """
+        nonlocal issued
+        if requests is not None and issued >= requests:
+            return None
+        slot = start + issued / rps if rps else time.perf_counter()
+        if deadline is not None and slot >= deadline:
+            return None
+        issued += 1
+        return slot
+
+    async def worker():
+        connection = _Connection(url, timeout)
+        try:
+            while True:
+                slot = next_slot()
+                if slot is None:
+                    return
+                delay = slot - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                began = time.perf_counter()
+                try:
+                    status = await connection.timed_request(method)
+                except asyncio.TimeoutError:
+                    result.errors["timeout"] += 1
+                    continue
+                except (OSError, ValueError, IndexError, asyncio.IncompleteReadError) as e:
+                    result.errors[e.__class__.__name__] += 1
+                    continue
+                result.latency.observe(time.perf_counter() - began)
+                result.statuses[status] += 1
+        finally:
+            connection.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def run(url: str, concurrency: int = 10, rps: Optional[float] = None,
+        duration: Optional[float] = None, requests: Optional[int] = None,
+        method: str = "GET", timeout: float = DEFAULT_TIMEOUT) -> LoadResult:
+    """
+    Send load to ``url`` until ``duration`` seconds or ``requests``
+    requests, whichever comes first. One of them is required.
+    """
+    if duration is None and requests is None:
+        raise ValueError("A duration or a number of requests is required")
+    return asyncio.run(_run(url, max(1, concurrency), rps, duration, requests, method, timeout))
+
+
+############################################################################
+# Lab tasks
+
+def generate_load(item: Dict):
+    """
+    Send HTTP load to an application.
+    The following parameters are used:
+    * ``url`` is the URL to request
+    * (optional) ``concurrency``, 10 by default
+    * (optional) ``rps``, the target requests per second, unlimited by default
+    * (optional) ``duration`` in seconds and ``requests``, when to stop.
+      Without either, the load lasts ``DEFAULT_DURATION`` seconds.
+    * (optional) ``max_error_rate``, the share of failed requests allowed,
+      0.1 by default. 5xx answers count as failures.
+    The result is stored in ``item["load"]``.
+    """
+    item["failed"] = False
+    duration = item.get("duration")
+    if duration is None and item.get("requests") is None:
+        duration = DEFAULT_DURATION
+    try:
+        result = run(
+            item["url"],
+            concurrency=item.get("concurrency", 10),
+            rps=item.get("rps"),
+            duration=duration,
+            requests=item.get("requests"),
+        )
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot send load to {}".format(item["url"])}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+        return item
+    item["load"] = result
+    failures = sum(result.errors.values()) + sum(
+        count for status, count in result.statuses.items() if status >= 500)
+    if not result.count or failures / result.count > item.get("max_error_rate", 0.1):
+        item["failed"] = True
+        item["msgs"] = [{"text": "Load on {}: {}".format(item["url"], result.summary())}]
+    return item
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send HTTP load to a lab application")
+    parser.add_argument("url")
+    parser.add_argument("-c", "--concurrency", type=int, default=10)
+    parser.add_argument("--rps", type=float, help="target requests per second")
+    parser.add_argument("-d", "--duration", type=float, help="seconds")
+    parser.add_argument("-n", "--requests", type=int, help="number of requests")
+    parser.add_argument("-X", "--method", default="GET")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    args = parser.parse_args(argv)
+    if args.duration is None and args.requests is None:
+        parser.error("one of --duration or --requests is required")
+
+    result = run(args.url, args.concurrency, args.rps, args.duration, args.requests,
+                 args.method, args.timeout)
+    print(result.summary())
+    return 0 if result.latency.count else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
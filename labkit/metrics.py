@@ -0,0 +1,281 @@
+"""
+Client-side metrics of the API requests made by a lab run
+
+Every request of the Kubernetes client updates, per verb and resource:
+
+* a latency histogram
+* the bytes received and sent
+* the request count by status code
+* a counter of throttled requests (429) and unavailable answers (503)
+* a counter of retries, a request that repeats one that was throttled or
+  failed
+* the number of requests in flight, and its maximum
+
+The metrics are written in the Prometheus text format when the process
+exits, ready for the node exporter textfile collector, and summarized in
+one line of the debug log. Recording a request is a few dictionary
+updates, so the metrics are always on.
+"""
+
+import os
+import sys
+import time
+import atexit
+import logging
+import tempfile
+import threading
+
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from . import requesthooks
+
+
+METRICS_DIR = os.environ.get("LAB_METRICS_DIR", os.path.expanduser("~/.cache/labs/metrics"))
+
+# Latency buckets in seconds, the same as the API server ones
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+THROTTLED_CODES = {429, 503}
+
+VERBS = ("start", "grade", "finish", "fix")
+
+
+def request_labels(entry: Dict) -> Tuple[str, str]:
+    """
+    Return the (verb, resource) of a request from its method and path.
+    """
+    parts = [p for p in entry["path"].split("/") if p]
+    if parts[:1] == ["api"]:
+        rest, group = parts[2:], ""
+    elif parts[:1] == ["apis"]:
+        rest, group = parts[3:], parts[1] if len(parts) > 1 else ""
+    else:
+        return entry["method"].lower(), entry["path"] or "/"
+    if len(rest) >= 3 and rest[0] == "namespaces":
+        rest = rest[2:]
+    if not rest:
+        resource, name = "discovery", None
+    else:
+        resource, name = rest[0], rest[1] if len(rest) > 1 else None
+        if len(rest) > 2:
+            resource = "{}/{}".format(resource, rest[2])
+    if group:
+        resource = "{}.{}".format(resource, group)
+
+    method = entry["method"].upper()
+    if method == "GET":
+        if "watch=true" in (entry.get("query") or "").lower():
+            verb = "watch"
+        else:
+            verb = "get" if name else "list"
+    else:
+        verb = {"POST": "create", "PUT": "update", "PATCH": "patch",
+                "DELETE": "delete"}.get(method, method.lower())
+        if verb == "delete" and not name:
+            verb = "deletecollection"
+    return verb, resource
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Return the upper bound of the bucket that holds the quantile.
+        """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class ClientMetrics:
+    """
+    Aggregate the requests observed by ``requesthooks``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = defaultdict(Histogram)
+        self.requests = defaultdict(int)
+        self.bytes_in = defaultdict(int)
+        self.bytes_out = defaultdict(int)
+        self.throttled = defaultdict(int)
+        self.retries = 0
+        self.in_flight = 0
+        self.in_flight_max = 0
+        self._failed = {}
+        self.start = time.time()
+
+    def on_start(self, entry: Dict):
+        key = (entry["method"], entry["path"])
+        with self._lock:
+            self.in_flight += 1
+            self.in_flight_max = max(self.in_flight_max, self.in_flight)
+            if self._failed.pop(key, None):
+                self.retries += 1
+
+    def on_done(self, entry: Dict):
+        labels = request_labels(entry)
+        status = entry.get("status")
+        with self._lock:
+            self.in_flight -= 1
+            # Watches stay open for minutes, their latency is the time to
+            # the first byte and is still meaningful
+            self.latency[labels].observe(entry.get("seconds") or 0.0)
+            self.requests[labels + (str(status or "error"),)] += 1
+            self.bytes_in[labels] += entry.get("bytes") or 0
+            self.bytes_out[labels] += entry.get("bytes_out") or 0
+            if status in THROTTLED_CODES:
+                self.throttled[str(status)] += 1
+            if status in THROTTLED_CODES or entry.get("error") and not status:
+                self._failed[(entry["method"], entry["path"])] = True
+
+    def install(self):
+        requesthooks.add_start(self.on_start)
+        requesthooks.add(self.on_done)
+        return self
+
+    def uninstall(self):
+        requesthooks.remove(self.on_start)
+        requesthooks.remove(self.on_done)
+
+    def summary(self) -> str:
+        with self._lock:
+            total = Histogram()
+            for histogram in self.latency.values():
+                total.count += histogram.count
+                total.sum += histogram.sum
+                total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+            p50, p95 = total.quantile(0.5), total.quantile(0.95)
+            return (
+                "API: {} requests in {:.1f}s, {:.1f}s in requests, p50<={}s p95<={}s, "
+                "{} KiB in, {} KiB out, {} throttled, {} retries, {} max in flight".format(
+                    total.count, time.time() - self.start, total.sum, p50, p95,
+                    sum(self.bytes_in.values()) // 1024, sum(self.bytes_out.values()) // 1024,
+                    sum(self.throttled.values()), self.retries, self.in_flight_max,
+                )
+            )
+
+    def prometheus(self, labels: Optional[Dict[str, str]] = None) -> str:
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        common = dict(labels or {})
+
+        def fmt(extra: Dict[str, str]) -> str:
+            merged = dict(common, **extra)
+            return "{" + ",".join(
+                '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                for k, v in sorted(merged.items())
+            ) + "}"
+
+        lines = []
+        with self._lock:
+            lines.append("# HELP lab_api_request_duration_seconds Time to the response headers.")
+            lines.append("# TYPE lab_api_request_duration_seconds histogram")
+            for (verb, resource), histogram in sorted(self.latency.items()):
+                base = {"verb": verb, "resource": resource}
+                cumulated = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulated += count
+                    lines.append("lab_api_request_duration_seconds_bucket{} {}".format(
+                        fmt(dict(base, le=str(bound))), cumulated))
+                lines.append("lab_api_request_duration_seconds_bucket{} {}".format(
+                    fmt(dict(base, le="+Inf")), histogram.count))
+                lines.append("lab_api_request_duration_seconds_sum{} {:.6f}".format(fmt(base), histogram.sum))
+                lines.append("lab_api_request_duration_seconds_count{} {}".format(fmt(base), histogram.count))
+
+            lines.append("# HELP lab_api_requests_total API requests by status code.")
+            lines.append("# TYPE lab_api_requests_total counter")
+            for (verb, resource, code), count in sorted(self.requests.items()):
+                lines.append("lab_api_requests_total{} {}".format(
+                    fmt({"verb": verb, "resource": resource, "code": code}), count))
+
+            for name, values, help_text in (
+                ("lab_api_response_bytes_total", self.bytes_in, "Bytes received from the API server."),
+                ("lab_api_request_bytes_total", self.bytes_out, "Bytes sent to the API server."),
+            ):
+                lines.append("# HELP {} {}".format(name, help_text))
+                lines.append("# TYPE {} counter".format(name))
+                for (verb, resource), value in sorted(values.items()):
+                    lines.append("{}{} {}".format(name, fmt({"verb": verb, "resource": resource}), value))
+
+            lines.append("# HELP lab_api_throttled_total Requests answered with 429 or 503.")
+            lines.append("# TYPE lab_api_throttled_total counter")
+            for code in sorted(THROTTLED_CODES):
+                lines.append("lab_api_throttled_total{} {}".format(
+                    fmt({"code": str(code)}), self.throttled.get(str(code), 0)))
+
+            lines.append("# HELP lab_api_retries_total Requests repeating a throttled or failed one.")
+            lines.append("# TYPE lab_api_retries_total counter")
+            lines.append("lab_api_retries_total{} {}".format(fmt({}), self.retries))
+
+            lines.append("# HELP lab_api_inflight_requests Requests in flight.")
+            lines.append("# TYPE lab_api_inflight_requests gauge")
+            lines.append("lab_api_inflight_requests{} {}".format(fmt({}), self.in_flight))
+            lines.append("# HELP lab_api_inflight_requests_max Most requests in flight at once.")
+            lines.append("# TYPE lab_api_inflight_requests_max gauge")
+            lines.append("lab_api_inflight_requests_max{} {}".format(fmt({}), self.in_flight_max))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, labels: Optional[Dict[str, str]] = None):
+        """
+        Write the text file atomically, so a collector never reads half of it.
+        """
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".lab-metrics-")
+        with os.fdopen(fd, "w") as f:
+            f.write(self.prometheus(labels))
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+
+_metrics: Optional[ClientMetrics] = None
+
+
+def current_verb() -> str:
+    """
+    Return the lab verb this process runs, from ``lab <verb> <lab>``.
+    """
+    argv = sys.argv[1:3]
+    return argv[0] if argv and argv[0] in VERBS else "unknown"
+
+
+def enable(lab: str) -> ClientMetrics:
+    """
+    Start collecting the metrics of this process. They are written to
+    ``<METRICS_DIR>/<lab>.prom`` when the process exits.
+    """
+    global _metrics
+    if _metrics is not None:
+        return _metrics
+    _metrics = ClientMetrics().install()
+    labels = {"lab": lab, "lab_verb": current_verb()}
+
+    def finish():
+        logging.debug(_metrics.summary())
+        try:
+            _metrics.write(os.path.join(METRICS_DIR, "{}.prom".format(lab)), labels)
+        except OSError as e:
+            logging.debug("Cannot write the API metrics: {}".format(e))
+
+    atexit.register(finish)
+    return _metrics
@@ -0,0 +1,274 @@
+"""
+Connectivity matrix for the NetworkPolicy labs
+
+Checking which sources reach which destinations used to take one
+``oc exec ... curl`` per pair. Here, every source namespace gets one
+long-lived probe pod, labeled like the workload it stands for. The pod
+receives the whole list of destinations in a single exec session, and
+connects to all of them in parallel. N sources and M destinations cost N
+exec sessions instead of N x M, and the sources run concurrently.
+
+Each pair ends up in one of these states:
+
+* ``allowed``: the connection was accepted
+* ``refused``: the packets got through but nothing listens on the port
+* ``denied``: no answer before the timeout, which is how OVN-Kubernetes
+  drops the traffic a NetworkPolicy does not allow
+* ``error``: the probe could not run
+
+The matrix is compared with the expected policy: every pair is either
+allowed or denied.
+"""
+
+import time
+import shlex
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from kubernetes.dynamic.exceptions import ConflictError, NotFoundError
+
+from . import rawapi
+from .watches import wait_deleted, wait_objects
+
+
+PROBE_POD = "lab-netprobe"
+PROBE_IMAGE = "registry.ocp4.example.com:8443/ubi9/ubi-minimal:latest"
+
+# The image runs as root. Set a user, the anyuid SCC that the admin client
+# may get does not assign one, and runAsNonRoot then rejects the container.
+PROBE_USER = 1001
+
+# Seconds each connection attempt waits before the pair counts as denied
+CONNECT_TIMEOUT = 3
+
+
+class Source(NamedTuple):
+    namespace: str
+    labels: Dict[str, str] = {}
+
+
+class Target(NamedTuple):
+    name: str
+    address: str
+    port: int
+
+
+def _probe_pod(labels: Dict[str, str], image: str) -> Dict:
+    return {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {
+            "name": PROBE_POD,
+            "labels": {**labels, "app.kubernetes.io/name": PROBE_POD},
+        },
+        "spec": {
+            "terminationGracePeriodSeconds": 0,
+            "containers": [{
+                "name": "probe",
+                "image": image,
+                "command": ["sleep", "infinity"],
+                "securityContext": {
+                    "allowPrivilegeEscalation": False,
+                    "runAsNonRoot": True,
+                    "runAsUser": PROBE_USER,
+                    "capabilities": {"drop": ["ALL"]},
+                    "seccompProfile": {"type": "RuntimeDefault"},
+                },
+            }],
+        },
+    }
+
+
+def _ready(pod: Dict) -> bool:
+    return any(
+        c.get("type") == "Ready" and c.get("status") == "True"
+        for c in (pod.get("status") or {}).get("conditions") or []
+    )
+
+
+def ensure_probe(oc_client, source: Source, image: str = PROBE_IMAGE, timeout: int = 120) -> bool:
+    """
+    Start the probe pod of a source namespace, or reuse the running one
+    and relabel it for the source. A probe pod that is still terminating
+    is waited for, then replaced. Returns True once it is ready.
+    """
+    deadline = time.time() + timeout
+    pods = oc_client.resources.get(api_version="v1", kind="Pod")
+    current = rawapi.get(oc_client, "v1", "Pod", PROBE_POD, source.namespace)
+    if current is not None and current["metadata"].get("deletionTimestamp"):
+        logging.debug("Waiting for the old probe pod in {}".format(source.namespace))
+        if wait_deleted(oc_client, "v1", "Pod", source.namespace, [PROBE_POD], timeout):
+            return False
+        current = None
+    if current is not None:
+        labels = current["metadata"].get("labels") or {}
+        if any(labels.get(k) != v for k, v in source.labels.items()):
+            pods.patch(name=PROBE_POD, namespace=source.namespace,
+                       body={"metadata": {"labels": dict(source.labels)}},
+                       content_type="application/merge-patch+json")
+    else:
+        try:
+            pods.create(namespace=source.namespace, body=_probe_pod(source.labels, image))
+        except ConflictError:
+            # The previous probe pod was deleted after it was read
+            logging.debug("Waiting for the old probe pod in {}".format(source.namespace))
+            if wait_deleted(oc_client, "v1", "Pod", source.namespace, [PROBE_POD],
+                            max(1, int(deadline - time.time()))):
+                return False
+            pods.create(namespace=source.namespace, body=_probe_pod(source.labels, image))
+    seen = wait_objects(oc_client, "v1", "Pod", source.namespace, [PROBE_POD],
+                        done=_ready,
+                        failed=lambda o: (o.get("status") or {}).get("phase") == "Failed",
+                        timeout=max(1, int(deadline - time.time())))
+    return _ready(seen.get(PROBE_POD, {}))
+
+
+def remove_probes(oc_client, namespaces: List[str]):
+    pods = oc_client.resources.get(api_version="v1", kind="Pod")
+    for namespace in namespaces:
+        try:
+            pods.delete(name=PROBE_POD, namespace=namespace)
+        except NotFoundError:
+            pass
+
+
+def _script(targets: List[Target], connect_timeout: int) -> str:
+    """
+    Return a bash script that connects to all the targets in parallel and
+    prints ``<index> <exit code>`` for each of them.
+    """
+    lines = []
+    for index, target in enumerate(targets):
+        connect = "</dev/tcp/{}/{}".format(target.address, int(target.port))
+        lines.append("(timeout {} bash -c {} 2>/dev/null; echo {} $?) &".format(
+            connect_timeout, shlex.quote(connect), index))
+    lines.append("wait")
+    return "\n".join(lines)
+
+
+def _state(code: int) -> str:
+    if code == 0:
+        return "allowed"
+    if code == 124:
+        return "denied"
+    if code == 1:
+        return "refused"
+    return "error"
+
+
+def probe_from(oc_client, source: Source, targets: List[Target],
+               connect_timeout: int = CONNECT_TIMEOUT) -> Dict[str, str]:
+    """
+    Run one exec session in the probe pod of the source.
+    Returns {target name: state}.
+    """
+    from kubernetes import client
+    from kubernetes.stream import stream
+
+    api = client.CoreV1Api(oc_client.client)
+    output = stream(
+        api.connect_get_namespaced_pod_exec, PROBE_POD, source.namespace,
+        command=["bash", "-c", _script(targets, connect_timeout)],
+        stderr=True, stdin=False, stdout=True, tty=False,
+        _request_timeout=connect_timeout + 30,
+    )
+    states = {target.name: "error" for target in targets}
+    for line in output.splitlines():
+        words = line.split()
+        if len(words) == 2 and words[0].isdigit() and int(words[0]) < len(targets):
+            states[targets[int(words[0])].name] = _state(int(words[1]))
+    return states
+
+
+def matrix(oc_client, sources: List[Source], targets: List[Target],
+           image: str = PROBE_IMAGE, connect_timeout: int = CONNECT_TIMEOUT) -> Dict[Tuple[str, str], str]:
+    """
+    Return the {(source namespace, target name): state} matrix. The
+    sources are probed concurrently.
+    """
+    names = [target.name for target in targets]
+    if len(set(names)) != len(names):
+        raise ValueError("The target names are not unique: {}".format(", ".join(sorted(
+            {name for name in names if names.count(name) > 1}))))
+    def run(source: Source) -> Dict[Tuple[str, str], str]:
+        try:
+            if not ensure_probe(oc_client, source, image):
+                raise RuntimeError("the probe pod is not ready")
+            states = probe_from(oc_client, source, targets, connect_timeout)
+        except Exception as e:
+            logging.debug("Cannot probe from {}: {}".format(source.namespace, e))
+            states = {target.name: "error" for target in targets}
+        return {(source.namespace, name): state for name, state in states.items()}
+
+    # Resolve the kinds before the threads use the discovery cache
+    oc_client.resources.get(api_version="v1", kind="Pod")
+    result = {}
+    with ThreadPoolExecutor(max_workers=max(len(sources), 1)) as executor:
+        for states in executor.map(run, sources):
+            result.update(states)
+    return result
+
+
+def compare(result: Dict[Tuple[str, str], str],
+            expected: Dict[Tuple[str, str], bool]) -> List[str]:
+    """
+    Return a message for every pair whose state differs from the
+    expected one.
+    """
+    msgs = []
+    for (source, target), allowed in sorted(expected.items()):
+        state = result.get((source, target), "error")
+        if state == "error":
+            msgs.append("Cannot test the traffic from '{}' to '{}'".format(source, target))
+        elif state == "refused":
+            msgs.append("Nothing listens on '{}' for the traffic from '{}'".format(target, source))
+        elif (state == "allowed") != allowed:
+            msgs.append("The traffic from '{}' to '{}' is {}, but it should be {}".format(
+                source, target, state, "allowed" if allowed else "denied"))
+    return msgs
+
+
+def pod_targets(oc_client, namespace: str, label_selector: str, port: int,
+                name: Optional[str] = None) -> List[Target]:
+    """
+    Return a target for each running pod that matches the selector, from
+    one list of the pods. The targets are named ``<namespace>/<pod>``, or
+    ``<name>/<pod>`` when ``name`` is given, so every pod is graded.
+    """
+    pods = rawapi.get(oc_client, "v1", "Pod", namespace=namespace, label_selector=label_selector,
+                      fields=["metadata.name", "status.podIP", "status.phase"])
+    return [
+        Target("{}/{}".format(name or namespace, pod["metadata.name"]), pod["status.podIP"], port)
+        for pod in pods
+        if pod["status.phase"] == "Running" and pod["status.podIP"]
+    ]
+
+
+############################################################################
+# Lab tasks
+
+def grade_connectivity(item: Dict):
+    """
+    Grade the NetworkPolicies with a connectivity matrix.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * ``sources`` is a list of ``Source``, a namespace and the labels of
+      the workload the probe pod stands for
+    * ``targets`` is a list of ``Target``
+    * ``expected`` is a {(source namespace, target name): allowed} dict
+    * (optional) ``image`` of the probe pods
+    * (optional) ``cleanup`` deletes the probe pods afterwards
+    """
+    item["failed"] = False
+    oc_client = item["oc_client"]
+    result = matrix(oc_client, item["sources"], item["targets"], item.get("image", PROBE_IMAGE))
+    item["matrix"] = result
+    msgs = compare(result, item["expected"])
+    if item.get("cleanup"):
+        remove_probes(oc_client, sorted({source.namespace for source in item["sources"]}))
+    if msgs:
+        item["failed"] = True
+        item["msgs"] = [{"text": text} for text in msgs]
+    return item
@@ -0,0 +1,260 @@
+"""
+Probe the external endpoints of LoadBalancer and NodePort Services
+
+The endpoints of every Service come from one list of the Services, and
+one list of the nodes for NodePort Services. Every (address, port,
+protocol) is probed at the same time with a timeout per probe, so
+checking several Services takes one timeout in total.
+
+A probe connects, for TCP, or sends a datagram, for UDP. It can also run
+a protocol handshake. An RTSP ``OPTIONS`` request is sent to the RTSP
+ports by default.
+
+``wait_for_ingress`` follows the Services with a watch until MetalLB
+assigns them an address.
+
+    python -m <course>.labkit.netprobe -n non-http-review-rtsp --wait 300
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from . import rawapi
+from .watches import wait_objects
+
+
+DEFAULT_TIMEOUT = 5
+
+
+class Endpoint(NamedTuple):
+    service: str
+    address: str
+    port: int
+    protocol: str
+
+
+class ProbeResult(NamedTuple):
+    endpoint: Endpoint
+    ok: bool
+    detail: str
+    seconds: float
+
+
+def rtsp_options(endpoint: Endpoint) -> Tuple[bytes, bytes]:
+    """
+    Return the RTSP OPTIONS request and the expected answer prefix.
+    """
+    request = "OPTIONS rtsp://{}:{}/ RTSP/1.0\r\nCSeq: 1\r\nUser-Agent: lab-netprobe\r\n\r\n".format(
+        endpoint.address, endpoint.port)
+    return request.encode("ascii"), b"RTSP/1.0"
+
+
+HANDSHAKES = {"rtsp": rtsp_options}
+
+# Handshake used by default for a port
+DEFAULT_HANDSHAKES = {554: "rtsp", 8554: "rtsp"}
+
+
+def endpoints(oc_client, namespace: Optional[str] = None, names: Optional[List[str]] = None,
+              label_selector: Optional[str] = None) -> List[Endpoint]:
+    """
+    Return the external endpoints of the LoadBalancer and NodePort
+    Services. LoadBalancer Services without an address yet have none.
+    """
+    services = rawapi.get(oc_client, "v1", "Service", namespace=namespace,
+                          label_selector=label_selector)
+    if names:
+        services = [s for s in services if s["metadata"]["name"] in names]
+    node_addresses = None
+    result = []
+    for service in services:
+        spec = service.get("spec") or {}
+        name = "{}/{}".format(service["metadata"]["namespace"], service["metadata"]["name"])
+        ports = spec.get("ports") or []
+        if spec.get("type") == "LoadBalancer":
+            ingress = ((service.get("status") or {}).get("loadBalancer") or {}).get("ingress") or []
+            for address in ingress:
+                for port in ports:
+                    result.append(Endpoint(name, address.get("ip") or address.get("hostname"),
+                                           port["port"], port.get("protocol", "TCP")))
+        elif spec.get("type") == "NodePort":
+            if node_addresses is None:
+                node_addresses = [
+                    address["address"]
+                    for node in rawapi.get(oc_client, "v1", "Node", fields=["status.addresses"])
+                    for address in node["status.addresses"] or []
+                    if address.get("type") == "InternalIP"
+                ]
+            for address in node_addresses:
+                for port in ports:
+                    if port.get("nodePort"):
+                        result.append(Endpoint(name, address, port["nodePort"],
+                                               port.get("protocol", "TCP")))
+    return result
+
+
+async def _probe_tcp(endpoint: Endpoint, handshake: Optional[str]) -> str:
+    reader, writer = await asyncio.open_connection(endpoint.address, endpoint.port)
+    try:
+        if handshake is None:
+            return "connected"
+        request, expected = HANDSHAKES[handshake](endpoint)
+        writer.write(request)
+        await writer.drain()
+        answer = await reader.readline()
+        if not answer.startswith(expected):
+            raise ValueError("unexpected {} answer {!r}".format(handshake, answer[:80]))
+        return answer.decode("latin-1").strip()
+    finally:
+        writer.close()
+
+
+class _Datagram(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.answer = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        if not self.answer.done():
+            self.answer.set_result(data)
+
+    def error_received(self, exc):
+        if not self.answer.done():
+            self.answer.set_exception(exc)
+
+
+async def _probe_udp(endpoint: Endpoint, handshake: Optional[str], timeout: float) -> str:
+    """
+    Send a datagram. An ICMP port unreachable fails the probe, no answer
+    within the timeout passes without a handshake: UDP has no connection.
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        _Datagram, remote_addr=(endpoint.address, endpoint.port))
+    try:
+        request, expected = HANDSHAKES[handshake](endpoint) if handshake else (b"\0", b"")
+        transport.sendto(request)
+        try:
+            answer = await asyncio.wait_for(asyncio.shield(protocol.answer), timeout * 0.9)
+        except asyncio.TimeoutError:
+            if handshake:
+                raise
+            return "no answer, open or filtered"
+        if not answer.startswith(expected):
+            raise ValueError("unexpected {} answer {!r}".format(handshake, answer[:80]))
+        return "answered"
+    finally:
+        transport.close()
+
+
+async def _probe(endpoint: Endpoint, handshake: Optional[str], timeout: float) -> ProbeResult:
+    start = time.perf_counter()
+    try:
+        if endpoint.protocol.upper() == "UDP":
+            detail = await asyncio.wait_for(_probe_udp(endpoint, handshake, timeout), timeout)
+        else:
+            detail = await asyncio.wait_for(_probe_tcp(endpoint, handshake), timeout)
+        ok = True
+    except asyncio.TimeoutError:
+        ok, detail = False, "no answer in {}s".format(timeout)
+    except (OSError, ValueError) as e:
+        ok, detail = False, str(e) or e.__class__.__name__
+    return ProbeResult(endpoint, ok, detail, round(time.perf_counter() - start, 3))
+
+
+def probe(targets: List[Endpoint], timeout: float = DEFAULT_TIMEOUT,
+          handshakes: Optional[Dict[int, Optional[str]]] = None) -> List[ProbeResult]:
+    """
+    Probe all the endpoints concurrently. ``handshakes`` maps a port to a
+    handshake name, or None for a plain connection, and extends
+    ``DEFAULT_HANDSHAKES``.
+    """
+    by_port = {**DEFAULT_HANDSHAKES, **(handshakes or {})}
+
+    async def probe_all():
+        return await asyncio.gather(*(
+            _probe(target, by_port.get(target.port), timeout) for target in targets
+        ))
+
+    return list(asyncio.run(probe_all())) if targets else []
+
+
+def wait_for_ingress(oc_client, namespace: str, names: List[str], timeout: int = 300) -> Dict[str, List[str]]:
+    """
+    Wait for the LoadBalancer Services to get an external address.
+    Returns the addresses of each Service, empty when none was assigned.
+    """
+    def addresses(obj: Dict) -> List[str]:
+        ingress = ((obj.get("status") or {}).get("loadBalancer") or {}).get("ingress") or []
+        return [i.get("ip") or i.get("hostname") for i in ingress]
+
+    seen = wait_objects(
+        oc_client, "v1", "Service", namespace, names,
+        done=lambda o: bool(addresses(o)),
+        failed=lambda o: False,
+        timeout=timeout,
+    )
+    return {name: addresses(seen[name]) if name in seen else [] for name in names}
+
+
+############################################################################
+# Lab tasks
+
+def grade_services_reachable(item: Dict):
+    """
+    Check that the external endpoints of Services answer.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * ``namespace`` is the project of the Services
+    * (optional) ``names``, the Services to check, all by default
+    * (optional) ``wait``, seconds to wait for the MetalLB addresses
+    * (optional) ``timeout`` of each probe, 5 seconds by default
+    * (optional) ``handshakes``, a {port: handshake name} dict
+    """
+    item["failed"] = False
+    oc_client = item["oc_client"]
+    msgs = []
+    if item.get("wait") and item.get("names"):
+        for name, addresses in wait_for_ingress(
+                oc_client, item["namespace"], item["names"], item["wait"]).items():
+            if not addresses:
+                msgs.append("The '{}' service has no external IP address".format(name))
+    targets = endpoints(oc_client, item["namespace"], item.get("names"))
+    if not targets and not msgs:
+        msgs.append("No external endpoint found in the '{}' project".format(item["namespace"]))
+    for result in probe(targets, item.get("timeout", DEFAULT_TIMEOUT), item.get("handshakes")):
+        if not result.ok:
+            msgs.append("{} {}:{}/{} does not answer: {}".format(
+                result.endpoint.service, result.endpoint.address, result.endpoint.port,
+                result.endpoint.protocol, result.detail))
+    if msgs:
+        item["failed"] = True
+        item["msgs"] = [{"text": text} for text in msgs]
+    return item
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Probe the external endpoints of Services")
+    parser.add_argument("-n", "--namespace")
+    parser.add_argument("names", nargs="*", help="Service names, all by default")
+    parser.add_argument("--wait", type=int, default=0, help="seconds to wait for the addresses")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    args = parser.parse_args(argv)
+
+    from kubernetes import config, dynamic
+    oc_client = dynamic.DynamicClient(config.new_client_from_config())
+    if args.wait and args.names:
+        wait_for_ingress(oc_client, args.namespace, args.names, args.wait)
+    results = probe(endpoints(oc_client, args.namespace, args.names or None), args.timeout)
+    for result in results:
+        print("{:<5} {:<45} {}:{}/{} {:.3f}s {}".format(
+            "OK" if result.ok else "FAIL", result.endpoint.service, result.endpoint.address,
+            result.endpoint.port, result.endpoint.protocol, result.seconds, result.detail))
+    return 0 if results and all(r.ok for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Node inventory with a label index
+
+Every label check is answered from a label -> node-set index instead of
+one GET per node. With a Node informer, see ``informer``, the index is
+rebuilt from the informer cache when a node is added or removed, or its
+labels change, so a long-lived process such as the grading service never
+grades stale labels. The status updates of the kubelet, which change the
+resourceVersion of a node every few seconds, keep the index. Without an
+informer, the index is listed again after ``INVENTORY_TTL`` seconds.
+"""
+
+import time
+import logging
+import threading
+
+from typing import Dict, Optional, Set
+
+
+class NodeInventory:
+    """
+    Index the cluster nodes by label.
+    """
+
+    def __init__(self, oc_client):
+        self.oc_client = oc_client
+        self.nodes = {}
+        self._by_label = {}
+        self._by_key = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        List the nodes and rebuild the index.
+        """
+        v1_nodes = self.oc_client.resources.get(api_version="v1", kind="Node")
+        nodes = {}
+        by_label = {}
+        by_key = {}
+        for node in v1_nodes.get().items:
+            name = node.metadata.name
+            labels = dict(node.metadata.labels or {})
+            nodes[name] = labels
+            for label in labels.items():
+                by_label.setdefault(label, set()).add(name)
+                by_key.setdefault(label[0], set()).add(name)
+        self.nodes, self._by_label, self._by_key = nodes, by_label, by_key
+        logging.debug("Indexed {} nodes by label".format(len(nodes)))
+
+    def with_label(self, key: str, value: Optional[str] = None) -> Set[str]:
+        """
+        Return the nodes that carry the label. With no value, any value matches.
+        """
+        if value is None:
+            return set(self._by_key.get(key, ()))
+        return set(self._by_label.get((key, value), ()))
+
+    def has_label(self, name: str, key: str, value: Optional[str] = None) -> bool:
+        if value is None:
+            return name in self._by_key.get(key, ())
+        return name in self._by_label.get((key, value), ())
+
+
+# Seconds a node inventory is reused when no Node informer tells when the
+# nodes change
+INVENTORY_TTL = 30
+
+_inventories = {}
+_lock = threading.Lock()
+
+
+def _label_version(oc_client) -> Optional[int]:
+    """
+    Return the label version of the Node informer store of a cached client,
+    or None when the client has no synced Node informer.
+    """
+    informer = getattr(oc_client, "informers", {}).get(("v1", "Node"))
+    if informer is not None and informer.synced.is_set():
+        return informer.store.label_version
+    return None
+
+
+def get_inventory(oc_client, refresh: bool = False) -> NodeInventory:
+    """
+    Return the node inventory shared by the steps that use the client.
+    With a Node informer, the inventory is rebuilt, from the informer
+    cache, when the node labels change. Otherwise it is reused for
+    ``INVENTORY_TTL`` seconds.
+    """
+    version = _label_version(oc_client)
+    with _lock:
+        cached = _inventories.get(id(oc_client))
+        if (refresh or cached is None or cached[0].oc_client is not oc_client
+                or (version is not None and cached[1] != version)
+                or (version is None and time.time() - cached[2] > INVENTORY_TTL)):
+            cached = _inventories[id(oc_client)] = (NodeInventory(oc_client), version, time.time())
+        return cached[0]
+
+
+def grade_node_label(item: Dict):
+    """
+    Check that a node carries a label.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * ``name`` is the node name
+    * ``label_key`` and ``label_value`` define the label
+    """
+    item["failed"] = False
+    name = item["name"]
+    key, value = item["label_key"], item["label_value"]
+    try:
+        inventory = get_inventory(item["oc_client"])
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot retrieve the cluster nodes"}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+        return item
+
+    if name not in inventory.nodes:
+        item["failed"] = True
+        item["msgs"] = [{"text": f"The '{name}' node does not exist"}]
+    elif not inventory.has_label(name, key, value):
+        item["failed"] = True
+        item["msgs"] = [{"text": f"The '{name}' node does not have the '{key}={value}' label"}]
+    return item
@@ -0,0 +1,139 @@
+"""
+OpenShift base class for the lab scripts
+
+Adds an optional informer mode to ``ocp.utils.OpenShift``. A lab class
+lists the kinds it reads repeatedly in ``__INFORMERS__``:
+
+    class ReviewCR1(OpenShift):
+        __LAB__ = "review-cr1"
+        __INFORMERS__ = [("v1", "Node")]
+
+Each declared kind is listed once and then followed with a watch stream.
+``oc_client``, ``resource_get`` and ``resource_exists`` serve those kinds
+from the local cache, so polling for readiness no longer costs one GET per
+iteration. Labs without ``__INFORMERS__`` behave exactly as before.
+
+The constructor waits for the cluster to be usable, see ``readiness``.
+
+Setting ``LAB_PROFILE`` profiles the run, see ``profiling``. The API
+request metrics are always collected, see ``metrics``.
+
+Every lab run works on a private copy of the kubeconfig, see
+``kubeconfig.isolate``, and its playbooks and Python tasks reuse one SSH
+connection per lab host for the life of the run, see ``sshpool``.
+
+``run_playbook`` streams the playbook events to the console, see
+``playbooks``.
+
+``run_start`` skips the ``start`` steps already prepared in the background
+by ``prefetch``.
+
+The ``fix`` verb server-side applies ``solutions/<lab>`` for any lab that
+ships a solution tree.
+"""
+
+import os
+import logging
+
+from ocp import utils
+from labs.common import userinterface
+
+from . import kubeconfig, metrics, playbooks, prefetch, profiling, readiness, solutions, sshpool
+from .informer import CachedClient
+
+
+# Directory of the lab scripts, the playbook paths are relative to it
+LABS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SOLUTIONS_DIR = os.path.join(LABS_DIR, "solutions")
+
+
+class OpenShift(utils.OpenShift):
+    """
+    OpenShift base class with an optional informer cache
+    """
+
+    # List of (api_version, kind) tuples served from the informer cache
+    __INFORMERS__ = []
+
+    def __init__(self):
+        profiling.from_environment()
+        metrics.enable(self.__LAB__)
+        # Logins done by the steps of this run must not touch ~/.kube/config
+        kubeconfig.isolate()
+        # One SSH master per lab host for this run, shared with the playbooks
+        sshpool.configure()
+        # Wait for the cluster instead of failing while it is still starting.
+        # finish only needs the API, not every cluster operator.
+        waited = readiness.wait_until_ready(
+            readiness.api_url(getattr(self, "OCP_API", None)),
+            connect=super().__init__,
+            client=lambda: self.oc_client,
+            operators=metrics.current_verb() != "finish",
+        )
+        logging.debug("Cluster ready after {:.1f}s".format(waited))
+        if self.__INFORMERS__:
+            self.oc_client = CachedClient(self.oc_client, self.__INFORMERS__)
+            self.oc_client.start()
+
+    def _informer(self, api, kind):
+        if isinstance(self.oc_client, CachedClient):
+            informer = self.oc_client.informers.get((api, kind))
+            if informer is not None and informer.synced.is_set():
+                return informer
+        return None
+
+    def resource_get(self, api, kind, name, namespace=None):
+        informer = self._informer(api, kind)
+        if informer is None:
+            return super().resource_get(api, kind, name, namespace)
+        return self.oc_client.resources.get(api_version=api, kind=kind).get(
+            name=name, namespace=namespace
+        )
+
+    def resource_exists(self, api, kind, name, namespace=None):
+        informer = self._informer(api, kind)
+        if informer is None:
+            return super().resource_exists(api, kind, name, namespace)
+        return informer.store.get(name, namespace) is not None
+
+    def run_playbook(self, item):
+        """
+        Run the playbook of a step, following its progress as it runs.
+        """
+        return playbooks.run_playbook(item, LABS_DIR)
+
+    def run_start(self, items):
+        """
+        Run the steps of the 'start' verb, skipping the ones that a
+        background worker already converged.
+        """
+        prefetch.cancel()
+        userinterface.Console(prefetch.pending(items)).run_items(action="Starting")
+
+    def fix(self):
+        """
+        Fix the lab by applying the manifests from its solution directory.
+        Labs without one keep the behaviour of the base class.
+        """
+        path = os.path.join(SOLUTIONS_DIR, self.__LAB__)
+        if not os.path.isdir(path):
+            return super().fix()
+        apply_item = {
+            "label": "Applying the solution manifests",
+            "task": solutions.apply_solution,
+            "oc_client": self.oc_client,
+            "path": path,
+            "namespace": self.__LAB__,
+            "fatal": True,
+        }
+        items = [
+            apply_item,
+            {
+                "label": "Waiting for the solution workloads",
+                "task": solutions.wait_solution_ready,
+                "oc_client": self.oc_client,
+                "source": apply_item,
+            },
+        ]
+        userinterface.Console(items).run_items(action="Fixing")
@@ -0,0 +1,181 @@
+"""
+Run Ansible playbooks with live progress
+
+``run_playbook`` runs a playbook through ``ansible-runner`` and handles
+its events as they arrive instead of after the run:
+
+* the console line of the step shows the task and host in progress
+* a step marked ``"fail_fast": True`` cancels the run at the first fatal
+  failure instead of running the remaining tasks. A task in a retry loop
+  is only fatal once its last attempt failed.
+* the duration of every task is kept in ``item["timings"]`` and added to
+  the profile of the run, see ``profiling``
+
+The failure messages come from ``msg`` when the task result has one, and
+from the task output otherwise, such as for ``no_log`` results.
+"""
+
+import os
+import re
+import time
+import shutil
+import logging
+import tempfile
+
+from typing import Dict, List, Optional
+
+from . import profiling
+
+
+# Seconds between two checks for a cancel request
+CANCEL_INTERVAL = 1
+
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def _message(event: Dict) -> str:
+    data = event.get("event_data", {})
+    res = data.get("res") or {}
+    text = res.get("msg") or res.get("stderr") or res.get("censored")
+    if not text:
+        text = ANSI_RE.sub("", event.get("stdout") or "").strip()
+    return "{}: {}".format(data.get("task") or "Playbook", str(text).strip()[:500])
+
+
+class PlaybookRun:
+    """
+    Follow the events of one playbook run for a lab step.
+    """
+
+    def __init__(self, item: Dict):
+        self.item = item
+        self.label = item["label"]
+        self.fail_fast = item.get("fail_fast", False)
+        self.failures: List[str] = []
+        self.timings: List[Dict] = []
+        self.cancelled = False
+        self._task: Optional[str] = None
+        self._task_start: Optional[float] = None
+
+    def _show(self, host: Optional[str] = None):
+        if self._task:
+            self.item["label"] = "{} ({}{})".format(
+                self.label, self._task, " on {}".format(host) if host else "")
+
+    def _end_task(self):
+        if self._task is not None:
+            self.timings.append({
+                "task": self._task,
+                "seconds": round(time.time() - self._task_start, 3),
+            })
+            self._task = None
+
+    def _fatal(self, event: Dict):
+        self.failures.append(_message(event))
+        if self.fail_fast and not self.cancelled:
+            logging.debug("Cancelling {}: {}".format(self.item["playbook"], self.failures[-1]))
+            self.cancelled = True
+
+    def handle(self, event: Dict) -> bool:
+        """
+        ``event_handler`` of ansible-runner. The events are not kept on
+        disk.
+        """
+        name = event.get("event")
+        data = event.get("event_data", {})
+        if name in ("playbook_on_task_start", "playbook_on_handler_task_start"):
+            self._end_task()
+            self._task = data.get("task") or data.get("name")
+            self._task_start = time.time()
+            self._show()
+        elif name == "runner_on_start":
+            self._show(data.get("host"))
+        elif name == "runner_on_failed" and not data.get("ignore_errors"):
+            self._fatal(event)
+        elif name == "runner_on_unreachable":
+            self._fatal(event)
+        elif name == "runner_retry":
+            res = data.get("res") or {}
+            # Retry loops ride out module failures, such as k8s_info on a
+            # kind whose CRD is not served yet: only the final failure counts
+            self._show("{}, attempt {}".format(data.get("host"), res.get("attempts", "?")))
+        elif name == "playbook_on_stats":
+            self._end_task()
+        return False
+
+    def cancel(self) -> bool:
+        """
+        ``cancel_callback`` of ansible-runner.
+        """
+        return self.cancelled
+
+
+def _config_dir(playbook: str, base_dir: str) -> Optional[str]:
+    """
+    Return the closest directory above the playbook with an ansible.cfg.
+    """
+    directory = os.path.dirname(playbook)
+    while directory.startswith(base_dir):
+        if os.path.isfile(os.path.join(directory, "ansible.cfg")):
+            return directory
+        directory = os.path.dirname(directory)
+    return None
+
+
+############################################################################
+# Lab tasks
+
+def run_playbook(item: Dict, base_dir: str):
+    """
+    Run a playbook and report its failures.
+    The following parameters are used:
+    * ``playbook`` is the path of the playbook, relative to ``base_dir``
+    * ``vars`` is a dict of extra variables
+    * ``fail_fast`` cancels the run at the first fatal failure
+    * ``timeout`` is the maximum duration of the run, in seconds
+    """
+    import ansible_runner
+
+    item["failed"] = False
+    playbook = os.path.join(base_dir, item["playbook"])
+    envvars = {}
+    config_dir = _config_dir(playbook, base_dir)
+    if config_dir:
+        envvars["ANSIBLE_CONFIG"] = os.path.join(config_dir, "ansible.cfg")
+
+    run = PlaybookRun(item)
+    private_data_dir = tempfile.mkdtemp(prefix="lab-playbook-")
+    start = time.time()
+    try:
+        runner = ansible_runner.run(
+            private_data_dir=private_data_dir,
+            playbook=playbook,
+            extravars=item.get("vars") or {},
+            envvars=envvars,
+            settings={"pexpect_timeout": CANCEL_INTERVAL},
+            timeout=item.get("timeout"),
+            event_handler=run.handle,
+            cancel_callback=run.cancel,
+            quiet=True,
+        )
+    finally:
+        shutil.rmtree(private_data_dir, ignore_errors=True)
+        item["label"] = run.label
+    run._end_task()
+
+    item["timings"] = run.timings
+    profiling.record("playbooks", {
+        "playbook": item["playbook"],
+        "status": runner.status,
+        "seconds": round(time.time() - start, 3),
+        "tasks": run.timings,
+    })
+    logging.debug("{} {} in {:.1f}s".format(item["playbook"], runner.status, time.time() - start))
+
+    if runner.status != "successful":
+        item["failed"] = True
+        msgs = run.failures or ["The playbook ended with status '{}'".format(runner.status)]
+        if run.cancelled:
+            msgs.append("The playbook was stopped at the first failure")
+        item["msgs"] = [{"text": text} for text in msgs]
+    return item
@@ -0,0 +1,238 @@
+"""
+Grade RHACM policy compliance from the hub
+
+The hub keeps a root Policy in the namespace where it was created and a
+replicated copy, named ``<namespace>.<policy>``, in the namespace of every
+managed cluster it is placed on. The root policy summarizes the
+compliance of each cluster in ``status.status[]``.
+
+One LIST of the Policy kind across all namespaces therefore gives the
+compliance of every placement target, with no login to the managed
+clusters. Enforced policies are awaited with a watch on the same list.
+"""
+
+import time
+import logging
+
+from typing import Dict, List, Optional
+
+from kubernetes.client.exceptions import ApiException
+
+
+POLICY_API = "policy.open-cluster-management.io/v1"
+
+ROOT_POLICY_LABEL = "policy.open-cluster-management.io/root-policy"
+CLUSTER_NAME_LABEL = "policy.open-cluster-management.io/cluster-name"
+
+COMPLIANT = "Compliant"
+
+
+class PolicyCompliance:
+    """
+    Per-cluster compliance of one root policy.
+    """
+
+    def __init__(self, name: str, namespace: str):
+        self.name = name
+        self.namespace = namespace
+        self.exists = False
+        self.remediation_action = None
+        self.disabled = False
+        self.clusters = {}
+
+    @property
+    def root_name(self) -> str:
+        return "{}.{}".format(self.namespace, self.name)
+
+    def update(self, obj: Dict):
+        """
+        Merge a root or a replicated Policy into the compliance view.
+        """
+        metadata = obj.get("metadata", {})
+        labels = metadata.get("labels") or {}
+        status = obj.get("status") or {}
+        if labels.get(ROOT_POLICY_LABEL) == self.root_name:
+            cluster = labels.get(CLUSTER_NAME_LABEL, metadata.get("namespace"))
+            self.clusters[cluster] = status.get("compliant")
+            return
+        self.exists = True
+        spec = obj.get("spec") or {}
+        self.remediation_action = spec.get("remediationAction")
+        self.disabled = bool(spec.get("disabled"))
+        for entry in status.get("status") or []:
+            # The replicated policy is more current than the root summary
+            self.clusters.setdefault(entry.get("clustername"), entry.get("compliant"))
+
+    def matches(self, obj: Dict) -> bool:
+        metadata = obj.get("metadata", {})
+        if (metadata.get("labels") or {}).get(ROOT_POLICY_LABEL) == self.root_name:
+            return True
+        return metadata.get("name") == self.name and metadata.get("namespace") == self.namespace
+
+    def noncompliant(self, clusters: Optional[List[str]] = None) -> Dict[str, Optional[str]]:
+        """
+        Return the clusters that are not compliant, with their state.
+        A cluster expected in ``clusters`` but not placed has no state.
+        """
+        expected = clusters if clusters is not None else list(self.clusters)
+        return {
+            cluster: self.clusters.get(cluster)
+            for cluster in expected
+            if self.clusters.get(cluster) != COMPLIANT
+        }
+
+
+def list_compliance(oc_client, names: List[str], namespace: str):
+    """
+    Read the compliance of several policies with one LIST.
+    Returns a {name: PolicyCompliance} map and the list resourceVersion.
+    """
+    resource = oc_client.resources.get(api_version=POLICY_API, kind="Policy")
+    listing = resource.get()
+    compliance = {name: PolicyCompliance(name, namespace) for name in names}
+    # Root policies first, so that the replicated ones take precedence
+    objects = sorted(
+        (item.to_dict() for item in listing.items),
+        key=lambda obj: ROOT_POLICY_LABEL in (obj["metadata"].get("labels") or {}),
+    )
+    for obj in objects:
+        for policy in compliance.values():
+            if policy.matches(obj):
+                policy.update(obj)
+    return compliance, listing.metadata.resourceVersion
+
+
+def wait_compliance(oc_client, names: List[str], namespace: str,
+                    clusters: Optional[List[str]] = None, timeout: int = 300):
+    """
+    Wait for the policies to be compliant on every cluster.
+    Returns the final {name: PolicyCompliance} map and the list of
+    compliance transitions observed while waiting.
+    """
+    compliance, resource_version = list_compliance(oc_client, names, namespace)
+    transitions = []
+    deadline = time.time() + timeout
+
+    def pending():
+        return [
+            policy for policy in compliance.values()
+            if not policy.exists or policy.noncompliant(clusters)
+        ]
+
+    resource = oc_client.resources.get(api_version=POLICY_API, kind="Policy")
+    while pending() and time.time() < deadline:
+        try:
+            for event in oc_client.watch(resource, resource_version=resource_version,
+                                         timeout=max(1, int(deadline - time.time()))):
+                obj = event["raw_object"]
+                resource_version = obj["metadata"]["resourceVersion"]
+                for policy in compliance.values():
+                    if not policy.matches(obj):
+                        continue
+                    before = dict(policy.clusters)
+                    labels = obj["metadata"].get("labels") or {}
+                    if event["type"] == "DELETED" and ROOT_POLICY_LABEL in labels:
+                        policy.clusters.pop(labels.get(CLUSTER_NAME_LABEL), None)
+                    elif event["type"] == "DELETED":
+                        policy.exists = False
+                    else:
+                        policy.update(obj)
+                    for cluster, state in policy.clusters.items():
+                        if before.get(cluster) != state:
+                            transitions.append({
+                                "policy": policy.name, "cluster": cluster,
+                                "from": before.get(cluster), "to": state,
+                                "time": time.time(),
+                            })
+                            logging.debug("Policy {} on {}: {} -> {}".format(
+                                policy.name, cluster, before.get(cluster), state))
+                if not pending() or time.time() > deadline:
+                    break
+        except ApiException as e:
+            if e.status != 410:
+                raise
+            # The resourceVersion expired, list again
+            compliance, resource_version = list_compliance(oc_client, names, namespace)
+    return compliance, transitions
+
+
+def _compliance_msgs(policy: PolicyCompliance, clusters: Optional[List[str]]) -> List[Dict]:
+    if not policy.exists:
+        return [{"text": "The '{}' policy does not exist in the '{}' namespace".format(
+            policy.name, policy.namespace)}]
+    if policy.disabled:
+        return [{"text": "The '{}' policy is disabled".format(policy.name)}]
+    return [
+        {"text": "The '{}' policy is {} on the '{}' cluster".format(
+            policy.name, state or "not placed", cluster)}
+        for cluster, state in sorted(policy.noncompliant(clusters).items())
+    ]
+
+
+############################################################################
+# Lab tasks
+
+def grade_policy_compliance(item: Dict):
+    """
+    Check that policies are compliant on their placement targets.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client of the hub
+    * ``names`` is the list of policy names
+    * ``namespace`` is the namespace of the root policies
+    * (optional) ``clusters`` is the list of clusters that must be
+      compliant. By default, every cluster the policies are placed on.
+    """
+    item["failed"] = False
+    clusters = item.get("clusters")
+    try:
+        compliance, _ = list_compliance(item["oc_client"], item["names"], item["namespace"])
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot read the policies from the hub"}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+        return item
+
+    msgs = []
+    for name in item["names"]:
+        msgs.extend(_compliance_msgs(compliance[name], clusters))
+    if msgs:
+        item["failed"] = True
+        item["msgs"] = msgs
+    return item
+
+
+def wait_policy_compliance(item: Dict):
+    """
+    Wait for enforced policies to become compliant.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client of the hub
+    * ``names`` is the list of policy names
+    * ``namespace`` is the namespace of the root policies
+    * (optional) ``clusters`` is the list of clusters that must be compliant
+    * (optional) ``timeout`` in seconds, 300 by default
+    The compliance transitions are saved in ``item["transitions"]``.
+    """
+    item["failed"] = False
+    clusters = item.get("clusters")
+    try:
+        compliance, transitions = wait_compliance(
+            item["oc_client"], item["names"], item["namespace"],
+            clusters, item.get("timeout", 300),
+        )
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot watch the policies on the hub"}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+        return item
+
+    item["transitions"] = transitions
+    msgs = []
+    for name in item["names"]:
+        policy = compliance[name]
+        msgs.extend(_compliance_msgs(policy, clusters))
+        if policy.exists and policy.remediation_action != "enforce" and policy.noncompliant(clusters):
+            msgs.append({"text": "The '{}' policy only informs, it does not remediate".format(name)})
+    if msgs:
+        item["failed"] = True
+        item["msgs"] = msgs
+    return item
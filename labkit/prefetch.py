@@ -0,0 +1,223 @@
+"""
+Prepare the next lab in the background
+
+Many ``start`` steps do not depend on the lab: installing the operators,
+deploying ``virtctl``, staging the disk images. A lab marks those steps
+with ``"prefetch": True`` in its ``start_items()``. Checks are never
+marked: their result is only valid when the lab starts.
+
+When the ``LAB_PREFETCH`` environment variable is set to ``1``, ``grade``
+and ``finish`` spawn a background worker for the lab that follows in
+``lab-order.txt``. The worker runs only the marked steps of that lab and
+records each one that succeeds as converged. It works on its own copy of
+the kubeconfig, because the copy of the lab run that spawns it is removed
+when that run exits, see ``kubeconfig``. The next ``start`` first
+cancels the worker, then skips the converged steps and runs the rest.
+
+The worker never runs a step that takes a ``namespace`` parameter, so it
+cannot create or inspect the next lab's project early.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import hashlib
+import logging
+import subprocess
+
+from typing import Dict, List, Optional
+
+from . import kubeconfig
+
+
+STATE_DIR = os.path.expanduser("~/.cache/labs/prefetch")
+PID_FILE = os.path.join(STATE_DIR, "worker.pid")
+KUBECONFIG_FILE = os.path.join(STATE_DIR, "kubeconfig")
+
+# Labs of these scripts in course order, next to the lab scripts
+LABS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "lab-order.txt")
+
+# Seconds a converged step stays valid
+CONVERGED_TTL = 30 * 60
+
+ENABLED = os.environ.get("LAB_PREFETCH", "") == "1"
+
+
+def next_lab(lab: str, path: str = LABS_FILE) -> Optional[str]:
+    """
+    Return the lab that follows ``lab`` in ``lab-order.txt``, if any.
+    """
+    try:
+        with open(path) as f:
+            labs = [
+                line.strip() for line in f
+                if line.strip() and not line.lstrip().startswith("#")
+            ]
+    except OSError:
+        return None
+    if lab in labs and labs.index(lab) + 1 < len(labs):
+        return labs[labs.index(lab) + 1]
+    return None
+
+
+def step_key(item: Dict) -> str:
+    """
+    Identify a step by what it does, so that the same step declared by
+    two labs shares its converged mark.
+    """
+    task = item.get("task")
+    identity = {
+        "task": getattr(task, "__qualname__", repr(task)),
+        "label": item.get("label"),
+        "playbook": item.get("playbook"),
+        "vars": item.get("vars"),
+    }
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def prefetchable(items: List[Dict]) -> List[Dict]:
+    return [item for item in items if item.get("prefetch") and "namespace" not in item]
+
+
+def mark_converged(item: Dict):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(os.path.join(STATE_DIR, step_key(item)), "w") as f:
+        json.dump({"label": item["label"], "time": time.time()}, f)
+
+
+def is_converged(item: Dict) -> bool:
+    try:
+        with open(os.path.join(STATE_DIR, step_key(item))) as f:
+            return time.time() - json.load(f)["time"] < CONVERGED_TTL
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def _converged(item: Dict):
+    item["failed"] = False
+    return item
+
+
+def pending(items: List[Dict]) -> List[Dict]:
+    """
+    Replace the task of the converged steps with a no-op. The steps keep
+    their label, so the console output does not change.
+    """
+    for item in prefetchable(items):
+        if is_converged(item):
+            logging.debug("Step already converged: {}".format(item["label"]))
+            item["task"] = _converged
+    return items
+
+
+def _copy_kubeconfig() -> str:
+    """
+    Copy the kubeconfig in use to a file that outlives the lab run.
+    """
+    source = kubeconfig.source_path()
+    fd = os.open(KUBECONFIG_FILE + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        if source:
+            with open(source) as config:
+                f.write(config.read())
+    os.replace(KUBECONFIG_FILE + ".tmp", KUBECONFIG_FILE)
+    return KUBECONFIG_FILE
+
+
+def spawn(lab: str) -> Optional[int]:
+    """
+    Start the background worker that prepares the lab after ``lab``.
+    Returns the worker PID.
+    """
+    target = next_lab(lab)
+    if not ENABLED or target is None:
+        return None
+    cancel()
+    os.makedirs(STATE_DIR, exist_ok=True)
+    env = dict(os.environ, KUBECONFIG=_copy_kubeconfig())
+    with open(os.path.join(STATE_DIR, "worker.log"), "a") as log:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", __name__, target],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True, env=env,
+        )
+    with open(PID_FILE, "w") as f:
+        f.write(str(proc.pid))
+    logging.debug("Preparing {} in the background, PID {}".format(target, proc.pid))
+    return proc.pid
+
+
+def cancel():
+    """
+    Stop the background worker, if it is still running.
+    """
+    try:
+        with open(PID_FILE) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return
+    try:
+        # The worker leads its own session, stop its playbooks with it
+        os.killpg(pid, signal.SIGTERM)
+        logging.debug("Cancelled the background worker {}".format(pid))
+    except (ProcessLookupError, PermissionError):
+        pass
+    try:
+        os.remove(PID_FILE)
+    except OSError:
+        pass
+
+
+def run(lab: str) -> int:
+    """
+    Run the prefetchable start steps of a lab and mark the converged ones.
+    """
+    from .gradeserver import load_lab
+
+    try:
+        items = prefetchable(load_lab(lab)().start_items())
+    except Exception:
+        logging.exception("Cannot load the {} lab".format(lab))
+        return 1
+    try:
+        _run_items(items)
+    finally:
+        _release_pid()
+    return 0
+
+
+def _release_pid():
+    try:
+        with open(PID_FILE) as f:
+            if int(f.read().strip()) != os.getpid():
+                return
+        os.remove(PID_FILE)
+    except (OSError, ValueError):
+        pass
+
+
+def _run_items(items: List[Dict]):
+    for item in items:
+        if is_converged(item):
+            continue
+        item["failed"] = False
+        try:
+            item["task"](item)
+        except Exception:
+            logging.exception("Step failed: {}".format(item["label"]))
+            item["failed"] = True
+        if item.get("failed"):
+            logging.info("Not converged: {}".format(item["label"]))
+            if item.get("fatal"):
+                break
+            continue
+        mark_converged(item)
+        logging.info("Converged: {}".format(item["label"]))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    sys.exit(run(sys.argv[1]))
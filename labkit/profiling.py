@@ -0,0 +1,291 @@
+"""
+Profile a lab verb
+
+Records, for one lab process:
+
+* a sampling wall-clock profile: a background thread reads the stack of
+  every other thread at a fixed interval, and skips the threads blocked
+  in a known wait, such as the informer and watch threads reading their
+  streams. Time spent in ``time.sleep`` or in C code still counts.
+* every HTTP request of the Kubernetes client: method, path, status,
+  bytes and latency
+* every subprocess started with ``subprocess``, which covers
+  ``run_command`` and ``oc``, with its duration and exit code
+* the sections other modules add with ``record``, such as the duration
+  of every playbook task
+
+and writes them to a single JSON report. Run a verb with:
+
+    python -m <course>.labkit.profiling --profile report.json start review-cr2
+
+or set ``LAB_PROFILE=report.json`` when running the ``lab`` command. The
+stacks are also saved in the collapsed format, so the report can be
+turned into a flame graph with ``jq -r '.stacks.collapsed[]'``.
+The profile works the same against a stub API server: point
+``KUBECONFIG`` at it.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import argparse
+import threading
+import subprocess
+
+from collections import Counter
+from typing import Dict, List, Optional
+
+from . import requesthooks
+
+
+# Seconds between two stack samples
+SAMPLE_INTERVAL = 0.02
+
+# Innermost frames, (file, function), of a thread that waits for a lock,
+# a socket or a process rather than running
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("socket.py", "readinto"),
+    ("socket.py", "accept"),
+    ("ssl.py", "read"),
+    ("ssl.py", "recv_into"),
+    ("subprocess.py", "_try_wait"),
+    ("subprocess.py", "_communicate"),
+    ("socketserver.py", "serve_forever"),
+}
+
+
+class Sampler:
+    """
+    Sample the stacks of the other threads of the process that are not
+    idle, see ``IDLE_FRAMES``.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lab-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    self.idle += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def top(self, limit: int = 30) -> List[Dict]:
+        """
+        Return the functions with the most samples, own and cumulated.
+        """
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        return [
+            {
+                "function": function,
+                "own": round(own[function] * self.interval, 3),
+                "total": round(total[function] * self.interval, 3),
+            }
+            for function, _ in total.most_common(limit)
+        ]
+
+    def collapsed(self) -> List[str]:
+        return ["{} {}".format(";".join(stack), count) for stack, count in self.stacks.most_common()]
+
+
+class Profiler:
+    """
+    Record the stack samples, HTTP requests and subprocesses of a lab run.
+    """
+
+    def __init__(self, path: str, interval: float = SAMPLE_INTERVAL):
+        self.path = path
+        self.sampler = Sampler(interval)
+        self.requests = []
+        self.subprocesses = []
+        self.sections = {}
+        self.info = {}
+        self._start = None
+        self._popen = None
+        self._lock = threading.Lock()
+
+    def _record_request(self, entry: Dict):
+        entry["time"] = round(time.time() - self._start, 6)
+        with self._lock:
+            self.requests.append(entry)
+
+    def _trace_subprocesses(self):
+        profiler = self
+        popen = self._popen = subprocess.Popen
+
+        class TracedPopen(popen):
+            def __init__(self, args, *a, **kw):
+                self._trace = {
+                    "args": args if isinstance(args, str) else [str(arg) for arg in args],
+                    "time": round(time.time() - profiler._start, 6),
+                    "seconds": None, "returncode": None,
+                }
+                self._trace_start = time.perf_counter()
+                super().__init__(args, *a, **kw)
+                with profiler._lock:
+                    profiler.subprocesses.append(self._trace)
+
+            def _traced(self):
+                if self.returncode is not None and self._trace["seconds"] is None:
+                    self._trace["seconds"] = round(time.perf_counter() - self._trace_start, 6)
+                    self._trace["returncode"] = self.returncode
+
+            def wait(self, *a, **kw):
+                try:
+                    return super().wait(*a, **kw)
+                finally:
+                    self._traced()
+
+            def poll(self):
+                try:
+                    return super().poll()
+                finally:
+                    self._traced()
+
+        subprocess.Popen = TracedPopen
+
+    def start(self):
+        self._start = time.time()
+        requesthooks.add(self._record_request)
+        self._trace_subprocesses()
+        self.sampler.start()
+        return self
+
+    def stop(self):
+        self.sampler.stop()
+        requesthooks.remove(self._record_request)
+        if self._popen is not None:
+            subprocess.Popen = self._popen
+
+    def report(self) -> Dict:
+        http = {}
+        for entry in self.requests:
+            key = "{} {}".format(entry["method"], entry["path"])
+            summary = http.setdefault(key, {"count": 0, "seconds": 0.0, "bytes": 0})
+            summary["count"] += 1
+            summary["seconds"] = round(summary["seconds"] + (entry["seconds"] or 0), 6)
+            summary["bytes"] += entry["bytes"] or 0
+        return {
+            "info": self.info,
+            "wall": round(time.time() - self._start, 3),
+            "stacks": {
+                "interval": self.sampler.interval,
+                "samples": self.sampler.samples,
+                "idle": self.sampler.idle,
+                "top": self.sampler.top(),
+                "collapsed": self.sampler.collapsed(),
+            },
+            "http": {
+                "count": len(self.requests),
+                "seconds": round(sum(e["seconds"] or 0 for e in self.requests), 6),
+                "bytes": sum(e["bytes"] or 0 for e in self.requests),
+                "by_path": dict(sorted(http.items(), key=lambda i: -i[1]["seconds"])),
+                "requests": self.requests,
+            },
+            "subprocesses": {
+                "count": len(self.subprocesses),
+                "seconds": round(sum(p["seconds"] or 0 for p in self.subprocesses), 6),
+                "processes": self.subprocesses,
+            },
+            **self.sections,
+        }
+
+    def write(self):
+        with open(self.path, "w") as f:
+            json.dump(self.report(), f, indent=1)
+        logging.debug("Profile written to {}".format(self.path))
+
+
+_profiler: Optional[Profiler] = None
+
+
+def from_environment() -> Optional[Profiler]:
+    """
+    Start profiling when ``LAB_PROFILE`` names a report file. The report
+    is written when the process exits.
+    """
+    global _profiler
+    path = os.environ.get("LAB_PROFILE")
+    if not path or _profiler is not None:
+        return _profiler
+    _profiler = Profiler(path).start()
+    _profiler.info = {"argv": sys.argv}
+
+    def finish():
+        _profiler.stop()
+        _profiler.write()
+
+    atexit.register(finish)
+    return _profiler
+
+
+def record(section: str, entry: Dict):
+    """
+    Add an entry to a section of the report, when profiling.
+    """
+    if _profiler is not None:
+        with _profiler._lock:
+            _profiler.sections.setdefault(section, []).append(entry)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a lab verb under the profiler")
+    parser.add_argument("verb", choices=["start", "grade", "finish", "fix"])
+    parser.add_argument("lab")
+    parser.add_argument("--profile", default="profile.json", help="report file")
+    parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL)
+    args = parser.parse_args(argv)
+
+    from .gradeserver import load_lab
+
+    profiler = Profiler(args.profile, args.interval).start()
+    profiler.info = {"lab": args.lab, "verb": args.verb}
+    rc = 0
+    try:
+        lab = load_lab(args.lab)()
+        getattr(lab, args.verb)()
+    except SystemExit as e:
+        rc = e.code if isinstance(e.code, int) else 1
+    finally:
+        profiler.stop()
+        profiler.write()
+    print("Profile written to {}".format(args.profile), file=sys.stderr)
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Plain-dict reads from the API server
+
+The dynamic client wraps every response in nested ``ResourceInstance``
+and ``ResourceField`` objects. For read-only checks, and for large lists
+such as nodes, virtual machines or PackageManifests, building those
+objects costs more CPU and memory than the request itself.
+
+``get`` sends the same request through the dynamic client, but returns
+the parsed JSON as plain dicts. ``orjson`` is used when it is installed.
+Callers can keep only some fields of the objects, or ask the API server
+for the object metadata or a table instead of the full objects.
+"""
+
+import json
+
+from typing import Any, Dict, List, Optional
+
+from kubernetes.dynamic.exceptions import NotFoundError
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+
+METADATA_ACCEPT = (
+    "application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1,"
+    "application/json;as=PartialObjectMetadata;g=meta.k8s.io;v=v1,"
+    "application/json"
+)
+TABLE_ACCEPT = "application/json;as=Table;g=meta.k8s.io;v=v1,application/json"
+
+
+def pluck(obj: Any, path: str, default=None):
+    """
+    Return the value at a dotted path, such as ``spec.storage.s3.bucket``.
+    List indexes are written as numbers: ``spec.containers.0.image``.
+    """
+    for key in path.split("."):
+        if isinstance(obj, dict):
+            obj = obj.get(key)
+        elif isinstance(obj, list) and key.isdigit() and int(key) < len(obj):
+            obj = obj[int(key)]
+        else:
+            return default
+        if obj is None:
+            return default
+    return obj
+
+
+def project(obj: Dict, fields: List[str]) -> Dict[str, Any]:
+    """
+    Keep only some fields of an object, as a {path: value} dict.
+    """
+    return {path: pluck(obj, path) for path in fields}
+
+
+def get(oc_client, api_version: str, kind: str, name: Optional[str] = None,
+        namespace: Optional[str] = None, fields: Optional[List[str]] = None,
+        label_selector: Optional[str] = None, field_selector: Optional[str] = None,
+        metadata_only: bool = False, table: bool = False):
+    """
+    Read an object, or a list, as plain dicts.
+
+    * With ``name``, returns the object, or ``None`` when it does not exist.
+    * Without ``name``, returns the list of items. For a table, returns
+      the whole Table object, see ``table_rows``.
+    * ``fields`` replaces each object with its ``project``.
+    * ``metadata_only`` asks for PartialObjectMetadata, without spec and
+      status.
+    """
+    resource = oc_client.resources.get(api_version=api_version, kind=kind)
+    header_params = {}
+    if table:
+        header_params["Accept"] = TABLE_ACCEPT
+    elif metadata_only:
+        header_params["Accept"] = METADATA_ACCEPT
+    try:
+        response = oc_client.request(
+            "GET", resource.path(name=name, namespace=namespace),
+            label_selector=label_selector, field_selector=field_selector,
+            header_params=header_params, serialize=False,
+        )
+    except NotFoundError:
+        if name:
+            return None
+        raise
+    data = _loads(response.data)
+    if table:
+        return data
+    if name:
+        return project(data, fields) if fields else data
+    items = data.get("items") or []
+    return [project(item, fields) for item in items] if fields else items
+
+
+def table_rows(table: Dict) -> List[Dict[str, Any]]:
+    """
+    Turn a Table response into one {column name: cell} dict per row.
+    """
+    columns = [column["name"] for column in table.get("columnDefinitions", [])]
+    return [dict(zip(columns, row.get("cells", []))) for row in table.get("rows", [])]
@@ -0,0 +1,233 @@
+"""
+Wait for the cluster to be usable before a lab verb runs
+
+The gate probes, in order:
+
+1. the API server ``/readyz`` endpoint
+2. the OAuth server, found from the API server OAuth metadata
+3. the login of the lab client
+4. the ClusterVersion and every ClusterOperator, which must be Available,
+   except for ``finish``
+
+Each probe is retried with a jittered exponential backoff until it passes
+or the deadline is reached. A rejected login, HTTP 401 or 403, is final:
+waiting does not fix a wrong password or token. The component still
+pending is printed each time it changes, and the lab proceeds as soon as
+all the probes pass. The deadline defaults to 15 minutes and can be
+changed with the ``LAB_READY_TIMEOUT`` environment variable, in seconds.
+"""
+
+import os
+import time
+import random
+import logging
+import requests
+
+from typing import Callable, List, Optional
+
+from kubernetes.client.exceptions import ApiException
+from kubernetes.dynamic.exceptions import ResourceNotFoundError
+from urllib3 import disable_warnings
+from urllib3.exceptions import HTTPError, InsecureRequestWarning
+
+from . import rawapi
+
+
+DEFAULT_API_URL = "https://api.ocp4.example.com:6443"
+
+READY_TIMEOUT = int(os.environ.get("LAB_READY_TIMEOUT", 15 * 60))
+
+# Backoff between two probes, in seconds
+BACKOFF_INITIAL = 2
+BACKOFF_MAX = 30
+
+# Seconds for one probe request
+PROBE_TIMEOUT = 10
+
+# HTTP status codes that no amount of waiting changes
+FINAL_STATUSES = (401, 403)
+
+disable_warnings(InsecureRequestWarning)
+
+
+class ClusterNotReady(Exception):
+    """
+    The cluster was not usable before the deadline, or ``final`` when it
+    rejected the request and waiting would not help.
+    ``exit_code`` is 3 when the API server cannot be reached, and 2 when
+    it answers but the cluster is not ready.
+    """
+
+    def __init__(self, component: str, reason: str, exit_code: int = 2, final: bool = False):
+        super().__init__(component, reason)
+        self.component = component
+        self.reason = reason
+        self.exit_code = exit_code
+        self.final = final
+
+    def __str__(self):
+        if self.final:
+            return "The OpenShift cluster rejected the {}: {}.".format(self.component, self.reason)
+        return "The OpenShift cluster is not ready: {} ({}). Please try again later.".format(
+            self.component, self.reason)
+
+
+def api_url(ocp_api: Optional[dict]) -> str:
+    """
+    Return the API server URL from the ``OCP_API`` settings of a lab.
+    """
+    if ocp_api and ocp_api.get("host"):
+        host = ocp_api["host"]
+        if "://" not in host:
+            host = "https://" + host
+        return "{}:{}".format(host, ocp_api.get("port", "6443"))
+    return os.environ.get("OCP_API_URL", DEFAULT_API_URL)
+
+
+def _status(e: Exception) -> Optional[int]:
+    if isinstance(e, ApiException):
+        return e.status
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return e.response.status_code
+    return None
+
+
+def _reason(e: Exception) -> str:
+    if isinstance(e, ApiException):
+        return "HTTP {} {}".format(e.status, e.reason or "")
+    if isinstance(e, requests.exceptions.ConnectionError):
+        return "connection refused or unreachable"
+    if isinstance(e, requests.exceptions.Timeout):
+        return "no answer in {} seconds".format(PROBE_TIMEOUT)
+    return "{}: {}".format(e.__class__.__name__, str(e)[:200])
+
+
+class ReadinessGate:
+    """
+    Retry readiness probes until they pass or the deadline is reached.
+    """
+
+    def __init__(self, url: str, timeout: int = READY_TIMEOUT, output=print):
+        self.url = url.rstrip("/")
+        self.deadline = time.time() + timeout
+        self.output = output
+        self._pending = None
+
+    def _report(self, component: str, reason: str):
+        pending = "{}: {}".format(component, reason)
+        if pending != self._pending:
+            self._pending = pending
+            self.output("Waiting for the {}".format(pending))
+            logging.debug("Readiness: {}".format(pending))
+
+    def wait(self, component: str, probe: Callable[[], Optional[str]], exit_code: int = 2):
+        """
+        Call ``probe`` until it returns ``None``. Any other value, or an
+        exception, is the reason the component is not ready yet.
+        """
+        delay = BACKOFF_INITIAL
+        while True:
+            try:
+                reason = probe()
+            except (requests.exceptions.RequestException, ApiException, HTTPError,
+                    OSError, ValueError) as e:
+                if _status(e) in FINAL_STATUSES:
+                    raise ClusterNotReady(component, _reason(e), exit_code, final=True) from e
+                reason = _reason(e)
+            if reason is None:
+                if self._pending and self._pending.startswith(component):
+                    logging.debug("Readiness: {} is ready".format(component))
+                return
+            if time.time() + delay > self.deadline:
+                raise ClusterNotReady(component, reason, exit_code)
+            self._report(component, reason)
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, BACKOFF_MAX)
+
+    def _get(self, url: str) -> requests.Response:
+        return requests.get(url, verify=False, timeout=PROBE_TIMEOUT)
+
+    def probe_api(self) -> Optional[str]:
+        response = self._get(self.url + "/readyz")
+        if response.status_code != 200:
+            return "/readyz returned {}".format(response.status_code)
+        return None
+
+    def probe_oauth(self) -> Optional[str]:
+        metadata = self._get(self.url + "/.well-known/oauth-authorization-server")
+        if metadata.status_code == 404:
+            # Not an OpenShift cluster, there is no OAuth server to wait for
+            return None
+        if metadata.status_code != 200:
+            return "OAuth metadata returned {}".format(metadata.status_code)
+        issuer = metadata.json().get("issuer")
+        response = self._get(issuer.rstrip("/") + "/healthz")
+        if response.status_code != 200:
+            return "{} returned {}".format(issuer, response.status_code)
+        return None
+
+    def wait_for_api(self):
+        self.wait("API server", self.probe_api, exit_code=3)
+        self.wait("OAuth server", self.probe_oauth)
+
+    def login(self, connect: Callable[[], None]):
+        """
+        Retry the login of the lab client until it succeeds.
+        """
+        def probe():
+            connect()
+            return None
+
+        self.wait("login", probe)
+
+    def wait_for_cluster(self, oc_client):
+        def probe():
+            pending = unavailable(oc_client)
+            if pending:
+                return "not available: {}".format(", ".join(pending))
+            return None
+
+        self.wait("cluster operators", probe)
+
+
+def _available(obj: dict) -> bool:
+    return any(
+        c.get("type") == "Available" and c.get("status") == "True"
+        for c in (obj.get("status") or {}).get("conditions") or []
+    )
+
+
+def unavailable(oc_client) -> List[str]:
+    """
+    Return the ClusterVersion and ClusterOperators that are not Available.
+    """
+    try:
+        versions = rawapi.get(oc_client, "config.openshift.io/v1", "ClusterVersion")
+    except ResourceNotFoundError:
+        # Not an OpenShift cluster
+        return []
+    pending = [
+        "clusterversion"
+        for cv in versions
+        if not _available(cv)
+    ]
+    for co in rawapi.get(oc_client, "config.openshift.io/v1", "ClusterOperator"):
+        if not _available(co):
+            pending.append(co["metadata"]["name"])
+    return pending
+
+
+def wait_until_ready(url: str, connect: Callable[[], None], client: Callable[[], object],
+                     timeout: int = READY_TIMEOUT, operators: bool = True) -> float:
+    """
+    Run the whole gate: API server, OAuth, login and, with ``operators``,
+    cluster operators. ``connect`` logs the lab client in, ``client``
+    returns it afterwards. Returns the seconds spent waiting.
+    """
+    start = time.time()
+    gate = ReadinessGate(url, timeout)
+    gate.wait_for_api()
+    gate.login(connect)
+    if operators:
+        gate.wait_for_cluster(client())
+    return time.time() - start
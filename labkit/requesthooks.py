@@ -0,0 +1,130 @@
+"""
+Observe the HTTP requests of the Kubernetes client
+
+``install()`` wraps ``RESTClientObject.request``, the single call through
+which the dynamic client talks to the API server. Every registered hook
+is then called once per request with a dict:
+
+    {"method": "GET", "path": "/api/v1/nodes", "query": "limit=500",
+     "status": 200, "bytes": 1234, "bytes_out": 0, "seconds": 0.012,
+     "error": None}
+
+Hooks registered with ``add_start`` are called with the same dict just
+before the request is sent.
+
+``seconds`` is the time until the response headers arrived. When the
+client reads the body later, ``bytes`` is filled in at that point, so a
+hook that keeps the dict sees the final size.
+"""
+
+import json
+import time
+import logging
+import threading
+
+from typing import Callable, Dict, List
+from urllib.parse import urlparse
+
+
+_hooks: List[Callable[[Dict], None]] = []
+_start_hooks: List[Callable[[Dict], None]] = []
+_lock = threading.Lock()
+_original = None
+
+
+def _size(response, entry: Dict):
+    data = getattr(response, "data", None)
+    if isinstance(data, (bytes, str)):
+        entry["bytes"] = len(data)
+        return
+    getheader = getattr(response, "getheader", None)
+    length = getheader("Content-Length") if getheader else None
+    if length is not None:
+        entry["bytes"] = int(length)
+    read = getattr(response, "read", None)
+    if read is not None and hasattr(response, "response"):
+        # The body is read after the request returns
+        def counting_read(*args, **kwargs):
+            result = read(*args, **kwargs)
+            if isinstance(result, (bytes, str)):
+                entry["bytes"] = len(result)
+            return result
+        response.read = counting_read
+
+
+def _body_size(body) -> int:
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    try:
+        return len(json.dumps(body, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _traced_request(self, *args, **kwargs):
+    method = kwargs.get("method", args[0] if args else None)
+    url = urlparse(kwargs.get("url", args[1] if len(args) > 1 else ""))
+    entry = {
+        "method": method, "path": url.path, "query": url.query, "status": None,
+        "bytes": None, "bytes_out": _body_size(kwargs.get("body")),
+        "seconds": None, "error": None,
+    }
+    _notify(entry, _start_hooks)
+    start = time.perf_counter()
+    try:
+        response = _original(self, *args, **kwargs)
+    except Exception as e:
+        entry["seconds"] = round(time.perf_counter() - start, 6)
+        entry["status"] = getattr(e, "status", None)
+        entry["error"] = e.__class__.__name__
+        _notify(entry, _hooks)
+        raise
+    entry["seconds"] = round(time.perf_counter() - start, 6)
+    entry["status"] = getattr(response, "status", None)
+    _size(response, entry)
+    _notify(entry, _hooks)
+    return response
+
+
+def _notify(entry: Dict, hooks: List[Callable[[Dict], None]]):
+    for hook in list(hooks):
+        try:
+            hook(entry)
+        except Exception:
+            logging.debug("Request hook failed", exc_info=True)
+
+
+def install():
+    """
+    Wrap the REST client once. Safe to call several times.
+    """
+    global _original
+    from kubernetes.client import rest
+
+    with _lock:
+        if _original is None:
+            _original = rest.RESTClientObject.request
+            rest.RESTClientObject.request = _traced_request
+
+
+def add(hook: Callable[[Dict], None]):
+    install()
+    with _lock:
+        if hook not in _hooks:
+            _hooks.append(hook)
+
+
+def add_start(hook: Callable[[Dict], None]):
+    install()
+    with _lock:
+        if hook not in _start_hooks:
+            _start_hooks.append(hook)
+
+
+def remove(hook: Callable[[Dict], None]):
+    with _lock:
+        for hooks in (_hooks, _start_hooks):
+            if hook in hooks:
+                hooks.remove(hook)
@@ -0,0 +1,683 @@
+"""
+Apply the solution manifests of a lab
+
+Loads the ``solutions/<lab>`` tree, builds the kustomizations it contains,
+orders the objects by kind dependency, and server-side applies them in
+parallel batches. Workloads are then awaited with watches instead of
+polling.
+
+The kustomize build is done in-process and covers the features used by
+the course solutions: resources and bases, namespace, namePrefix and
+nameSuffix, commonLabels, labels, commonAnnotations, images, replicas,
+configMapGenerator and secretGenerator, and strategic merge or JSON 6902
+patches. Shell scripts found in the solution tree are not run.
+"""
+
+import os
+import re
+import copy
+import json
+import time
+import base64
+import shutil
+import hashlib
+import logging
+import tempfile
+import yaml
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+
+KUSTOMIZATION_FILES = ["kustomization.yaml", "kustomization.yml", "Kustomization"]
+
+FIELD_MANAGER = "lab-fix"
+
+# solution-v1.1.0.yaml and the like, one complete copy per version
+VERSIONED_FILE = re.compile(r"(?P<stem>.+)-v(?P<version>\d+(\.\d+)*)\.(yaml|yml|json)")
+
+# Objects of the same rank are applied in the same parallel batch
+KIND_ORDER = [
+    "Namespace",
+    "Project",
+    "CustomResourceDefinition",
+    "OperatorGroup",
+    "Subscription",
+    "ResourceQuota",
+    "LimitRange",
+    "PodSecurityPolicy",
+    "SecurityContextConstraints",
+    "ServiceAccount",
+    "Secret",
+    "ConfigMap",
+    "StorageClass",
+    "PersistentVolume",
+    "PersistentVolumeClaim",
+    "ClusterRole",
+    "ClusterRoleBinding",
+    "Role",
+    "RoleBinding",
+    "NetworkAttachmentDefinition",
+    "Service",
+    "DaemonSet",
+    "Pod",
+    "ReplicaSet",
+    "Deployment",
+    "DeploymentConfig",
+    "StatefulSet",
+    "Job",
+    "CronJob",
+    "HorizontalPodAutoscaler",
+    "PodDisruptionBudget",
+    "Ingress",
+    "Route",
+    "NetworkPolicy",
+]
+
+# Kinds that never get a namespace
+CLUSTER_KINDS = {
+    "Namespace", "Project", "CustomResourceDefinition", "ClusterRole",
+    "ClusterRoleBinding", "PersistentVolume", "StorageClass",
+    "SecurityContextConstraints", "OAuth", "Group", "User", "APIService",
+}
+
+# Kinds with a pod template, and where their selector lives
+WORKLOAD_KINDS = {"Deployment", "StatefulSet", "DaemonSet", "ReplicaSet", "Job", "DeploymentConfig"}
+
+# Workloads awaited after the apply
+READY_KINDS = {"Deployment", "StatefulSet", "DaemonSet"}
+
+
+class SolutionError(Exception):
+    pass
+
+
+def read_yaml_documents(path: str) -> List[Dict]:
+    with open(path) as f:
+        return [doc for doc in yaml.safe_load_all(f) if doc]
+
+
+def find_kustomization(directory: str) -> Optional[str]:
+    for name in KUSTOMIZATION_FILES:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+############################################################################
+# Kustomize build
+
+def _hash_suffix(obj: Dict) -> str:
+    """
+    Compute the name suffix kustomize adds to generated objects.
+    """
+    encoded = {"kind": obj["kind"], "name": obj["metadata"]["name"], "data": obj.get("data", {})}
+    if obj["kind"] == "Secret":
+        encoded["type"] = obj.get("type", "Opaque")
+    text = json.dumps(encoded, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    text = text.replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026")
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:10]
+    return digest.translate(str.maketrans("013ae", "ghkmt"))
+
+
+def _generator_data(directory: str, spec: Dict) -> Dict[str, str]:
+    data = {}
+    for literal in spec.get("literals", []):
+        key, _, value = literal.partition("=")
+        data[key] = value.strip('"')
+    for entry in spec.get("files", []):
+        key, sep, path = entry.partition("=")
+        if not sep:
+            key, path = os.path.basename(entry), entry
+        with open(os.path.join(directory, path)) as f:
+            data[key] = f.read()
+    for path in spec.get("envs", []) + ([spec["env"]] if "env" in spec else []):
+        with open(os.path.join(directory, path)) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    key, _, value = line.partition("=")
+                    data[key] = value
+    return data
+
+
+def _generate(directory: str, kustomization: Dict, objects: List[Dict]) -> Dict[str, str]:
+    """
+    Run the ConfigMap and Secret generators.
+    Returns the renames caused by the hash suffixes.
+    """
+    renames = {}
+    options = kustomization.get("generatorOptions", {})
+    for kind, key in (("ConfigMap", "configMapGenerator"), ("Secret", "secretGenerator")):
+        for spec in kustomization.get(key, []):
+            name = spec["name"]
+            data = _generator_data(directory, spec)
+            if kind == "Secret":
+                data = {k: base64.b64encode(v.encode("utf-8")).decode("ascii") for k, v in data.items()}
+            existing = next((o for o in objects if o["kind"] == kind
+                             and o["metadata"].get("annotations", {}).get("kustomize.generated/name") == name), None)
+            behavior = spec.get("behavior", "create")
+            if existing is not None and behavior in ("merge", "replace"):
+                if behavior == "merge":
+                    data = dict(existing.get("data", {}), **data)
+                objects.remove(existing)
+            obj = {"apiVersion": "v1", "kind": kind, "metadata": {"name": name}, "data": data}
+            if kind == "Secret":
+                obj["type"] = spec.get("type", "Opaque")
+            labels = dict(options.get("labels", {}), **spec.get("options", {}).get("labels", {}))
+            annotations = dict(options.get("annotations", {}), **spec.get("options", {}).get("annotations", {}))
+            if labels:
+                obj["metadata"]["labels"] = labels
+            if annotations:
+                obj["metadata"]["annotations"] = annotations
+            disable_hash = spec.get("options", {}).get(
+                "disableNameSuffixHash", options.get("disableNameSuffixHash", False))
+            if not disable_hash:
+                obj["metadata"]["name"] = "{}-{}".format(name, _hash_suffix(obj))
+                renames[(kind, name)] = obj["metadata"]["name"]
+            obj["metadata"].setdefault("annotations", {})["kustomize.generated/name"] = name
+            objects.append(obj)
+    return renames
+
+
+def _pod_spec(obj: Dict) -> Optional[Dict]:
+    spec = obj.get("spec", {})
+    if obj["kind"] == "Pod":
+        return spec
+    if obj["kind"] == "CronJob":
+        return spec.get("jobTemplate", {}).get("spec", {}).get("template", {}).get("spec")
+    if obj["kind"] in WORKLOAD_KINDS:
+        return spec.get("template", {}).get("spec")
+    return None
+
+
+def _rename_references(objects: List[Dict], renames: Dict):
+    """
+    Update the ConfigMap, Secret and Service references after a rename.
+    """
+    def rename(kind, name):
+        return renames.get((kind, name), name)
+
+    for obj in objects:
+        pod = _pod_spec(obj)
+        if pod is not None:
+            for volume in pod.get("volumes", []):
+                if "configMap" in volume:
+                    volume["configMap"]["name"] = rename("ConfigMap", volume["configMap"].get("name"))
+                if "secret" in volume:
+                    volume["secret"]["secretName"] = rename("Secret", volume["secret"].get("secretName"))
+            for container in pod.get("containers", []) + pod.get("initContainers", []):
+                for source in container.get("envFrom", []):
+                    if "configMapRef" in source:
+                        source["configMapRef"]["name"] = rename("ConfigMap", source["configMapRef"]["name"])
+                    if "secretRef" in source:
+                        source["secretRef"]["name"] = rename("Secret", source["secretRef"]["name"])
+                for env in container.get("env", []):
+                    ref = env.get("valueFrom", {})
+                    if "configMapKeyRef" in ref:
+                        ref["configMapKeyRef"]["name"] = rename("ConfigMap", ref["configMapKeyRef"]["name"])
+                    if "secretKeyRef" in ref:
+                        ref["secretKeyRef"]["name"] = rename("Secret", ref["secretKeyRef"]["name"])
+        if obj["kind"] == "Route" and "to" in obj.get("spec", {}):
+            obj["spec"]["to"]["name"] = rename("Service", obj["spec"]["to"]["name"])
+        if obj["kind"] == "StatefulSet" and "serviceName" in obj.get("spec", {}):
+            obj["spec"]["serviceName"] = rename("Service", obj["spec"]["serviceName"])
+
+
+def _add_labels(obj: Dict, labels: Dict, selectors: bool):
+    obj["metadata"].setdefault("labels", {}).update(labels)
+    if not selectors:
+        return
+    spec = obj.get("spec", {})
+    if obj["kind"] in WORKLOAD_KINDS:
+        if obj["kind"] == "DeploymentConfig":
+            spec.setdefault("selector", {}).update(labels)
+        else:
+            spec.setdefault("selector", {}).setdefault("matchLabels", {}).update(labels)
+        spec.setdefault("template", {}).setdefault("metadata", {}).setdefault("labels", {}).update(labels)
+    elif obj["kind"] == "Service":
+        spec.setdefault("selector", {}).update(labels)
+
+
+def _set_images(obj: Dict, images: List[Dict]):
+    pod = _pod_spec(obj)
+    if pod is None:
+        return
+    for container in pod.get("containers", []) + pod.get("initContainers", []):
+        image = container.get("image", "")
+        name = re.split(r"[:@]", image.split("/")[-1])[0]
+        repo = image.rsplit("@", 1)[0]
+        if ":" in repo.split("/")[-1]:
+            repo = repo.rsplit(":", 1)[0]
+        for spec in images:
+            if spec["name"] not in (repo, name):
+                continue
+            new = spec.get("newName", repo)
+            if "digest" in spec:
+                container["image"] = "{}@{}".format(new, spec["digest"])
+            else:
+                tag = spec.get("newTag", image[len(repo) + 1:] if len(image) > len(repo) else "")
+                container["image"] = "{}:{}".format(new, tag) if tag else new
+
+
+def strategic_merge(base, patch):
+    """
+    Merge a strategic merge patch. Lists of objects are merged by name.
+    """
+    if isinstance(base, dict) and isinstance(patch, dict):
+        if patch.get("$patch") == "delete":
+            return None
+        result = dict(base)
+        for key, value in patch.items():
+            if key == "$patch":
+                continue
+            if value is None:
+                result.pop(key, None)
+            elif key in result:
+                result[key] = strategic_merge(result[key], value)
+            else:
+                result[key] = copy.deepcopy(value)
+        return result
+    if (isinstance(base, list) and isinstance(patch, list)
+            and all(isinstance(i, dict) and "name" in i for i in base + patch)):
+        result = list(base)
+        for value in patch:
+            index = next((i for i, b in enumerate(result) if b["name"] == value["name"]), None)
+            if index is None:
+                result.append(copy.deepcopy(value))
+            else:
+                merged = strategic_merge(result[index], value)
+                if merged is None:
+                    del result[index]
+                else:
+                    result[index] = merged
+        return result
+    return copy.deepcopy(patch)
+
+
+def _pointer(path: str) -> List[str]:
+    return [p.replace("~1", "/").replace("~0", "~") for p in path.lstrip("/").split("/")] if path else []
+
+
+def json_patch(obj: Dict, operations: List[Dict]) -> Dict:
+    """
+    Apply JSON 6902 operations (add, replace, remove, test).
+    """
+    obj = copy.deepcopy(obj)
+    for op in operations:
+        parts = _pointer(op["path"])
+        parent = obj
+        for part in parts[:-1]:
+            parent = parent[int(part)] if isinstance(parent, list) else parent[part]
+        last = parts[-1]
+        if isinstance(parent, list):
+            index = len(parent) if last == "-" else int(last)
+            if op["op"] == "add":
+                parent.insert(index, op["value"])
+            elif op["op"] == "replace":
+                parent[index] = op["value"]
+            elif op["op"] == "remove":
+                del parent[index]
+            elif op["op"] == "test" and parent[index] != op["value"]:
+                raise SolutionError("JSON patch test failed at {}".format(op["path"]))
+        else:
+            if op["op"] in ("add", "replace"):
+                parent[last] = op["value"]
+            elif op["op"] == "remove":
+                del parent[last]
+            elif op["op"] == "test" and parent.get(last) != op["value"]:
+                raise SolutionError("JSON patch test failed at {}".format(op["path"]))
+    return obj
+
+
+def _target_matches(obj: Dict, target: Dict) -> bool:
+    metadata = obj["metadata"]
+    if "kind" in target and target["kind"] != obj["kind"]:
+        return False
+    if "name" in target and not re.fullmatch(target["name"], metadata["name"]):
+        return False
+    if "namespace" in target and target["namespace"] != metadata.get("namespace"):
+        return False
+    if "labelSelector" in target:
+        labels = metadata.get("labels", {})
+        for term in target["labelSelector"].split(","):
+            key, _, value = term.partition("=")
+            if labels.get(key.strip()) != value.strip():
+                return False
+    return True
+
+
+def _apply_patch(directory: str, objects: List[Dict], patch_spec) -> List[Dict]:
+    if isinstance(patch_spec, str):
+        patch_spec = {"path": patch_spec}
+    if "path" in patch_spec:
+        with open(os.path.join(directory, patch_spec["path"])) as f:
+            content = f.read()
+    else:
+        content = patch_spec["patch"]
+    patches = [p for p in yaml.safe_load_all(content) if p]
+    target = patch_spec.get("target")
+    result = []
+    for obj in objects:
+        for patch in patches:
+            if isinstance(patch, list):
+                if target and _target_matches(obj, target):
+                    obj = json_patch(obj, patch)
+            else:
+                selector = target or {
+                    "kind": patch.get("kind"),
+                    "name": re.escape(patch.get("metadata", {}).get("name", "")),
+                }
+                if _target_matches(obj, {k: v for k, v in selector.items() if v}):
+                    body = dict(patch)
+                    if target:
+                        body.pop("metadata", None)
+                    obj = strategic_merge(obj, body)
+        if obj is not None:
+            result.append(obj)
+    return result
+
+
+def kustomize_build(directory: str) -> List[Dict]:
+    """
+    Build a kustomization directory and return its objects.
+    """
+    path = find_kustomization(directory)
+    if path is None:
+        raise SolutionError("No kustomization file in {}".format(directory))
+    with open(path) as f:
+        kustomization = yaml.safe_load(f) or {}
+
+    objects = []
+    for resource in kustomization.get("bases", []) + kustomization.get("resources", []):
+        resource_path = os.path.normpath(os.path.join(directory, resource))
+        if os.path.isdir(resource_path):
+            objects.extend(kustomize_build(resource_path))
+        elif os.path.isfile(resource_path):
+            objects.extend(read_yaml_documents(resource_path))
+        else:
+            raise SolutionError("Resource {} not found in {}".format(resource, directory))
+
+    renames = _generate(directory, kustomization, objects)
+
+    for patch_spec in (kustomization.get("patchesStrategicMerge", [])
+                       + kustomization.get("patchesJson6902", [])
+                       + kustomization.get("patches", [])):
+        objects = _apply_patch(directory, objects, patch_spec)
+
+    prefix = kustomization.get("namePrefix", "")
+    suffix = kustomization.get("nameSuffix", "")
+    namespace = kustomization.get("namespace")
+    replicas = {r["name"]: r["count"] for r in kustomization.get("replicas", [])}
+    for obj in objects:
+        metadata = obj.setdefault("metadata", {})
+        kind = obj["kind"]
+        if (prefix or suffix) and kind not in ("Namespace", "CustomResourceDefinition"):
+            old = metadata["name"]
+            metadata["name"] = "{}{}{}".format(prefix, old, suffix)
+            renames[(kind, old)] = metadata["name"]
+            generated = metadata.get("annotations", {}).get("kustomize.generated/name")
+            if generated:
+                renames[(kind, generated)] = metadata["name"]
+        if namespace and kind not in CLUSTER_KINDS:
+            metadata["namespace"] = namespace
+        if kustomization.get("commonLabels"):
+            _add_labels(obj, kustomization["commonLabels"], selectors=True)
+        for entry in kustomization.get("labels", []):
+            _add_labels(obj, entry.get("pairs", {}), selectors=entry.get("includeSelectors", False))
+        if kustomization.get("commonAnnotations"):
+            metadata.setdefault("annotations", {}).update(kustomization["commonAnnotations"])
+        if kustomization.get("images"):
+            _set_images(obj, kustomization["images"])
+        if kind in WORKLOAD_KINDS and metadata["name"] in replicas:
+            obj.setdefault("spec", {})["replicas"] = replicas[metadata["name"]]
+    _rename_references(objects, renames)
+    return objects
+
+
+############################################################################
+# Solution loading and apply
+
+def _version_key(name: str):
+    return [int(p) for p in re.findall(r"\d+", name)]
+
+
+def _layer_versions(directory: str, versions: List[str], target: str):
+    """
+    Copy the versioned directories on top of each other, oldest first.
+    Each version only holds the files changed since the previous one.
+    """
+    for version in versions:
+        source = os.path.join(directory, version)
+        for dirpath, _, filenames in os.walk(source):
+            destination = os.path.join(target, os.path.relpath(dirpath, source))
+            os.makedirs(destination, exist_ok=True)
+            for filename in filenames:
+                shutil.copy2(os.path.join(dirpath, filename), destination)
+
+
+def _latest_files(entries: List[str]) -> List[str]:
+    """
+    Return the versioned files (name-v1.1.0.yaml, name-v1.1.1.yaml, ...)
+    that are not the highest version of their name. Unlike versioned
+    directories, each version is a complete copy of the file.
+    """
+    latest = {}
+    for entry in entries:
+        match = VERSIONED_FILE.fullmatch(entry)
+        if match:
+            latest.setdefault(match.group("stem"), []).append(entry)
+    return [
+        entry
+        for files in latest.values()
+        for entry in sorted(files, key=lambda f: _version_key(VERSIONED_FILE.fullmatch(f).group("version")))[:-1]
+    ]
+
+
+def load_solution(directory: str) -> List[Dict]:
+    """
+    Return the objects of a solution tree.
+    A directory with a kustomization is built, other directories are walked
+    and their YAML files loaded. Versioned directories (v1.1.0, v1.1.1, ...)
+    are layered in order and the result is built from its production
+    overlay, or from its base. Of the versioned files, only the highest
+    version of each name is loaded.
+    """
+    if find_kustomization(directory):
+        return kustomize_build(directory)
+
+    entries = sorted(os.listdir(directory))
+    versions = sorted((e for e in entries if re.fullmatch(r"v\d+(\.\d+)*", e)), key=_version_key)
+    superseded = _latest_files(entries)
+    objects = []
+    for entry in entries:
+        path = os.path.join(directory, entry)
+        if entry in versions:
+            continue
+        if entry in superseded:
+            logging.debug("Skipping {}, a later version replaces it".format(path))
+            continue
+        if os.path.isdir(path):
+            objects.extend(load_solution(path))
+        elif entry.endswith((".yaml", ".yml", ".json")):
+            objects.extend(
+                doc for doc in read_yaml_documents(path)
+                if isinstance(doc, dict) and "kind" in doc and doc["kind"] != "Kustomization"
+            )
+        else:
+            logging.debug("Skipping {} from the solution".format(path))
+
+    if versions:
+        with tempfile.TemporaryDirectory() as layered:
+            _layer_versions(directory, versions, layered)
+            for candidate in ("overlays/production", "base", "."):
+                path = os.path.join(layered, candidate)
+                if os.path.isdir(path):
+                    return objects + load_solution(path)
+    return objects
+
+
+def kind_rank(obj: Dict) -> int:
+    try:
+        return KIND_ORDER.index(obj["kind"])
+    except ValueError:
+        return len(KIND_ORDER)
+
+
+def _strip_build_annotations(obj: Dict) -> Dict:
+    annotations = obj.get("metadata", {}).get("annotations")
+    if annotations:
+        annotations.pop("kustomize.generated/name", None)
+        if not annotations:
+            del obj["metadata"]["annotations"]
+    return obj
+
+
+def object_key(obj: Dict):
+    metadata = obj["metadata"]
+    return obj["apiVersion"], obj["kind"], metadata.get("namespace"), metadata["name"]
+
+
+def apply_objects(oc_client, objects: List[Dict], namespace: Optional[str] = None,
+                  workers: int = 8) -> List[Dict]:
+    """
+    Server-side apply the objects, one parallel batch per kind rank.
+    When the solution declares an object several times, the last
+    declaration is applied. Returns the applied objects, with their
+    namespace filled in.
+    """
+    # Resolve the kinds before the threads use the discovery cache
+    resources = {}
+    unique = {}
+    for obj in objects:
+        obj = _strip_build_annotations(copy.deepcopy(obj))
+        kind = (obj["apiVersion"], obj["kind"])
+        if kind not in resources:
+            resources[kind] = oc_client.resources.get(api_version=kind[0], kind=kind[1])
+        if resources[kind].namespaced:
+            obj["metadata"].setdefault("namespace", namespace)
+        else:
+            obj["metadata"].pop("namespace", None)
+        key = object_key(obj)
+        if key in unique:
+            logging.debug("{} {} is declared more than once, applying the last one".format(
+                obj["kind"], obj["metadata"]["name"]))
+            del unique[key]
+        unique[key] = obj
+
+    def apply(obj):
+        oc_client.server_side_apply(
+            resources[(obj["apiVersion"], obj["kind"])],
+            body=obj,
+            name=obj["metadata"]["name"],
+            namespace=obj["metadata"].get("namespace"),
+            field_manager=FIELD_MANAGER,
+            force_conflicts=True,
+        )
+        logging.debug("Applied {} {}".format(obj["kind"], obj["metadata"]["name"]))
+        return obj
+
+    batches = {}
+    for obj in unique.values():
+        batches.setdefault(kind_rank(obj), []).append(obj)
+    applied = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for rank in sorted(batches):
+            applied.extend(executor.map(apply, batches[rank]))
+    return applied
+
+
+def _is_ready(obj: Dict) -> bool:
+    spec, status = obj.get("spec", {}), obj.get("status", {})
+    if status.get("observedGeneration", 0) < obj.get("metadata", {}).get("generation", 0):
+        return False
+    if obj["kind"] == "DaemonSet":
+        return status.get("numberReady", 0) >= status.get("desiredNumberScheduled", 1)
+    return status.get("readyReplicas", 0) >= spec.get("replicas", 1)
+
+
+def wait_ready(oc_client, objects: List[Dict], timeout: int = 300) -> List[str]:
+    """
+    Wait for the applied workloads to be ready, with one watch per kind
+    and namespace. Returns the workloads that are still not ready.
+    """
+    pending = {}
+    for obj in objects:
+        if obj["kind"] in READY_KINDS:
+            key = (obj["apiVersion"], obj["kind"], obj["metadata"].get("namespace"))
+            pending.setdefault(key, set()).add(obj["metadata"]["name"])
+
+    deadline = time.time() + timeout
+    not_ready = []
+    for (api_version, kind, namespace), names in pending.items():
+        resource = oc_client.resources.get(api_version=api_version, kind=kind)
+        listing = resource.get(namespace=namespace)
+        for item in listing.items:
+            if item.metadata.name in names and _is_ready(item.to_dict()):
+                names.discard(item.metadata.name)
+        remaining = deadline - time.time()
+        if names and remaining > 0:
+            for event in oc_client.watch(resource, namespace=namespace,
+                                         resource_version=listing.metadata.resourceVersion,
+                                         timeout=max(1, int(remaining))):
+                obj = event["raw_object"]
+                name = obj.get("metadata", {}).get("name")
+                if name in names and event["type"] in ("ADDED", "MODIFIED") and _is_ready(obj):
+                    names.discard(name)
+                if not names or time.time() > deadline:
+                    break
+        not_ready.extend("{}/{}".format(kind, name) for name in sorted(names))
+    return not_ready
+
+
+############################################################################
+# Lab tasks
+
+def apply_solution(item: Dict):
+    """
+    Apply the solution manifests of a lab.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * ``path`` is the solution directory
+    * ``namespace`` is the default namespace for namespaced objects
+    The applied objects are saved in ``item["objects"]``.
+    """
+    item["failed"] = False
+    path = item["path"]
+    if not os.path.isdir(path):
+        item["failed"] = True
+        item["msgs"] = [{"text": "The fix command is not supported for this lab."}]
+        return item
+    try:
+        objects = load_solution(path)
+        if not objects:
+            raise SolutionError("No manifests found in the solution")
+        item["objects"] = apply_objects(item["oc_client"], objects, item.get("namespace"))
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot apply the solution: {}".format(e)}]
+        item["exception"] = {"name": e.__class__.__name__, "message": str(e)}
+    return item
+
+
+def wait_solution_ready(item: Dict):
+    """
+    Wait for the workloads applied by ``apply_solution``.
+    The following parameters are used:
+    * ``oc_client`` is the OpenShift client
+    * ``source`` is the ``apply_solution`` item
+    * (optional) ``timeout`` in seconds, 300 by default
+    """
+    item["failed"] = False
+    objects = item["source"].get("objects", [])
+    try:
+        not_ready = wait_ready(item["oc_client"], objects, item.get("timeout", 300))
+    except Exception as e:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Cannot check the workloads: {}".format(e)}]
+        return item
+    if not_ready:
+        item["failed"] = True
+        item["msgs"] = [{"text": "Not ready: {}".format(", ".join(not_ready))}]
+    return item
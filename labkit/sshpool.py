@@ -0,0 +1,157 @@
+"""
+Shared SSH connections to the lab hosts
+
+Every ``ssh`` to ``workstation`` or ``utility`` used to pay a full
+handshake. Within a lab run, the connections now go through one
+multiplexed master per host, opened by the first connection and closed
+when the run exits.
+
+``configure`` creates a private socket directory for the run and exports
+it to Ansible with ``ANSIBLE_SSH_CONTROL_PATH_DIR`` and
+``ANSIBLE_SSH_CONTROL_PATH``, which take precedence over
+``ansible.cfg``, and the master options in ``ANSIBLE_SSH_ARGS`` unless
+the user already set them. Python tasks share the same masters through
+``run``, which logs in with the ``ansible_user`` of the host in
+``ansible/inventory``. No ssh configuration file of the user is written.
+
+The ``run_command`` steps of the ``labs`` package connect with paramiko,
+which has no connection multiplexing, and do not use the masters.
+"""
+
+import os
+import shlex
+import atexit
+import shutil
+import logging
+import functools
+import tempfile
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+
+# Socket name inside the directory of the run, as in ansible.cfg
+CONTROL_NAME = "lab-%r@%h-%p"
+
+# Seconds an idle master stays open, it is closed at exit anyway
+PERSIST = int(os.environ.get("LAB_SSH_PERSIST", 600))
+
+INVENTORY = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ansible", "inventory"
+)
+
+_control_dir = None
+
+
+def control_path() -> str:
+    """
+    Return the master socket path of this run, see ``configure``.
+    """
+    return os.path.join(configure(), CONTROL_NAME)
+
+
+def options() -> List[str]:
+    """
+    Return the ssh options that use, or start, the shared master.
+    """
+    return [
+        "-o", "ControlMaster=auto",
+        "-o", "ControlPath={}".format(control_path()),
+        "-o", "ControlPersist={}".format(PERSIST),
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def inventory_hosts(path: str = INVENTORY) -> Dict[str, Dict[str, str]]:
+    """
+    Return the {host: {variable: value}} of the inventory, without groups.
+    The inventory is read once per process.
+    """
+    hosts = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                words = shlex.split(line, comments=True)
+                if not words or words[0].startswith("["):
+                    continue
+                hosts[words[0]] = dict(w.split("=", 1) for w in words[1:] if "=" in w)
+    except OSError:
+        pass
+    return hosts
+
+
+def _target(host: str) -> str:
+    user = inventory_hosts().get(host, {}).get("ansible_user")
+    return "{}@{}".format(user, host) if user else host
+
+
+def ssh_command(host: str, command: Optional[str] = None) -> List[str]:
+    argv = ["ssh"] + options() + ["-o", "BatchMode=yes", _target(host)]
+    if command:
+        argv.append(command)
+    return argv
+
+
+def run(host: str, command: str, timeout: Optional[int] = None) -> subprocess.CompletedProcess:
+    """
+    Run a command on a lab host through its shared connection.
+    """
+    return subprocess.run(
+        ssh_command(host, command), stdin=subprocess.DEVNULL,
+        capture_output=True, text=True, timeout=timeout,
+    )
+
+
+def warm(hosts: List[str], timeout: int = 30) -> Dict[str, bool]:
+    """
+    Open the masters of the hosts concurrently. Returns {host: opened}.
+    """
+    def open_master(host):
+        try:
+            return host, run(host, "true", timeout).returncode == 0
+        except subprocess.TimeoutExpired:
+            return host, False
+
+    configure()
+    with ThreadPoolExecutor(max_workers=max(len(hosts), 1)) as executor:
+        return dict(executor.map(open_master, hosts))
+
+
+def close(hosts: List[str]):
+    """
+    Stop the masters of the hosts.
+    """
+    if _control_dir is None:
+        return
+    for host in hosts:
+        subprocess.run(
+            ["ssh", "-o", "ControlPath={}".format(os.path.join(_control_dir, CONTROL_NAME)),
+             "-O", "exit", _target(host)],
+            stdin=subprocess.DEVNULL, capture_output=True,
+        )
+
+
+def _cleanup(directory: str):
+    if os.listdir(directory):
+        close(sorted(inventory_hosts()))
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def configure() -> str:
+    """
+    Create the socket directory of this run and point Ansible at it.
+    The masters are closed and the directory removed at exit. Calling it
+    again in the same process returns the same directory.
+    """
+    global _control_dir
+    if _control_dir is not None:
+        return _control_dir
+    # Short path: a socket path is limited to about 100 characters
+    _control_dir = tempfile.mkdtemp(prefix="lab-ssh-")
+    atexit.register(_cleanup, _control_dir)
+    os.environ["ANSIBLE_SSH_CONTROL_PATH_DIR"] = _control_dir
+    os.environ["ANSIBLE_SSH_CONTROL_PATH"] = "%(directory)s/" + CONTROL_NAME.replace("%", "%%")
+    os.environ.setdefault("ANSIBLE_SSH_ARGS", "-C -o ControlMaster=auto -o ControlPersist={}s".format(PERSIST))
+    logging.debug("SSH connections shared through {}".format(_control_dir))
+    return _control_dir
@@ -0,0 +1,101 @@
+"""
+Wait for objects with one list and one watch
+
+Polling a few objects with a GET each every few seconds costs one request
+per object and per iteration, and reacts late. ``wait_objects`` lists the
+objects once, then follows them with a single watch stream until they
+reach the expected state. ``wait_deleted`` does the same until they are
+gone.
+"""
+
+import time
+
+from typing import Callable, Dict, List
+
+from kubernetes.client.exceptions import ApiException
+
+
+def wait_objects(oc_client, api_version: str, kind: str, namespace: str, names: List[str],
+                 done: Callable[[Dict], bool], failed: Callable[[Dict], bool],
+                 timeout: int) -> Dict[str, Dict]:
+    """
+    Follow the named objects with one list and one watch until every one
+    is done, one failed, or the deadline is reached.
+    Returns the last seen object of each name.
+    """
+    deadline = time.time() + timeout
+    resource = oc_client.resources.get(api_version=api_version, kind=kind)
+    seen = {}
+
+    def finished():
+        return any(failed(o) for o in seen.values()) or (
+            len(seen) == len(names) and all(done(o) for o in seen.values()))
+
+    resource_version = None
+    while time.time() < deadline:
+        if resource_version is None:
+            seen.clear()
+            listing = resource.get(namespace=namespace)
+            for obj in listing.items:
+                obj = obj.to_dict()
+                if obj["metadata"]["name"] in names:
+                    seen[obj["metadata"]["name"]] = obj
+            resource_version = listing.metadata.resourceVersion
+        if finished():
+            break
+        try:
+            for event in oc_client.watch(resource, namespace=namespace,
+                                         resource_version=resource_version,
+                                         timeout=max(1, int(deadline - time.time()))):
+                obj = event["raw_object"]
+                resource_version = obj["metadata"]["resourceVersion"]
+                if obj["metadata"]["name"] not in names:
+                    continue
+                if event["type"] == "DELETED":
+                    seen.pop(obj["metadata"]["name"], None)
+                else:
+                    seen[obj["metadata"]["name"]] = obj
+                if finished() or time.time() > deadline:
+                    break
+        except ApiException as e:
+            if e.status != 410:
+                raise
+            # The resourceVersion expired, list again
+            resource_version = None
+    return seen
+
+
+def wait_deleted(oc_client, api_version: str, kind: str, namespace: str, names: List[str],
+                 timeout: int) -> List[str]:
+    """
+    Follow the named objects with one list and one watch until they are
+    all gone, or the deadline is reached.
+    Returns the names still present.
+    """
+    deadline = time.time() + timeout
+    resource = oc_client.resources.get(api_version=api_version, kind=kind)
+    remaining = set()
+
+    resource_version = None
+    while time.time() < deadline:
+        if resource_version is None:
+            listing = resource.get(namespace=namespace)
+            remaining = {obj.metadata.name for obj in listing.items} & set(names)
+            resource_version = listing.metadata.resourceVersion
+        if not remaining:
+            break
+        try:
+            for event in oc_client.watch(resource, namespace=namespace,
+                                         resource_version=resource_version,
+                                         timeout=max(1, int(deadline - time.time()))):
+                obj = event["raw_object"]
+                resource_version = obj["metadata"]["resourceVersion"]
+                if event["type"] == "DELETED":
+                    remaining.discard(obj["metadata"]["name"])
+                if not remaining or time.time() > deadline:
+                    break
+        except ApiException as e:
+            if e.status != 410:
+                raise
+            resource_version = None
+    return sorted(remaining)
@@ -17,18 +17,17 @@ This module either does start, grade, or finish for the review-cr1 lab.
 
 import sys
 import logging
-import requests
 
 from urllib3 import disable_warnings
 from urllib3.exceptions import InsecureRequestWarning
-from kubernetes.client.exceptions import ApiException
 
-from ocp.utils import OpenShift
 from labs import labconfig
 from labs.common import labtools, userinterface
 
 # Import all the functions defined in the common.py module
 from do316 import common
+from .labkit import catalog, health, leftovers, nodes, prefetch, readiness
+from .labkit.openshift import OpenShift
 
 
 # Course SKU
@@ -44,6 +43,16 @@ NAMESPACE = "review-cr1"
 # List of operators used in the course
 OPERATORS = common.OPERATORS
 
+# Operator packages the catalog must offer, with the source and channel
+# the operators subscribe from
+PACKAGES = [
+    catalog.subscription(OPERATORS["virt"], "kubevirt-hyperconverged"),
+    catalog.subscription(OPERATORS["nmstate"], "kubernetes-nmstate-operator"),
+]
+
+# Catalog sources the lab depends on
+CATALOG_SOURCES = catalog.sources_of(PACKAGES)
+
 # Disable certificate validation
 disable_warnings(InsecureRequestWarning)
 
@@ -55,6 +64,12 @@ class ReviewCR1(OpenShift):
 
     __LAB__ = NAMESPACE
 
+    # Cluster-scoped objects read by several steps, served from a local cache
+    __INFORMERS__ = [
+        ("v1", "Node"),
+        ("nmstate.io/v1", "NodeNetworkConfigurationPolicy"),
+    ]
+
     # Get the OCP parameters from the common class
     OCP_API = common.OCP_API
 
@@ -63,20 +78,9 @@ class ReviewCR1(OpenShift):
         logging.debug("{} / {}".format(SKU, sys._getframe().f_code.co_name))
         try:
             super().__init__()
-        except requests.exceptions.ConnectionError:
-            msg = (
-                "The Lab environment is not ready, "
-                "please wait 10 minutes before trying again."
-            )
-            print(str(msg))
-            sys.exit(3)
-        except ApiException:
-            msg = (
-                "The OpenShift cluster is not ready, "
-                "please wait 5 minutes before trying again."
-            )
-            print(str(msg))
-            sys.exit(2)
+        except readiness.ClusterNotReady as e:
+            print(str(e))
+            sys.exit(e.exit_code)
         except Exception as e:
             msg = "An unknown error ocurred."
             print(str(msg))
@@ -89,6 +93,13 @@ class ReviewCR1(OpenShift):
         Prepare the system for starting the lab
         """
         logging.debug("{} / {}".format(SKU, sys._getframe().f_code.co_name))
+        self.run_start(self.start_items())
+
+    def start_items(self):
+        """
+        Return the steps of the 'start' verb. The steps marked with
+        'prefetch' can run in the background before the lab starts.
+        """
         items = []
         items.append(
             {
@@ -115,16 +126,18 @@ class ReviewCR1(OpenShift):
         items.append(
             {
                 "label": "Checking cluster readiness",
-                "task": common.start_check_cluster_ready,
+                "task": health.check_cluster_ready,
                 "oc_client": self.oc_client,
+                "catalog_sources": CATALOG_SOURCES,
                 "fatal": True,
             }
         )
         items.append(
             {
                 "label": "Checking CatalogSource",
-                "task": self.run_playbook,
-                "playbook": "ansible/playbooks/check-catalog-source.yaml",
+                "task": catalog.check_catalog,
+                "oc_client": self.oc_client,
+                "packages": PACKAGES,
                 "fatal": True,
             }
         )
@@ -147,6 +160,7 @@ class ReviewCR1(OpenShift):
                 "label": "Install the 'OpenShift Virtualization' operator",
                 "task": common.openshift_virt,
                 "oc_client": self.oc_client,
+                "prefetch": True,
                 "fatal": True,
             }
         )
@@ -155,6 +169,7 @@ class ReviewCR1(OpenShift):
                 "label": "Install the 'NMstate' operator",
                 "task": common.nmstate_operator,
                 "oc_client": self.oc_client,
+                "prefetch": True,
                 "fatal": True,
             }
         )
@@ -163,6 +178,7 @@ class ReviewCR1(OpenShift):
                 "label": "Confirming virtctl availability",
                 "task": self.run_playbook,
                 "playbook": "ansible/playbooks/deploy-virtctl.yml",
+                "prefetch": True,
                 "fatal": True,
             }
         )
@@ -171,6 +187,7 @@ class ReviewCR1(OpenShift):
                 "label": "Confirming virtctl availability",
                 "task": self.run_playbook,
                 "playbook": "ansible/playbooks/deploy-virtctl.yml",
+                "prefetch": True,
                 "fatal": True,
             }
         )
@@ -199,6 +216,20 @@ class ReviewCR1(OpenShift):
                 "fatal": True,
             }
         )
+        items.append(
+            {
+                "label": "Recording the cluster state",
+                "task": leftovers.record_baseline,
+                "oc_client": self.oc_client,
+                "lab": self.__LAB__,
+                "label_keys": ["orgnet"],
+                "owned": {
+                    "Namespace": [NAMESPACE],
+                    "NodeNetworkConfigurationPolicy": ["br0"],
+                },
+                "fatal": False,
+            }
+        )
         items.append(
             {
                 "label": f"Creating the '{NAMESPACE}' project",
@@ -215,13 +246,23 @@ class ReviewCR1(OpenShift):
                 "fatal": True,
             }
         )
-        userinterface.Console(items).run_items(action="Starting")
+        return items
 
     def grade(self):
         """
         Perform evaluation steps on the system
         """
         logging.debug("{} / {}".format(SKU, sys._getframe().f_code.co_name))
+        prefetch.spawn(self.__LAB__)
+        ui = userinterface.Console(self.grade_items())
+        ui.run_items(action="Grading")
+        ui.report_grade()
+
+    def grade_items(self, namespace=NAMESPACE):
+        """
+        Return the evaluation steps for the given namespace.
+        The classroom grading service calls this for every student namespace.
+        """
         items = []
         items.append(
             {
@@ -235,8 +276,9 @@ class ReviewCR1(OpenShift):
         items.append(
             {
                 "label": "Checking cluster readiness",
-                "task": common.start_check_cluster_ready,
+                "task": health.check_cluster_ready,
                 "oc_client": self.oc_client,
+                "catalog_sources": CATALOG_SOURCES,
                 "fatal": True,
                 "grading": True,
             }
@@ -244,8 +286,9 @@ class ReviewCR1(OpenShift):
         items.append(
             {
                 "label": "Checking CatalogSource",
-                "task": self.run_playbook,
-                "playbook": "ansible/playbooks/check-catalog-source.yaml",
+                "task": catalog.check_catalog,
+                "oc_client": self.oc_client,
+                "packages": PACKAGES,
                 "fatal": True,
                 "grading": True,
             }
@@ -267,7 +310,7 @@ class ReviewCR1(OpenShift):
             items.append(
                 {
                     "label": f"The '{node}' node has the 'orgnet=true' label",
-                    "task": common.grade_node_label,
+                    "task": nodes.grade_node_label,
                     "oc_client": self.oc_client,
                     "name": node,
                     "label_key": "orgnet",
@@ -294,7 +337,7 @@ class ReviewCR1(OpenShift):
                 "label": "The 'ext-net' network attachment resource exists",
                 "task": common.grade_attachment,
                 "oc_client": self.oc_client,
-                "namespace": NAMESPACE,
+                "namespace": namespace,
                 "name": "ext-net",
                 "bridge": "br0",
                 "fatal": False,
@@ -306,7 +349,7 @@ class ReviewCR1(OpenShift):
                 "label": "The 'web1' VM is running",
                 "task": common.grade_vm_running,
                 "oc_client": self.oc_client,
-                "namespace": NAMESPACE,
+                "namespace": namespace,
                 "name": "web1",
                 "fatal": False,
                 "grading": True,
@@ -317,7 +360,7 @@ class ReviewCR1(OpenShift):
                 "label": "The 'web1' VM was created from the 'RHEL8' template",
                 "task": common.grade_vm_template,
                 "oc_client": self.oc_client,
-                "namespace": NAMESPACE,
+                "namespace": namespace,
                 "name": "web1",
                 "template": "rhel8-server-small",
                 "fatal": False,
@@ -329,7 +372,7 @@ class ReviewCR1(OpenShift):
                 "label": "The 'web1' VM has a 'nic-0' network interface",
                 "task": common.grade_vm_nic,
                 "oc_client": self.oc_client,
-                "namespace": NAMESPACE,
+                "namespace": namespace,
                 "name": "web1",
                 "nic": "nic-0",
                 "attachment": "ext-net",
@@ -337,9 +380,7 @@ class ReviewCR1(OpenShift):
                 "grading": True,
             }
         )
-        ui = userinterface.Console(items)
-        ui.run_items(action="Grading")
-        ui.report_grade()
+        return items
 
     def finish(self):
         """
@@ -358,16 +399,18 @@ class ReviewCR1(OpenShift):
         items.append(
             {
                 "label": "Checking cluster readiness",
-                "task": common.start_check_cluster_ready,
+                "task": health.check_cluster_ready,
                 "oc_client": self.oc_client,
+                "catalog_sources": CATALOG_SOURCES,
                 "fatal": True,
             }
         )
         items.append(
             {
                 "label": "Checking CatalogSource",
-                "task": self.run_playbook,
-                "playbook": "ansible/playbooks/check-catalog-source.yaml",
+                "task": catalog.check_catalog,
+                "oc_client": self.oc_client,
+                "packages": PACKAGES,
                 "fatal": True,
             }
         )
@@ -396,4 +439,14 @@ class ReviewCR1(OpenShift):
                 "fatal": True,
             }
         )
+        items.append(
+            {
+                "label": "Checking for resources left behind",
+                "task": leftovers.check_leftovers,
+                "oc_client": self.oc_client,
+                "lab": self.__LAB__,
+                "fatal": False,
+            }
+        )
         userinterface.Console(items).run_items(action="Finishing")
+        prefetch.spawn(self.__LAB__)
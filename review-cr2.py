@@ -17,18 +17,17 @@ This module either does start, grade, or finish for the review-cr2 lab.
 
 import sys
 import logging
-import requests
 
 from urllib3 import disable_warnings
 from urllib3.exceptions import InsecureRequestWarning
-from kubernetes.client.exceptions import ApiException
 
-from ocp.utils import OpenShift
 from labs import labconfig
 from labs.common import labtools, userinterface
 
 # Import all the functions defined in the common.py module
 from do316 import common
+from .labkit import catalog, health, leftovers, prefetch, readiness
+from .labkit.openshift import OpenShift
 
 
 # Course SKU
@@ -44,6 +43,13 @@ NAMESPACE = "review-cr2"
 # List of operators used in the course
 OPERATORS = common.OPERATORS
 
+# Operator packages the catalog must offer, with the source and channel
+# the operators subscribe from
+PACKAGES = [catalog.subscription(OPERATORS["virt"], "kubevirt-hyperconverged")]
+
+# Catalog sources the lab depends on
+CATALOG_SOURCES = catalog.sources_of(PACKAGES)
+
 # Disable certificate validation
 disable_warnings(InsecureRequestWarning)
 
@@ -63,20 +69,9 @@ class ReviewCR2(OpenShift):
         logging.debug("{} / {}".format(SKU, sys._getframe().f_code.co_name))
         try:
             super().__init__()
-        except requests.exceptions.ConnectionError:
-            msg = (
-                "The Lab environment is not ready, "
-                "please wait 10 minutes before trying again."
-            )
-            print(str(msg))
-            sys.exit(3)
-        except ApiException:
-            msg = (
-                "The OpenShift cluster is not ready, "
-                "please wait 5 minutes before trying again."
-            )
-            print(str(msg))
-            sys.exit(2)
+        except readiness.ClusterNotReady as e:
+            print(str(e))
+            sys.exit(e.exit_code)
         except Exception as e:
             msg = "An unknown error ocurred."
             print(str(msg))
@@ -89,6 +84,13 @@ class ReviewCR2(OpenShift):
         Prepare the system for starting the lab
         """
         logging.debug("{} / {}".format(SKU, sys._getframe().f_code.co_name))
+        self.run_start(self.start_items())
+
+    def start_items(self):
+        """
+        Return the steps of the 'start' verb. The steps marked with
+        'prefetch' can run in the background before the lab starts.
+        """
         items = []
         items.append(
             {
@@ -115,16 +117,18 @@ class ReviewCR2(OpenShift):
         items.append(
             {
                 "label": "Checking cluster readiness",
-                "task": common.start_check_cluster_ready,
+                "task": health.check_cluster_ready,
                 "oc_client": self.oc_client,
+                "catalog_sources": CATALOG_SOURCES,
                 "fatal": True,
             }
         )
         items.append(
             {
                 "label": "Checking CatalogSource",
-                "task": self.run_playbook,
-                "playbook": "ansible/playbooks/check-catalog-source.yaml",
+                "task": catalog.check_catalog,
+                "oc_client": self.oc_client,
+                "packages": PACKAGES,
                 "fatal": True,
             }
         )
@@ -133,6 +137,7 @@ class ReviewCR2(OpenShift):
                 "label": "Install the 'OpenShift Virtualization' operator",
                 "task": common.openshift_virt,
                 "oc_client": self.oc_client,
+                "prefetch": True,
                 "fatal": True,
             }
         )
@@ -142,6 +147,7 @@ class ReviewCR2(OpenShift):
                 "label": "Install the 'Node Maintenance' operator",
                 "task": common.node_maintenance,
                 "oc_client": self.oc_client,
+                "prefetch": True,
                 "fatal": True,
             }
         )
@@ -150,6 +156,7 @@ class ReviewCR2(OpenShift):
                 "label": "Confirming virtctl availability",
                 "task": self.run_playbook,
                 "playbook": "ansible/playbooks/deploy-virtctl.yml",
+                "prefetch": True,
                 "fatal": True,
             }
         )
@@ -162,6 +169,16 @@ class ReviewCR2(OpenShift):
                 "fatal": True,
             }
         )
+        items.append(
+            {
+                "label": "Recording the cluster state",
+                "task": leftovers.record_baseline,
+                "oc_client": self.oc_client,
+                "lab": self.__LAB__,
+                "owned": {"Namespace": [NAMESPACE]},
+                "fatal": False,
+            }
+        )
         items.append(
             {
                 "label": f"Creating the '{NAMESPACE}' project",
@@ -178,13 +195,14 @@ class ReviewCR2(OpenShift):
                 "fatal": True,
             }
         )
-        userinterface.Console(items).run_items(action="Starting")
+        return items
 
     def grade(self):
         """
         Perform evaluation steps on the system
         """
         logging.debug("{} / {}".format(SKU, sys._getframe().f_code.co_name))
+        prefetch.spawn(self.__LAB__)
         items = []
         items.append(
             {
@@ -198,8 +216,9 @@ class ReviewCR2(OpenShift):
         items.append(
             {
                 "label": "Checking cluster readiness",
-                "task": common.start_check_cluster_ready,
+                "task": health.check_cluster_ready,
                 "oc_client": self.oc_client,
+                "catalog_sources": CATALOG_SOURCES,
                 "fatal": True,
                 "grading": True,
             }
@@ -207,8 +226,9 @@ class ReviewCR2(OpenShift):
         items.append(
             {
                 "label": "Checking CatalogSource",
-                "task": self.run_playbook,
-                "playbook": "ansible/playbooks/check-catalog-source.yaml",
+                "task": catalog.check_catalog,
+                "oc_client": self.oc_client,
+                "packages": PACKAGES,
                 "fatal": True,
                 "grading": True,
             }
@@ -315,16 +335,18 @@ class ReviewCR2(OpenShift):
         items.append(
             {
                 "label": "Checking cluster readiness",
-                "task": common.start_check_cluster_ready,
+                "task": health.check_cluster_ready,
                 "oc_client": self.oc_client,
+                "catalog_sources": CATALOG_SOURCES,
                 "fatal": True,
             }
         )
         items.append(
             {
                 "label": "Checking CatalogSource",
-                "task": self.run_playbook,
-                "playbook": "ansible/playbooks/check-catalog-source.yaml",
+                "task": catalog.check_catalog,
+                "oc_client": self.oc_client,
+                "packages": PACKAGES,
                 "fatal": True,
             }
         )
@@ -364,4 +386,14 @@ class ReviewCR2(OpenShift):
                 "fatal": True,
             }
         )
+        items.append(
+            {
+                "label": "Checking for resources left behind",
+                "task": leftovers.check_leftovers,
+                "oc_client": self.oc_client,
+                "lab": self.__LAB__,
+                "fatal": False,
+            }
+        )
         userinterface.Console(items).run_items(action="Finishing")
+        prefetch.spawn(self.__LAB__)
@@ -17,18 +17,17 @@ This module either does start, grade, or finish for the review-cr3 lab.
 
 import sys
 import logging
-import requests
 
 from urllib3 import disable_warnings
 from urllib3.exceptions import InsecureRequestWarning
-from kubernetes.client.exceptions import ApiException
 
-from ocp.utils import OpenShift
 from labs import labconfig
 from labs.common import labtools, userinterface
 
 # Import all the functions defined in the common.py module
 from do316 import common
+from .labkit.openshift import OpenShift
+from .labkit import catalog, golden, health, imagestore, leftovers, prefetch, readiness
 
 
 # Course SKU
@@ -44,6 +43,25 @@ NAMESPACE = "review-cr3"
 # List of operators used in the course
 OPERATORS = common.OPERATORS
 
+# Operator packages the catalog must offer, with the source and channel
+# the operators subscribe from
+PACKAGES = [catalog.subscription(OPERATORS["virt"], "kubevirt-hyperconverged")]
+
+# Catalog sources the lab depends on
+CATALOG_SOURCES = catalog.sources_of(PACKAGES)
+
+# Image server on the 'utility' machine
+IMAGES_URL = "http://utility.lab.example.com:8080"
+
+# DataVolumes that start_data_volumes.yml creates for the web VMs of the
+# students, and the name prefix of the image they import. Keep them in
+# sync with the playbook, golden mode must create the same volumes.
+DATA_VOLUMES = ["web1-documentroot", "web2-documentroot"]
+DATA_VOLUME_IMAGE = "documentroot"
+
+# In golden mode, the DataVolumes are cloned from a snapshot of this disk
+GOLDEN_DISK = f"{NAMESPACE}-{DATA_VOLUME_IMAGE}"
+
 # Disable certificate validation
 disable_warnings(InsecureRequestWarning)
 
@@ -63,20 +81,9 @@ class ReviewCR3(OpenShift):
         logging.debug("{} / {}".format(SKU, sys._getframe().f_code.co_name))
         try:
             super().__init__()
-        except requests.exceptions.ConnectionError:
-            msg = (
-                "The Lab environment is not ready, "
-                "please wait 10 minutes before trying again."
-            )
-            print(str(msg))
-            sys.exit(3)
-        except ApiException:
-            msg = (
-                "The OpenShift cluster is not ready, "
-                "please wait 5 minutes before trying again."
-            )
-            print(str(msg))
-            sys.exit(2)
+        except readiness.ClusterNotReady as e:
+            print(str(e))
+            sys.exit(e.exit_code)
         except Exception as e:
             msg = "An unknown error ocurred."
             print(str(msg))
@@ -89,6 +96,13 @@ class ReviewCR3(OpenShift):
         Prepare the system for starting the lab
         """
         logging.debug("{} / {}".format(SKU, sys._getframe().f_code.co_name))
+        self.run_start(self.start_items())
+
+    def start_items(self):
+        """
+        Return the steps of the 'start' verb. The steps marked with
+        'prefetch' can run in the background before the lab starts.
+        """
         items = []
         items.append(
             {
@@ -115,16 +129,18 @@ class ReviewCR3(OpenShift):
         items.append(
             {
                 "label": "Checking cluster readiness",
-                "task": common.start_check_cluster_ready,
+                "task": health.check_cluster_ready,
                 "oc_client": self.oc_client,
+                "catalog_sources": CATALOG_SOURCES,
                 "fatal": True,
             }
         )
         items.append(
             {
                 "label": "Checking CatalogSource",
-                "task": self.run_playbook,
-                "playbook": "ansible/playbooks/check-catalog-source.yaml",
+                "task": catalog.check_catalog,
+                "oc_client": self.oc_client,
+                "packages": PACKAGES,
                 "fatal": True,
             }
         )
@@ -133,6 +149,7 @@ class ReviewCR3(OpenShift):
                 "label": "Install the 'OpenShift Virtualization' operator",
                 "task": common.openshift_virt,
                 "oc_client": self.oc_client,
+                "prefetch": True,
                 "fatal": True,
             }
         )
@@ -141,6 +158,7 @@ class ReviewCR3(OpenShift):
                 "label": "Confirming virtctl availability",
                 "task": self.run_playbook,
                 "playbook": "ansible/playbooks/deploy-virtctl.yml",
+                "prefetch": True,
                 "fatal": True,
             }
         )
@@ -155,20 +173,53 @@ class ReviewCR3(OpenShift):
         )
         items.append(
             {
-                "label": "Preparing the disk images on the 'utility' machine",
-                "task": self.run_playbook,
-                "playbook": f"ansible/{self.__LAB__}/start_image.yml",
-                "fatal": True,
+                "label": "Recording the cluster state",
+                "task": leftovers.record_baseline,
+                "oc_client": self.oc_client,
+                "lab": self.__LAB__,
+                "owned": {"Namespace": [NAMESPACE]},
+                "fatal": False,
             }
         )
         items.append(
             {
-                "label": "Creating the data volumes",
-                "task": self.run_playbook,
-                "playbook": f"ansible/{self.__LAB__}/start_data_volumes.yml",
+                "label": "Preparing the disk images on the 'utility' machine",
+                "task": self._stage_images,
+                "playbook": f"ansible/{self.__LAB__}/start_image.yml",
+                "prefetch": True,
                 "fatal": True,
             }
         )
+        if golden.ENABLED:
+            items.append(
+                {
+                    "label": "Preparing the golden disk snapshot",
+                    "task": self._prepare_golden,
+                    "prefetch": True,
+                    "fatal": True,
+                }
+            )
+            items.append(
+                {
+                    "label": "Cloning the data volumes from the golden disk",
+                    "task": self._clone_data_volumes,
+                    "oc_client": self.oc_client,
+                    "namespace": NAMESPACE,
+                    "disks": DATA_VOLUMES,
+                    "golden": GOLDEN_DISK,
+                    "playbook": f"ansible/{self.__LAB__}/start_data_volumes.yml",
+                    "fatal": True,
+                }
+            )
+        else:
+            items.append(
+                {
+                    "label": "Creating the data volumes",
+                    "task": self.run_playbook,
+                    "playbook": f"ansible/{self.__LAB__}/start_data_volumes.yml",
+                    "fatal": True,
+                }
+            )
         items.append(
             {
                 "label": "Creating the 'golden-web' virtual machine",
@@ -185,13 +236,14 @@ class ReviewCR3(OpenShift):
                 "fatal": True,
             }
         )
-        userinterface.Console(items).run_items(action="Starting")
+        return items
 
     def grade(self):
         """
         Perform evaluation steps on the system
         """
         logging.debug("{} / {}".format(SKU, sys._getframe().f_code.co_name))
+        prefetch.spawn(self.__LAB__)
         items = []
         items.append(
             {
@@ -205,8 +257,9 @@ class ReviewCR3(OpenShift):
         items.append(
             {
                 "label": "Checking cluster readiness",
-                "task": common.start_check_cluster_ready,
+                "task": health.check_cluster_ready,
                 "oc_client": self.oc_client,
+                "catalog_sources": CATALOG_SOURCES,
                 "fatal": True,
                 "grading": True,
             }
@@ -214,8 +267,9 @@ class ReviewCR3(OpenShift):
         items.append(
             {
                 "label": "Checking CatalogSource",
-                "task": self.run_playbook,
-                "playbook": "ansible/playbooks/check-catalog-source.yaml",
+                "task": catalog.check_catalog,
+                "oc_client": self.oc_client,
+                "packages": PACKAGES,
                 "fatal": True,
                 "grading": True,
             }
@@ -343,16 +397,18 @@ class ReviewCR3(OpenShift):
         items.append(
             {
                 "label": "Checking cluster readiness",
-                "task": common.start_check_cluster_ready,
+                "task": health.check_cluster_ready,
                 "oc_client": self.oc_client,
+                "catalog_sources": CATALOG_SOURCES,
                 "fatal": True,
             }
         )
         items.append(
             {
                 "label": "Checking CatalogSource",
-                "task": self.run_playbook,
-                "playbook": "ansible/playbooks/check-catalog-source.yaml",
+                "task": catalog.check_catalog,
+                "oc_client": self.oc_client,
+                "packages": PACKAGES,
                 "fatal": True,
             }
         )
@@ -365,6 +421,9 @@ class ReviewCR3(OpenShift):
                 "fatal": True,
             }
         )
+        # NOTE: The images stay on 'utility' only once start_image.yml
+        # publishes them with 'imagestore add --lab' and the image store
+        # serves them. Until then, remove them like before.
         items.append(
             {
                 "label": "Removing the disk images from the 'utility' machine",
@@ -381,4 +440,69 @@ class ReviewCR3(OpenShift):
                 "fatal": True,
             }
         )
+        items.append(
+            {
+                "label": "Checking for resources left behind",
+                "task": leftovers.check_leftovers,
+                "oc_client": self.oc_client,
+                "lab": self.__LAB__,
+                "fatal": False,
+            }
+        )
         userinterface.Console(items).run_items(action="Finishing")
+        prefetch.spawn(self.__LAB__)
+
+    def _stage_images(self, item):
+        """
+        Run the image staging playbook only when the image store on
+        'utility' does not already publish the images of the lab.
+        Without a published manifest, the playbook always runs.
+        """
+        if imagestore.images_current(IMAGES_URL, self.__LAB__):
+            logging.debug("Disk images for {} are already staged".format(self.__LAB__))
+            item["failed"] = False
+            return item
+        return self.run_playbook(item)
+
+    def _golden_image(self):
+        """
+        Return the (name, digest) of the image of the data volumes in the
+        image manifest of the lab, or None when it is not published.
+        """
+        manifest = imagestore.published_manifest(IMAGES_URL, self.__LAB__)
+        image = next(
+            (name for name in sorted(manifest)
+             if name.rsplit("/", 1)[-1].startswith(DATA_VOLUME_IMAGE)),
+            None,
+        )
+        return None if image is None else (image, manifest[image])
+
+    def _prepare_golden(self, item):
+        """
+        Make sure the golden snapshot was taken from the published image of
+        the data volumes. Without a published image, there is nothing to
+        prepare and the data volumes are created by the playbook.
+        """
+        image = self._golden_image()
+        if image is None:
+            logging.info(f"The image server does not publish the '{DATA_VOLUME_IMAGE}' image, "
+                         "the data volumes are not cloned")
+            item["failed"] = False
+            return item
+        item.update(
+            oc_client=self.oc_client,
+            name=GOLDEN_DISK,
+            url=f"{IMAGES_URL}/{image[0]}",
+            digest=image[1],
+        )
+        return golden.prepare_golden_snapshot(item)
+
+    def _clone_data_volumes(self, item):
+        """
+        Clone the data volumes from the golden disk, or run
+        start_data_volumes.yml when the image server does not publish
+        their image.
+        """
+        if self._golden_image() is None:
+            return self.run_playbook(item)
+        return golden.clone_golden_disks(item)
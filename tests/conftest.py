@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubapi import StubAPI  # noqa: E402
+
+
+@pytest.fixture
+def api():
+    stub = StubAPI()
+    for i in range(1, 4):
+        stub.add("nodes", "worker0{}".format(i), labels={"orgnet": "true" if i < 3 else "false"})
+    stub.url = stub.start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def oc_client(api):
+    from kubernetes import client
+    from kubernetes.dynamic import DynamicClient
+
+    configuration = client.Configuration()
+    configuration.host = api.url
+    return DynamicClient(client.ApiClient(configuration))
+
+
+def eventually(check, timeout: float = 5):
+    """
+    Retry ``check`` until it returns a true value or the timeout expires.
+    """
+    deadline = time.time() + timeout
+    while True:
+        result = check()
+        if result or time.time() > deadline:
+            return result
+        time.sleep(0.05)
@@ -0,0 +1,217 @@
+"""
+Minimal Kubernetes API server for the tests
+
+Serves the discovery endpoints and the v1 Nodes and ConfigMaps: get, list
+with an equality label selector, and watch. Every change gets the next
+resourceVersion and is queued as a watch event. ``compact()`` drops the
+queued events, so a watch from an older resourceVersion gets the 410
+ERROR event the API server sends once etcd compacted them.
+"""
+
+import json
+import time
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+
+# Seconds a watch request stays open, much shorter than the real server
+WATCH_SECONDS = 0.5
+
+RESOURCES = {
+    "nodes": {"kind": "Node", "namespaced": False},
+    "configmaps": {"kind": "ConfigMap", "namespaced": True},
+}
+
+
+def _status(code: int, reason: str, message: str) -> dict:
+    return {"kind": "Status", "apiVersion": "v1", "metadata": {}, "status": "Failure",
+            "reason": reason, "message": message, "code": code}
+
+
+def _matches(obj: dict, selector: str) -> bool:
+    labels = obj["metadata"].get("labels") or {}
+    for term in filter(None, (selector or "").split(",")):
+        key, _, value = term.partition("=")
+        if labels.get(key) != value:
+            return False
+    return True
+
+
+class StubAPI:
+    """
+    The state of the stub server: its objects, the watch events and the
+    requests it received.
+    """
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.version = 0
+        self.compacted = 0
+        self.objects = {plural: {} for plural in RESOURCES}
+        self.events = []
+        self.requests = []
+        self._server = None
+
+    # Changes
+
+    def _store(self, plural: str, kind: str, obj: dict, event: bool):
+        with self.lock:
+            self.version += 1
+            obj["metadata"]["resourceVersion"] = str(self.version)
+            key = (obj["metadata"].get("namespace") or "", obj["metadata"]["name"])
+            if kind == "DELETED":
+                self.objects[plural].pop(key, None)
+            else:
+                self.objects[plural][key] = obj
+            if event:
+                self.events.append((self.version, plural, kind, json.loads(json.dumps(obj))))
+            self.lock.notify_all()
+
+    def add(self, plural: str, name: str, namespace: str = None, labels: dict = None,
+            data: dict = None, event: bool = True) -> dict:
+        info = RESOURCES[plural]
+        obj = {"apiVersion": "v1", "kind": info["kind"],
+               "metadata": {"name": name, "labels": dict(labels or {})}}
+        if namespace:
+            obj["metadata"]["namespace"] = namespace
+        if data is not None:
+            obj["data"] = data
+        key = (namespace or "", name)
+        self._store(plural, "MODIFIED" if key in self.objects[plural] else "ADDED", obj, event)
+        return obj
+
+    def label(self, plural: str, name: str, namespace: str = None, event: bool = True, **labels):
+        with self.lock:
+            obj = json.loads(json.dumps(self.objects[plural][(namespace or "", name)]))
+        obj["metadata"]["labels"].update(labels)
+        self._store(plural, "MODIFIED", obj, event)
+
+    def delete(self, plural: str, name: str, namespace: str = None, event: bool = True):
+        with self.lock:
+            obj = self.objects[plural][(namespace or "", name)]
+        self._store(plural, "DELETED", obj, event)
+
+    def compact(self):
+        """
+        Forget the events up to now, as etcd does when it compacts.
+        """
+        with self.lock:
+            self.events = []
+            self.compacted = self.version
+
+    def count(self, path: str, watch: bool = False) -> int:
+        with self.lock:
+            return sum(1 for p, q in self.requests if p == path and bool(q.get("watch")) == watch)
+
+    # Server
+
+    def start(self) -> str:
+        handler = type("Handler", (_Handler,), {"api": self})
+        self._server = _Server(("127.0.0.1", 0), handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return "http://127.0.0.1:{}".format(self._server.server_address[1])
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    api: StubAPI = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, event: dict):
+        data = (json.dumps(event) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        with self.api.lock:
+            self.api.requests.append((url.path, query))
+        if url.path == "/version":
+            return self._reply(200, {"major": "1", "minor": "29", "gitVersion": "v1.29.0"})
+        if url.path == "/api":
+            return self._reply(200, {"kind": "APIVersions", "versions": ["v1"]})
+        if url.path == "/apis":
+            return self._reply(200, {"kind": "APIGroupList", "apiVersion": "v1", "groups": []})
+        if url.path == "/api/v1":
+            return self._reply(200, {
+                "kind": "APIResourceList", "groupVersion": "v1",
+                "resources": [
+                    {"name": plural, "singularName": info["kind"].lower(),
+                     "namespaced": info["namespaced"], "kind": info["kind"],
+                     "verbs": ["get", "list", "watch"]}
+                    for plural, info in RESOURCES.items()
+                ],
+            })
+        parts = url.path.strip("/").split("/")[2:]
+        namespace = None
+        if len(parts) >= 3 and parts[0] == "namespaces":
+            namespace, parts = parts[1], parts[2:]
+        if not parts or parts[0] not in RESOURCES:
+            return self._reply(404, _status(404, "NotFound", url.path))
+        plural = parts[0]
+        if len(parts) == 2:
+            with self.api.lock:
+                obj = self.api.objects[plural].get((namespace or "", parts[1]))
+            if obj is None:
+                return self._reply(404, _status(404, "NotFound", "{} not found".format(parts[1])))
+            return self._reply(200, obj)
+        selector = query.get("labelSelector", [None])[0]
+        if query.get("watch", ["false"])[0] in ("true", "1"):
+            return self._watch(plural, namespace, selector, int(query.get("resourceVersion", ["0"])[0] or 0))
+        with self.api.lock:
+            items = [
+                obj for key, obj in sorted(self.api.objects[plural].items())
+                if (namespace is None or key[0] == namespace) and _matches(obj, selector)
+            ]
+            version = str(self.api.version)
+        return self._reply(200, {"kind": RESOURCES[plural]["kind"] + "List", "apiVersion": "v1",
+                                 "metadata": {"resourceVersion": version}, "items": items})
+
+    def _watch(self, plural: str, namespace: str, selector: str, version: int):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        deadline = time.time() + WATCH_SECONDS
+        with self.api.lock:
+            if version < self.api.compacted:
+                self._chunk({"type": "ERROR", "object": _status(410, "Expired", "too old resource version")})
+                self.wfile.write(b"0\r\n\r\n")
+                return
+        while time.time() < deadline:
+            with self.api.lock:
+                pending = [
+                    (rv, kind, obj) for rv, p, kind, obj in self.api.events
+                    if p == plural and rv > version
+                    and (namespace is None or obj["metadata"].get("namespace") == namespace)
+                    and _matches(obj, selector)
+                ]
+                if not pending:
+                    self.api.lock.wait(max(deadline - time.time(), 0))
+                    continue
+            for rv, kind, obj in pending:
+                self._chunk({"type": kind, "object": obj})
+                version = rv
+        self.wfile.write(b"0\r\n\r\n")
@@ -0,0 +1,58 @@
+import pytest
+
+from labkit import catalog
+
+
+SOURCES = {
+    "redhat-operators": {"state": "READY", "image": "registry/redhat", "digest": "sha256:1"},
+    "community-operators": {"state": "TRANSIENT_FAILURE", "image": "registry/community", "digest": None},
+}
+
+PACKAGES = {
+    "kubevirt-hyperconverged": {
+        "redhat-operators": {"default": "stable", "channels": {"stable": "kubevirt-hyperconverged.v4.16.0"}},
+    },
+}
+
+
+@pytest.fixture
+def cluster(monkeypatch, tmp_path):
+    calls = {"packages": 0}
+
+    def list_packages(oc_client, namespace):
+        calls["packages"] += 1
+        return PACKAGES
+
+    monkeypatch.setattr(catalog, "CACHE_FILE", str(tmp_path / "catalog.json"))
+    monkeypatch.setattr(catalog, "_index", None)
+    monkeypatch.setattr(catalog, "list_sources", lambda oc_client, namespace: SOURCES)
+    monkeypatch.setattr(catalog, "list_packages", list_packages)
+    return calls
+
+
+def test_ready_judges_the_named_sources():
+    index = catalog.CatalogIndex("key", SOURCES, PACKAGES)
+    assert not index.ready()
+    assert index.ready(["redhat-operators"])
+    assert not index.ready(["community-operators"])
+    assert not index.ready(["missing-operators"])
+
+
+def test_index_is_kept_when_the_lab_sources_are_ready(cluster):
+    catalog.load(None, sources=["redhat-operators"])
+    catalog.load(None, sources=["redhat-operators"])
+    assert cluster["packages"] == 1
+
+
+def test_index_is_read_again_while_a_judged_source_is_not_ready(cluster):
+    catalog.load(None)
+    catalog.load(None)
+    assert cluster["packages"] == 2
+
+
+def test_check_catalog_judges_the_sources_of_its_subscriptions(cluster):
+    package = catalog.Subscription("kubevirt-hyperconverged", "stable", "redhat-operators")
+    for _ in range(2):
+        item = catalog.check_catalog({"oc_client": None, "packages": [package], "timeout": 1})
+        assert not item["failed"]
+    assert cluster["packages"] == 1
@@ -0,0 +1,115 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import eventually
+from labkit import gradeserver, nodes
+
+
+def check_configmap(item):
+    configmaps = item["oc_client"].resources.get(api_version="v1", kind="ConfigMap")
+    try:
+        configmaps.get(name=item["name"], namespace=item["namespace"])
+        item["failed"] = False
+    except Exception:
+        item["failed"] = True
+        item["msgs"] = [{"text": "The '{}' ConfigMap does not exist".format(item["name"])}]
+    return item
+
+
+@pytest.fixture
+def service(api, oc_client, monkeypatch):
+    class FakeLab:
+        __LAB__ = "fake-lab"
+
+        def __init__(self):
+            self.oc_client = oc_client
+
+        def grade_items(self, namespace):
+            return [
+                {
+                    "label": "Checking lab systems",
+                    "hosts": ["utility"],
+                    "task": None,
+                    "fatal": True,
+                },
+                {
+                    "label": "The 'worker01' node has the 'orgnet=true' label",
+                    "task": nodes.grade_node_label,
+                    "oc_client": self.oc_client,
+                    "name": "worker01",
+                    "label_key": "orgnet",
+                    "label_value": "true",
+                    "fatal": False,
+                },
+                {
+                    "label": "The 'web' ConfigMap exists",
+                    "task": check_configmap,
+                    "oc_client": self.oc_client,
+                    "namespace": namespace,
+                    "name": "web",
+                    "fatal": False,
+                },
+            ]
+
+    def load_lab(lab):
+        if lab != FakeLab.__LAB__:
+            raise LookupError("No lab class found for {}".format(lab))
+        return FakeLab
+
+    monkeypatch.setattr(gradeserver, "load_lab", load_lab)
+    api.add("configmaps", "web", namespace="student1")
+    service = gradeserver.GradeService(["fake-lab"], kinds=[("v1", "Node"), ("v1", "ConfigMap")])
+    yield service
+    service.stop()
+
+
+def test_grade_from_the_cache(api, service):
+    requests = len(api.requests)
+    result = service.grade("fake-lab", "student1")
+    assert result["result"] == "PASS"
+    assert [item["label"] for item in result["items"]] == [
+        "The 'worker01' node has the 'orgnet=true' label",
+        "The 'web' ConfigMap exists",
+    ]
+    result = service.grade("fake-lab", "student2")
+    assert result["result"] == "FAIL"
+    assert result["items"][1]["msgs"] == ["The 'web' ConfigMap does not exist"]
+    assert not [r for r in api.requests[requests:] if not r[1].get("watch")]
+
+
+def test_grade_follows_the_cluster(api, service):
+    assert service.grade("fake-lab", "student1")["result"] == "PASS"
+    api.label("nodes", "worker01", orgnet="false")
+    api.add("configmaps", "web", namespace="student2")
+    assert eventually(lambda: service.grade("fake-lab", "student1")["result"] == "FAIL")
+    assert eventually(lambda: service.grade("fake-lab", "student2")["items"][1]["result"] == "PASS")
+
+
+def test_http_service(service):
+    handler = type("Handler", (gradeserver.GradeRequestHandler,), {"service": service})
+    server = gradeserver.GradeServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}".format(server.server_address[1])
+
+    def get(path):
+        try:
+            with urllib.request.urlopen(url + path, timeout=5) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    try:
+        assert get("/healthz") == (200, {"status": "ok"})
+        status, body = get("/grade?lab=fake-lab&namespace=student1")
+        assert status == 200
+        assert (body["lab"], body["namespace"], body["result"]) == ("fake-lab", "student1", "PASS")
+        assert get("/grade")[0] == 400
+        assert get("/grade?lab=other-lab")[0] == 404
+        assert get("/other")[0] == 404
+    finally:
+        server.shutdown()
+        server.server_close()
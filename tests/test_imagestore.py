@@ -0,0 +1,45 @@
+import threading
+import urllib.request
+
+import pytest
+
+from labkit import imagestore
+
+
+@pytest.fixture
+def server(tmp_path):
+    store = imagestore.ImageStore(str(tmp_path / "store"))
+    source = tmp_path / "disk.qcow2"
+    source.write_bytes(b"0123456789")
+    digest = store.add(str(source), "images/my disk.qcow2", lab="review-cr3")
+    handler = type("Handler", (imagestore.ImageRequestHandler,), {"store": store})
+    httpd = imagestore.ImageServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1]), digest
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(url, headers=None):
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, b""
+
+
+def test_quoted_names_and_ranges(server):
+    url, digest = server
+    assert get(url + "/images/my%20disk.qcow2") == (200, b"0123456789")
+    assert get(url + "/images/my%20disk.qcow2?x=1", {"Range": "bytes=2-4"}) == (206, b"234")
+    assert get(url + "/images/my%20disk.qcow2", {"If-None-Match": '"sha256:{}"'.format(digest)})[0] == 304
+    assert get(url + "/images/other.qcow2")[0] == 404
+    assert get(url + "/images/%2e%2e/%2e%2e/etc/passwd")[0] == 404
+
+
+def test_images_current(server):
+    url, digest = server
+    assert imagestore.published_manifest(url, "review-cr3") == {"images/my disk.qcow2": digest}
+    assert imagestore.images_current(url, "review-cr3")
+    assert not imagestore.images_current(url, "review-cr1")
@@ -0,0 +1,121 @@
+import pytest
+
+from conftest import eventually
+from labkit.informer import CachedClient, Informer, Store, parse_selector
+
+
+def node_names(informer):
+    return sorted(obj["metadata"]["name"] for obj in informer.store.list())
+
+
+@pytest.mark.parametrize("selector, terms", [
+    (None, []),
+    ("", []),
+    ("a=b", [("a", "=", "b")]),
+    ("a==b, c!=d", [("a", "=", "b"), ("c", "!=", "d")]),
+    ("a,!b", [("a", "exists", None), ("b", "!", None)]),
+    ("node-role.kubernetes.io/worker=", [("node-role.kubernetes.io/worker", "=", "")]),
+])
+def test_parse_selector(selector, terms):
+    assert parse_selector(selector) == terms
+
+
+@pytest.mark.parametrize("selector", [
+    "env in (prod,qa)",
+    "env notin (prod)",
+    "a=b,env in (prod)",
+    "env in",
+    "a b=c",
+])
+def test_parse_selector_rejects_set_based(selector):
+    with pytest.raises(ValueError):
+        parse_selector(selector)
+
+
+def test_store_list():
+    store = Store()
+    store.replace([
+        {"metadata": {"name": "a", "namespace": "x", "labels": {"app": "web"}}},
+        {"metadata": {"name": "b", "namespace": "x", "labels": {"app": "db"}}},
+        {"metadata": {"name": "c", "namespace": "y", "labels": {"app": "web"}}},
+    ])
+    assert [o["metadata"]["name"] for o in store.list("x")] == ["a", "b"]
+    assert [o["metadata"]["name"] for o in store.list(label_selector="app=web")] == ["a", "c"]
+    assert [o["metadata"]["name"] for o in store.list("x", "app!=web")] == ["b"]
+    store.delete({"metadata": {"name": "a", "namespace": "x"}})
+    assert store.list(label_selector="app=web")[0]["metadata"]["name"] == "c"
+
+
+def test_informer_follows_changes(api, oc_client):
+    informer = Informer(oc_client, "v1", "Node")
+    assert informer.start(timeout=5)
+    try:
+        assert node_names(informer) == ["worker01", "worker02", "worker03"]
+        lists = api.count("/api/v1/nodes")
+
+        api.add("nodes", "worker04")
+        api.label("nodes", "worker03", orgnet="true")
+        api.delete("nodes", "worker01")
+        assert eventually(lambda: node_names(informer) == ["worker02", "worker03", "worker04"])
+        assert eventually(lambda: len(informer.store.list(label_selector="orgnet=true")) == 2)
+        assert api.count("/api/v1/nodes") == lists
+    finally:
+        informer.stop()
+
+
+def test_informer_relists_when_the_version_expires(api, oc_client):
+    informer = Informer(oc_client, "v1", "Node")
+    assert informer.start(timeout=5)
+    try:
+        lists = api.count("/api/v1/nodes")
+        # The change is only visible to a new LIST
+        api.add("nodes", "worker04", event=False)
+        api.compact()
+        assert eventually(lambda: "worker04" in node_names(informer))
+        assert api.count("/api/v1/nodes") == lists + 1
+    finally:
+        informer.stop()
+
+
+def test_cached_client_reads_from_the_cache(api, oc_client):
+    api.add("configmaps", "web", namespace="ns1", labels={"app": "web"})
+    api.add("configmaps", "db", namespace="ns2", labels={"app": "db"})
+    client = CachedClient(oc_client, [("v1", "Node"), ("v1", "ConfigMap")])
+    assert client.start(timeout=5)
+    try:
+        before = list(api.requests)
+        nodes = client.resources.get(api_version="v1", kind="Node")
+        configmaps = client.resources.get(api_version="v1", kind="ConfigMap")
+        assert nodes.get(name="worker01").metadata.name == "worker01"
+        assert len(nodes.get(label_selector="orgnet=true").items) == 2
+        assert [cm.metadata.name for cm in configmaps.get(namespace="ns1").items] == ["web"]
+        assert configmaps.get(name="db", namespace="ns2").metadata.labels.app == "db"
+        assert not [r for r in api.requests[len(before):] if not r[1].get("watch")]
+    finally:
+        client.stop()
+
+
+def test_cached_client_sends_set_based_selectors_to_the_server(api, oc_client):
+    client = CachedClient(oc_client, [("v1", "Node")])
+    assert client.start(timeout=5)
+    try:
+        lists = api.count("/api/v1/nodes")
+        nodes = client.resources.get(api_version="v1", kind="Node")
+        nodes.get(label_selector="orgnet in (true)")
+        assert api.count("/api/v1/nodes") == lists + 1
+    finally:
+        client.stop()
+
+
+def test_store_label_version():
+    store = Store()
+    store.update({"metadata": {"name": "a", "labels": {"app": "web"}, "resourceVersion": "1"}})
+    version = store.label_version
+    store.update({"metadata": {"name": "a", "labels": {"app": "web"}, "resourceVersion": "2"}})
+    assert store.label_version == version
+    store.update({"metadata": {"name": "a", "labels": {"app": "db"}, "resourceVersion": "3"}})
+    assert store.label_version == version + 1
+    store.delete({"metadata": {"name": "missing"}})
+    assert store.label_version == version + 1
+    store.delete({"metadata": {"name": "a"}})
+    assert store.label_version == version + 2
@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from kubernetes.dynamic.exceptions import ForbiddenError, GoneError
+
+from labkit import inventory
+
+
+class FakeResource:
+    def __init__(self, kind, group=""):
+        self.kind = kind
+        self.group = group
+
+    def path(self, namespace=None):
+        return "/" + self.kind
+
+
+class Response:
+    def __init__(self, page):
+        self.data = json.dumps(page)
+
+
+class Error:
+    def __init__(self, status):
+        self.status = status
+        self.reason = "error"
+        self.body = "{}"
+        self.headers = {}
+
+
+def item(namespace, name, version="1"):
+    return {"metadata": {"namespace": namespace, "name": name, "resourceVersion": version}}
+
+
+class FakeClient:
+    """
+    Serve the items of each kind two per page. ``fail`` maps a kind to the
+    exceptions raised, one per request, before its second page.
+    """
+
+    def __init__(self, items, fail=None):
+        self.items = items
+        self.fail = fail or {}
+        self.requests = []
+
+    def request(self, method, path, limit, _continue, header_params, serialize):
+        kind = path[1:]
+        self.requests.append((kind, _continue))
+        start = int(_continue or 0)
+        if start and self.fail.get(kind):
+            raise self.fail[kind].pop(0)
+        items = self.items[kind][start:start + limit]
+        token = str(start + limit) if start + limit < len(self.items[kind]) else None
+        return Response({"items": items, "metadata": {"continue": token}})
+
+
+def snapshot(client, path, kinds):
+    resources = [FakeResource(kind) for kind in kinds]
+    incomplete = []
+    return inventory.write_snapshot(
+        str(path), inventory.iter_rows(client, resources, page_size=2, incomplete=incomplete), incomplete
+    )
+
+
+def test_expired_continue_token_lists_the_kind_again(tmp_path):
+    pods = [item("a", "p{}".format(i)) for i in range(5)]
+    client = FakeClient({"Pod": pods}, fail={"Pod": [GoneError(Error(410))]})
+    path = tmp_path / "snapshot.tsv.gz"
+    assert snapshot(client, path, ["Pod"]) == 5
+    assert [row[2] for row in inventory.read_snapshot(str(path))] == ["p0", "p1", "p2", "p3", "p4"]
+    assert inventory.incomplete_kinds(str(path)) == set()
+    assert client.requests[:3] == [("Pod", None), ("Pod", "2"), ("Pod", None)]
+
+
+def test_kind_that_cannot_be_listed_is_incomplete(tmp_path):
+    items = {"ConfigMap": [item("a", "c0"), item("a", "c1"), item("b", "c2")],
+             "Secret": [item("a", "s0"), item("a", "s1"), item("a", "s2")]}
+    before = tmp_path / "before.tsv.gz"
+    assert snapshot(FakeClient(items), before, ["ConfigMap", "Secret"]) == 6
+
+    failing = FakeClient(items, fail={"Secret": [ForbiddenError(Error(403))]})
+    after = tmp_path / "after.tsv.gz"
+    assert snapshot(failing, after, ["ConfigMap", "Secret"]) == 3
+    assert inventory.incomplete_kinds(str(after)) == {"Secret"}
+
+    skip = inventory.incomplete_kinds(str(before)) | inventory.incomplete_kinds(str(after))
+    assert list(inventory.diff(inventory.read_snapshot(str(before)),
+                               inventory.read_snapshot(str(after)), skip=skip)) == []
+    assert inventory.main(["diff", str(before), str(after)]) == 0
+
+
+def test_errors_raise_without_an_incomplete_list():
+    client = FakeClient({"Pod": [item("a", "p{}".format(i)) for i in range(3)]},
+                        fail={"Pod": [GoneError(Error(410))] * inventory.LIST_ATTEMPTS})
+    with pytest.raises(GoneError):
+        list(inventory.iter_rows(client, [FakeResource("Pod")], page_size=2))
+
+
+def test_unsorted_kind_is_sorted(tmp_path):
+    client = FakeClient({"Pod": [item("b", "x"), item("a-b", "x"), item("a", "x")]})
+    path = tmp_path / "snapshot.tsv.gz"
+    snapshot(client, path, ["Pod"])
+    rows = list(inventory.read_snapshot(str(path)))
+    assert rows == sorted(rows, key=inventory.row_key)
@@ -0,0 +1,25 @@
+from conftest import eventually
+from labkit import nodes
+from labkit.informer import CachedClient
+
+
+def test_inventory_is_rebuilt_only_when_labels_change(api, oc_client):
+    client = CachedClient(oc_client, [("v1", "Node")])
+    assert client.start(timeout=5)
+    informer = client.informers[("v1", "Node")]
+    try:
+        inventory = nodes.get_inventory(client)
+        assert inventory.with_label("orgnet", "true") == {"worker01", "worker02"}
+
+        # A status update, like a kubelet heartbeat, keeps the index
+        version = informer.resource_version
+        api.label("nodes", "worker01", orgnet="true")
+        assert eventually(lambda: informer.resource_version != version)
+        assert nodes.get_inventory(client) is inventory
+
+        api.label("nodes", "worker03", orgnet="true")
+        assert eventually(lambda: nodes.get_inventory(client) is not inventory)
+        assert nodes.get_inventory(client).with_label("orgnet", "true") == {
+            "worker01", "worker02", "worker03"}
+    finally:
+        client.stop()
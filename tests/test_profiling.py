@@ -0,0 +1,55 @@
+import json
+import subprocess
+
+from labkit import gradeserver, profiling
+from labkit.informer import CachedClient
+
+
+def busy(seconds):
+    deadline = profiling.time.time() + seconds
+    total = 0
+    while profiling.time.time() < deadline:
+        total += sum(range(1000))
+    return total
+
+
+def test_profile_a_verb_against_the_stub(api, oc_client, monkeypatch, tmp_path):
+    class FakeLab:
+        __LAB__ = "fake-lab"
+
+        def __init__(self):
+            # An informer thread blocked on its watch stream, which is idle
+            self.oc_client = CachedClient(oc_client, [("v1", "Node")])
+            self.oc_client.start(timeout=5)
+
+        def grade(self):
+            try:
+                nodes = oc_client.resources.get(api_version="v1", kind="Node")
+                nodes.get()
+                nodes.get(name="worker01")
+                subprocess.run(["true"], check=True)
+                busy(0.3)
+            finally:
+                self.oc_client.stop()
+
+    monkeypatch.setattr(gradeserver, "load_lab", lambda lab: FakeLab)
+    path = tmp_path / "profile.json"
+    assert profiling.main(["grade", "fake-lab", "--profile", str(path)]) == 0
+
+    report = json.loads(path.read_text())
+    assert report["info"] == {"lab": "fake-lab", "verb": "grade"}
+
+    paths = {entry["path"] for entry in report["http"]["requests"]}
+    assert {"/api/v1/nodes", "/api/v1/nodes/worker01"} <= paths
+    assert all(entry["status"] == 200 for entry in report["http"]["requests"])
+
+    assert report["subprocesses"]["count"] == 1
+    assert report["subprocesses"]["processes"][0]["args"] == ["true"]
+    assert report["subprocesses"]["processes"][0]["returncode"] == 0
+
+    stacks = report["stacks"]
+    assert stacks["interval"] == profiling.SAMPLE_INTERVAL
+    assert stacks["samples"] > 0 and stacks["idle"] > 0
+    assert any(entry["function"] == "test_profiling.py:busy" for entry in stacks["top"])
+    # The informer thread waiting on its stream is not sampled
+    assert not any(line.split(" ")[0].endswith("socket.py:readinto") for line in stacks["collapsed"])
@@ -0,0 +1,93 @@
+import os
+import threading
+import collections
+
+import pytest
+
+from labkit import solutions
+
+
+SOLUTIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "solutions")
+
+LABS = sorted(os.listdir(SOLUTIONS_DIR))
+
+
+def key(obj):
+    return obj["apiVersion"], obj["kind"], obj["metadata"].get("namespace"), obj["metadata"]["name"]
+
+
+@pytest.mark.parametrize("lab", LABS)
+def test_load_shipped_solution(lab):
+    objects = solutions.load_solution(os.path.join(SOLUTIONS_DIR, lab))
+    assert objects
+    for obj in objects:
+        assert obj["apiVersion"] and obj["kind"] and obj["metadata"]["name"]
+    duplicates = [k for k, count in collections.Counter(map(key, objects)).items() if count > 1]
+    assert duplicates == []
+
+
+def test_versioned_files_load_the_latest_version():
+    directory = os.path.join(SOLUTIONS_DIR, "declarative-manifests")
+    latest = [
+        obj
+        for name in ("database-v1.1.1.yaml", "exoplanets-v1.1.1.yaml")
+        for obj in solutions.read_yaml_documents(os.path.join(directory, name))
+        if isinstance(obj, dict) and "kind" in obj
+    ]
+    objects = solutions.load_solution(directory)
+    assert len(objects) == len(latest)
+    assert {key(obj): obj for obj in objects} == {key(obj): obj for obj in latest}
+
+
+def test_versioned_directories_are_layered():
+    objects = solutions.load_solution(os.path.join(SOLUTIONS_DIR, "declarative-kustomize"))
+    assert len({key(obj) for obj in objects}) == len(objects)
+
+
+class FakeResource:
+    def __init__(self, kind, namespaced):
+        self.kind = kind
+        self.namespaced = namespaced
+
+
+class FakeClient:
+    def __init__(self):
+        self.lookups = []
+        self.applied = []
+        self.resources = self
+        self._lock = threading.Lock()
+
+    def get(self, api_version, kind):
+        self.lookups.append(threading.current_thread())
+        return FakeResource(kind, kind != "Namespace")
+
+    def server_side_apply(self, resource, body, name, namespace, field_manager, force_conflicts):
+        with self._lock:
+            self.applied.append(body)
+
+
+def configmap(name, value, namespace=None):
+    obj = {"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": name}, "data": {"v": value}}
+    if namespace:
+        obj["metadata"]["namespace"] = namespace
+    return obj
+
+
+def test_apply_objects_dedupes_and_orders():
+    client = FakeClient()
+    objects = [
+        configmap("app", "1"),
+        {"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "lab", "namespace": "x"}},
+        configmap("app", "2", namespace="lab"),
+        configmap("app", "3", namespace="other"),
+    ]
+    applied = solutions.apply_objects(client, objects, namespace="lab")
+    assert [(o["kind"], o["metadata"].get("namespace"), o.get("data")) for o in applied] == [
+        ("Namespace", None, None),
+        ("ConfigMap", "lab", {"v": "2"}),
+        ("ConfigMap", "other", {"v": "3"}),
+    ]
+    assert len(client.applied) == 3
+    assert set(client.lookups) == {threading.main_thread()}
+    # The objects of the caller are left untouched
+    assert objects[0]["metadata"] == {"name": "app"}